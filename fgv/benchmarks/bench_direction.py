@@ -0,0 +1,106 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# The modules of the pipeline are imported as "src.<module>", from the fgv folder, and the reference kernels from the tests folder
+FGV_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FGV_FOLDER)
+sys.path.insert(0, os.path.join(FGV_FOLDER, "tests"))
+
+import reference_kernels
+import src.utils as utils
+
+def long_unknown_runs(rng, num_points):
+    """
+    Stationary points in the route (with unknown direction) until the very end, where a single trip resolves the direction of all of them.
+    It's the worst case of the previous implementation, which evaluated the mean of the last N distances for every point.
+    """
+
+    gps_distance_dir_0 = np.full(num_points, 5000.0)
+    gps_distance_dir_0[-100:] += np.arange(100) * 150.0
+
+    return np.ones(num_points, dtype=bool), gps_distance_dir_0.astype(np.float32), (20000.0 - gps_distance_dir_0).astype(np.float32), 500
+
+def windows_on_tolerance(rng, num_points, N):
+    """
+    Distances growing by a constant step, so the difference of the means in every window is the tolerance, far from zero (where the rounding of the sums is larger).
+    Every point is evaluated (no terminal tolerance), and falls within the rounding bound of the tolerance, so it's the worst case of the rolling sums.
+    """
+
+    gps_distance_dir_0 = 25000.0 + 200.0 / max(N - 1, 1) * np.arange(num_points)
+
+    return np.ones(num_points, dtype=bool), gps_distance_dir_0.astype(np.float32), np.full(num_points, 25000.0, dtype=np.float32), np.inf
+
+def realistic_trips(rng, num_points):
+    """
+    A bus going back and forth on a route, with noise, stops and points out of the route.
+    """
+
+    route_length = 15000.0
+    steps = rng.exponential(80.0, num_points) * rng.choice([0.0, 1.0], num_points, p=[0.2, 0.8])
+    position = np.cumsum(steps) % (2 * route_length)
+
+    gps_distance_dir_0 = np.where(position < route_length, position, 2 * route_length - position) + rng.normal(0.0, 20.0, num_points)
+    gps_distance_dir_1 = route_length - gps_distance_dir_0 + rng.normal(0.0, 20.0, num_points)
+
+    return rng.random(num_points) > 0.05, gps_distance_dir_0.astype(np.float32), gps_distance_dir_1.astype(np.float32), 500
+
+def time_call(function, *args, repeat=3):
+    """
+    Time a function, keeping the best of some runs.
+
+    Returns:
+        tuple: Best time in seconds and the result of the last run.
+    """
+
+    best_time = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    return best_time, result
+
+def main(num_points, windows, repeat, seed):
+    rng = np.random.default_rng(seed)
+
+    cases = {
+        "long unknown runs": lambda N: long_unknown_runs(rng, num_points),
+        "windows on the tolerance": lambda N: windows_on_tolerance(rng, num_points, N),
+        "realistic trips": lambda N: realistic_trips(rng, num_points),
+    }
+
+    mismatches = 0
+
+    print(f"Points: {num_points}")
+    for name, build_case in cases.items():
+        for N in windows:
+            gps_in_route, gps_distance_dir_0, gps_distance_dir_1, terminal_tolerance = build_case(N)
+
+            # Compile the kernels for the types of the case before timing them
+            reference_kernels.assign_direction(gps_in_route[:N + 1], gps_distance_dir_0[:N + 1], gps_distance_dir_1[:N + 1], N, terminal_tolerance)
+            utils.assign_direction(gps_in_route[:N + 1], gps_distance_dir_0[:N + 1], gps_distance_dir_1[:N + 1], N, terminal_tolerance)
+
+            reference_time, expected = time_call(reference_kernels.assign_direction, gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N, terminal_tolerance, repeat=repeat)
+            new_time, result = time_call(utils.assign_direction, gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N, terminal_tolerance, repeat=repeat)
+
+            # The directions (and how they were inferred) must be the same
+            same = np.array_equal(result[0], expected[0]) and np.array_equal(result[1], expected[1])
+            mismatches += not same
+
+            print(f"{name:<25} N={N:<3} reference: {reference_time * 1000:8.1f} ms, new: {new_time * 1000:8.1f} ms ({reference_time / new_time:5.1f}x){'' if same else ' DIFFERENT RESULTS!'}")
+
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the direction inference against the previous implementation, on adversarial and realistic traces.")
+    parser.add_argument("--points", type=int, default=1000000, help="Number of points of each trace.")
+    parser.add_argument("--windows", type=int, nargs="+", default=[3, 5, 50], help="Numbers of last points (N) used to infer the direction.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs timed for each case (the best one is kept).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random traces.")
+    args = parser.parse_args()
+
+    sys.exit(1 if main(args.points, args.windows, args.repeat, args.seed) else 0)
@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import time
+
+# Numba can't use more threads than the ones launched on import, so they are set from the arguments before importing it
+parser = argparse.ArgumentParser(description="Benchmark the scaling of the parallel projection kernels with the number of threads, on a full day of GPS points of a GTFS shape.")
+parser.add_argument("gtfs_folder", nargs="?", default="./data/gtfs_data", help="Folder with the GTFS data (with the shapes.txt file).")
+parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="Numbers of threads benchmarked.")
+parser.add_argument("--shape", default=None, help="Identifier of the shape the points are scattered around (the longest one by default).")
+parser.add_argument("--buses", type=int, default=100, help="Number of buses of the route, each one sending a point every 30 seconds for a day.")
+parser.add_argument("--noise", type=float, default=30.0, help="Standard deviation in meters of the distance of the points to the shape.")
+parser.add_argument("--repeat", type=int, default=3, help="Number of runs timed for each number of threads (the best one is kept).")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the random points.")
+args = parser.parse_args()
+
+os.environ.setdefault("NUMBA_NUM_THREADS", str(max(args.threads)))
+
+import numba
+import numpy as np
+import pandas as pd
+
+# The modules of the pipeline are imported as "src.<module>", from the fgv folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.utils as utils
+
+def load_shape(gtfs_folder, shape_id=None):
+    """
+    Load a GTFS shape, in the local metric frame.
+
+    Args:
+        gtfs_folder (str): Path to the folder containing the GTFS data files.
+        shape_id (str, optional): Identifier of the shape. Defaults to None, which loads the shape with the most points.
+
+    Returns:
+        tuple: Identifier of the shape, and its segments with shape (M, 2, 2) and segment distances with shape (M, 2), as np.float32.
+    """
+
+    shapes = pd.read_csv(f"{gtfs_folder}/shapes.txt", dtype={"shape_id": str})
+
+    if shape_id is None:
+        shape_id = shapes["shape_id"].value_counts().index[0]
+
+    shape = shapes[shapes["shape_id"] == shape_id].sort_values("shape_pt_sequence")
+    assert len(shape) >= 2, f"The shape {shape_id} was not found in the GTFS data!"
+
+    segments, segment_distances = utils.build_shape_segments(utils.project_to_local_meters(shape["shape_pt_lon"], shape["shape_pt_lat"]).astype(np.float32),
+                                                             shape["shape_dist_traveled"].to_numpy(np.float32),
+                                                             np.zeros(len(shape), dtype=np.int64))
+
+    return shape_id, segments, segment_distances
+
+def time_call(function, *args, repeat=3):
+    """
+    Time a function, keeping the best of some runs.
+
+    Returns:
+        tuple: Best time in seconds and the result of the last run.
+    """
+
+    best_time = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    return best_time, result
+
+def main():
+    rng = np.random.default_rng(args.seed)
+
+    shape_id, segments, segment_distances = load_shape(args.gtfs_folder, args.shape)
+    segment_grid = utils.build_segment_grid(segments)
+
+    # A point every 30 seconds of each bus, for a day, scattered around the shape
+    num_points = args.buses * 2880
+    points = segments[rng.integers(0, len(segments), num_points), 0].astype(np.float64) + rng.normal(0.0, args.noise, (num_points, 2))
+
+    print(f"Shape {shape_id}: {len(segments)} segments, {num_points} points ({args.buses} buses), {os.cpu_count()} cores, {numba.config.NUMBA_NUM_THREADS} threads launched by numba")
+
+    kernels = {
+        "projection": (utils.closest_projection, utils.closest_projection_parallel, (points, segments, segment_grid)),
+        "projection with distance": (utils.closest_projection_with_distance, utils.closest_projection_with_distance_parallel, (points, segments, segment_distances, segment_grid)),
+    }
+
+    mismatches = 0
+
+    for name, (serial_kernel, parallel_kernel, kernel_args) in kernels.items():
+        # Compile the kernels before timing them
+        serial_kernel(points[:1], *kernel_args[1:])
+        parallel_kernel(points[:1], *kernel_args[1:])
+
+        serial_time, expected = time_call(serial_kernel, *kernel_args, repeat=args.repeat)
+        print(f"{name}: serial {serial_time * 1000:.1f} ms")
+
+        for num_threads in args.threads:
+            if num_threads > numba.config.NUMBA_NUM_THREADS:
+                print(f"{name}: {num_threads} threads skipped (NUMBA_NUM_THREADS is {numba.config.NUMBA_NUM_THREADS})")
+                continue
+
+            utils.set_num_threads(num_threads)
+            parallel_time, result = time_call(parallel_kernel, *kernel_args, repeat=args.repeat)
+
+            # The results must be bit-identical to the serial kernel
+            same = all(np.array_equal(array, expected_array) for array, expected_array in zip(result, expected))
+            mismatches += not same
+
+            print(f"{name}: {num_threads} threads {parallel_time * 1000:.1f} ms ({serial_time / parallel_time:.2f}x the serial kernel){'' if same else ' DIFFERENT RESULTS!'}")
+
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,118 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# The modules of the pipeline are imported as "src.<module>", from the fgv folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.utils as utils
+
+def load_shape_segments(gtfs_folder):
+    """
+    Load the segments of each GTFS shape, in the local metric frame.
+
+    Args:
+        gtfs_folder (str): Path to the folder containing the GTFS data files.
+
+    Returns:
+        dict: Array of segments with shape (M, 2, 2) (np.float32) of each shape id.
+    """
+
+    shapes = pd.read_csv(f"{gtfs_folder}/shapes.txt", dtype={"shape_id": "category"})
+    shapes = shapes.sort_values(["shape_id", "shape_pt_sequence"], kind="stable")
+
+    shape_points = utils.project_to_local_meters(shapes["shape_pt_lon"], shapes["shape_pt_lat"]).astype(np.float32)
+    shape_distances = shapes["shape_dist_traveled"].to_numpy(np.float32)
+    shape_codes = shapes["shape_id"].cat.codes.to_numpy()
+
+    # Split the points by shape (they are contiguous after sorting)
+    bounds = np.flatnonzero(np.diff(shape_codes)) + 1
+    starts, ends = np.concatenate(([0], bounds)), np.concatenate((bounds, [len(shapes)]))
+
+    shape_segments = {}
+    for start, end in zip(starts, ends):
+        segments, _ = utils.build_shape_segments(shape_points[start:end], shape_distances[start:end], shape_codes[start:end])
+        shape_segments[shapes["shape_id"].iloc[start]] = segments
+
+    return shape_segments
+
+def time_call(function, *args, repeat=3):
+    """
+    Time a function, keeping the best of some runs.
+
+    Returns:
+        tuple: Best time in seconds and the result of the last run.
+    """
+
+    best_time = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    return best_time, result
+
+def main(gtfs_folder, num_points, num_shapes, noise_meters, repeat, seed):
+    rng = np.random.default_rng(seed)
+
+    print(f"Loading the shapes from {gtfs_folder}...")
+    shape_segments = load_shape_segments(gtfs_folder)
+
+    # Benchmark a sample of the shapes (or all of them)
+    shape_ids = list(shape_segments)
+    if num_shapes is not None and num_shapes < len(shape_ids):
+        shape_ids = [shape_ids[i] for i in sorted(rng.choice(len(shape_ids), num_shapes, replace=False))]
+
+    # Compile the kernels before timing them
+    segments = shape_segments[shape_ids[0]]
+    utils.closest_projection_brute_force(segments[:1, 0].astype(np.float64), segments)
+    utils.closest_projection_indexed(segments[:1, 0].astype(np.float64), segments, utils.build_segment_grid(segments))
+
+    total_segments, total_build_time, total_brute_force_time, total_indexed_time, mismatches = 0, 0.0, 0.0, 0.0, 0
+
+    for shape_id in shape_ids:
+        segments = shape_segments[shape_id]
+        if len(segments) == 0:
+            continue
+
+        # Points scattered around the shape, as noisy GPS data
+        points = segments[rng.integers(0, len(segments), num_points), 0].astype(np.float64) + rng.normal(0.0, noise_meters, (num_points, 2))
+
+        build_time, segment_grid = time_call(utils.build_segment_grid, segments, repeat=repeat)
+        brute_force_time, (expected_distances, expected_indexes) = time_call(utils.closest_projection_brute_force, points, segments, repeat=repeat)
+        indexed_time, (distances, indexes) = time_call(utils.closest_projection_indexed, points, segments, segment_grid, repeat=repeat)
+
+        # The indexed search must find the same segments and distances
+        if not (np.array_equal(indexes, expected_indexes) and np.array_equal(distances, expected_distances)):
+            mismatches += 1
+            print(f"Shape {shape_id}: the indexed search differs from the brute force search!")
+
+        total_segments += len(segments)
+        total_build_time += build_time
+        total_brute_force_time += brute_force_time
+        total_indexed_time += indexed_time
+
+    num_queries = len(shape_ids) * num_points
+    print(f"Shapes: {len(shape_ids)}, segments: {total_segments} (mean of {total_segments / len(shape_ids):.0f} per shape), points per shape: {num_points}")
+    print(f"Brute force: {total_brute_force_time:.3f}s ({total_brute_force_time / num_queries * 1e6:.2f} us per point)")
+    print(f"Indexed: {total_indexed_time:.3f}s ({total_indexed_time / num_queries * 1e6:.2f} us per point) + {total_build_time:.3f}s building the grids")
+    print(f"Speedup: {total_brute_force_time / total_indexed_time:.1f}x (with the grids: {total_brute_force_time / (total_indexed_time + total_build_time):.1f}x)")
+    print(f"Shapes with different results: {mismatches}")
+
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the indexed closest projection against the brute force search, on the GTFS shapes.")
+    parser.add_argument("gtfs_folder", nargs="?", default="./data/gtfs_data", help="Folder with the GTFS data (with the shapes.txt file).")
+    parser.add_argument("--points", type=int, default=10000, help="Number of points projected on each shape.")
+    parser.add_argument("--shapes", type=int, default=None, help="Number of shapes sampled (all of them by default).")
+    parser.add_argument("--noise", type=float, default=100.0, help="Standard deviation in meters of the distance of the points to the shape.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs timed for each shape (the best one is kept).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random points.")
+    args = parser.parse_args()
+
+    sys.exit(1 if main(args.gtfs_folder, args.points, args.shapes, args.noise, args.repeat, args.seed) else 0)
@@ -0,0 +1,105 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+# The modules of the pipeline are imported as "src.<module>", from the fgv folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.gtfs_handler as gtfs_handler
+import src.utils as utils
+
+def time_call(function, *args, repeat=3):
+    """
+    Time a function, keeping the best of some runs.
+
+    Returns:
+        tuple: Best time in seconds and the result of the last run.
+    """
+
+    best_time = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    return best_time, result
+
+def match_route(gtfs, points_by_direction):
+    """
+    Match the points of each direction of the filtered route, as "GPSHandler.project_on_route": building the spatial index of the segments and projecting the points with their distances.
+
+    Returns:
+        dict: Distances from the route start of the points of each direction.
+    """
+
+    distances_from_start = {}
+    for direction_id, points in points_by_direction.items():
+        route_segments = gtfs.get_route_segments_by_direction(direction_id)
+        segment_grid = utils.build_segment_grid(route_segments)
+        _, _, _, distances_from_start[direction_id] = utils.closest_projection_with_distance(points, route_segments, gtfs.get_route_segment_distances_by_direction(direction_id), segment_grid)
+
+    return distances_from_start
+
+def main(gtfs_folder, tolerance, routes, num_points, noise_meters, repeat, seed):
+    rng = np.random.default_rng(seed)
+
+    gtfs = gtfs_handler.GTFSHandler(gtfs_folder)
+    simplified_gtfs = gtfs_handler.GTFSHandler(gtfs_folder, simplify_tolerance_meters=tolerance)
+    report = simplified_gtfs.get_simplification_report()
+
+    # Benchmark the given routes (or a sample of them)
+    if not routes:
+        routes = list(rng.choice(report.index[report['num_segments'] > 0], min(10, len(report)), replace=False))
+
+    # Compile the kernels before timing them
+    segments = np.zeros((1, 2, 2), dtype=np.float32)
+    utils.closest_projection_with_distance(np.zeros((1, 2)), segments, np.zeros((1, 2), dtype=np.float32), utils.build_segment_grid(segments))
+
+    print(f"{'route':>8} {'segments':>9} {'simplified':>10} {'reduction':>9} {'time (ms)':>10} {'simplified':>10} {'speedup':>8} {'diff p50 (m)':>12} {'diff p99 (m)':>12}")
+
+    total_time, total_simplified_time = 0.0, 0.0
+    for route in routes:
+        # Select the route in both handlers (without their progress messages, to keep the table readable)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gtfs.filter_by_route(route)
+            simplified_gtfs.filter_by_route(route)
+
+        # Points scattered around the original segments of each direction, as a day of noisy GPS data of the route
+        points_by_direction = {}
+        for direction_id in gtfs.get_route_directions():
+            route_segments = gtfs.get_route_segments_by_direction(direction_id)
+            if len(route_segments) > 0:
+                points_by_direction[direction_id] = route_segments[rng.integers(0, len(route_segments), num_points), 0].astype(np.float64) + rng.normal(0.0, noise_meters, (num_points, 2))
+
+        route_time, distances_from_start = time_call(match_route, gtfs, points_by_direction, repeat=repeat)
+        simplified_time, simplified_distances_from_start = time_call(match_route, simplified_gtfs, points_by_direction, repeat=repeat)
+
+        # Change of the distances from the route start of the points (the points between overlapping shapes of a direction may be matched to another shape, with other distances)
+        differences = np.concatenate([np.abs(simplified_distances_from_start[direction_id] - distances_from_start[direction_id]) for direction_id in points_by_direction] + [np.zeros(1)])
+        median_difference, p99_difference = np.percentile(differences, [50, 99])
+
+        total_time += route_time
+        total_simplified_time += simplified_time
+
+        route_report = report.loc[route]
+        print(f"{route:>8} {int(route_report['num_segments']):>9} {int(route_report['num_simplified_segments']):>10} {route_report['reduction']:>8.1f}x {route_time * 1000:>10.1f} {simplified_time * 1000:>10.1f} {route_time / simplified_time:>7.2f}x {median_difference:>12.2f} {p99_difference:>12.2f}")
+
+    print(f"Matching of {len(routes)} routes with a tolerance of {tolerance} meters: {total_time * 1000:.1f} -> {total_simplified_time * 1000:.1f} ms ({total_time / total_simplified_time:.2f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the matching of GPS points on the simplified route shapes, for each route.")
+    parser.add_argument("gtfs_folder", nargs="?", default="./data/gtfs_data", help="Folder with the GTFS data.")
+    parser.add_argument("--tolerance", type=float, default=2.0, help="Tolerance in meters of the simplification.")
+    parser.add_argument("--routes", nargs="*", default=None, help="Short names of the routes benchmarked (10 random routes by default).")
+    parser.add_argument("--points", type=int, default=20000, help="Number of points matched on each direction of a route.")
+    parser.add_argument("--noise", type=float, default=30.0, help="Standard deviation in meters of the distance of the points to the route.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs timed for each route (the best one is kept).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random points and routes.")
+    args = parser.parse_args()
+
+    main(args.gtfs_folder, args.tolerance, args.routes, args.points, args.noise, args.repeat, args.seed)
@@ -1,3 +1,5 @@
+import src.manifest_handler as manifest_handler
+import src.plotting as plotting
 import src.utils as utils
 import src.gtfs_handler as gtfs_handler
 import src.gps_handler as gps_handler
@@ -6,36 +8,71 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 
+import argparse
+import json
+import multiprocessing
 import os
 import re
 import shutil
 
+from concurrent.futures import ProcessPoolExecutor
 from numba import jit
 from tqdm import tqdm
 
 import time
 
-def define_output_path(base_path, folder_name):
-    # Define the output path for the file
-    file_output_path = base_path + folder_name + "/"
-    # Create folder if it doesn't exist
-    if not os.path.exists(file_output_path):
-        os.makedirs(file_output_path)
-        return file_output_path
-    else:
-        # If the path already exists, skip the file
-        return None
-
-# Get the start time of the loading process
-loading_start_time = time.time()
-
 # Define if the output must be overwritten or if the data must be appended to the existing files
-OVERWRITE = True
+# When appending, only the buses of each day and route not processed yet (or processed from other data, or not finished) are processed, according to the manifest
+# Overwriting deletes the whole output folder, including the manifest, so every bus is processed again
+OVERWRITE = False
+
+# Define the version of the pipeline, recorded in the manifest with each bus processed (increase it when the processing changes, so all the buses are processed again)
+PIPELINE_VERSION = 1
 
 # Define min and max boundaries for number of points in a route for a bus to be considered
 MIN_POINTS = 300
 MAX_POINTS = 2880
 
+# Define the number of threads used to project the GPS points on the routes (None uses all the cores, 1 keeps the serial kernels)
+NUM_THREADS = 1
+
+# Define the number of processes that process the (day, route) pairs (1 processes them in this process, one after the other)
+# It can also be set with the --workers argument
+NUM_WORKERS = 1
+
+# Define if the workers share the route data compiled into memory-mapped arrays by this process, instead of each one loading the GTFS data
+SHARED_ROUTE_ARRAYS = True
+
+# Define if the GPS data files are converted (once) to compact archive files, which are processed instead of the CSV files
+GPS_ARCHIVE = False
+
+# Define if the GPS points are matched around the segment matched to the previous point (searching the whole route only when needed)
+INCREMENTAL_MATCHING = False
+
+# Define the tolerance in meters used to simplify the route shapes (None keeps every shape point)
+# A shape point is only removed if it's within the tolerance from the simplified shape, and if the distance from the route start interpolated for it differs by at most the tolerance from its own
+SHAPE_SIMPLIFY_TOLERANCE = None
+
+# Define the windows (in minutes) of the mean speed features, and if their speed variances and stop fractions are also generated
+SPEED_WINDOWS = (1, 3, 5)
+SPEED_COMPANION_FEATURES = False
+
+# Define the format of the output data: "csv" (files of each bus, and training and validation files of each route) or "parquet" (training and validation datasets partitioned by date and route, with a row group per route)
+OUTPUT_FORMAT = "csv"
+PARQUET_COMPRESSION = "zstd"
+
+# Define the number of writes of output files that can wait to be run in the background while the next buses are processed (0 writes them synchronously)
+WRITE_QUEUE_SIZE = 8
+
+# Define the number of processes that render the plots while the data is processed (0 renders them in the processes of the data, before continuing)
+PLOT_PROCESSES = 1
+
+# Define the sampling of the buses plotted: only every Nth bus of each route (by its position among the buses of the route) is plotted (0 plots no bus)
+PLOT_EVERY_NTH_BUS = 1
+
+# Define if all the buses of a route are processed at once (if the batch fails, the buses of the route are processed one at a time)
+BATCH_ROUTES = True
+
 # Define the paths to the GTFS and GPS data
 GTFS_FOLDER = "./data/gtfs_data"
 GPS_FOLDER = "./data/gps_data"
@@ -43,124 +80,519 @@ GPS_FOLDER = "./data/gps_data"
 # Define the path to the output folder
 OUTPUT_FOLDER = "./data/output/"
 
-# If the output folder exists and the OVERWRITE flag is set to True, delete the folder
-if OVERWRITE:
-    if os.path.exists(OUTPUT_FOLDER):
-        print("Deleting the output folder...")
-        shutil.rmtree(OUTPUT_FOLDER)
+# Define the path to the manifest of the buses of each day and route processed
+MANIFEST_PATH = OUTPUT_FOLDER + "manifest.jsonl"
 
-# Load the GTFS data
-print("Loading GTFS data...")
-gtfs = gtfs_handler.GTFSHandler(GTFS_FOLDER)
+# Define the path to the folder of the part files written by each (day, route) pair when using several workers
+PARTS_FOLDER = OUTPUT_FOLDER + ".parts/"
 
-# Load the GPS data
-print("Loading GPS data...")
-gps = gps_handler.GPSHandler(GPS_FOLDER)
+# State of each worker process: the GTFS data, and the GPS data of the last file loaded
+worker_state = {}
 
-# Check if the GPS data files are in the correct format (YYYY-MM-DD.csv)
-# If not, split the files into files with the same date and remove the original file
-original_files = os.listdir(GPS_FOLDER)
-files = []
-print("Files in the GPS data folder:")
-for file in original_files:
-    print(file)
-    # If the filename is not in the format "YYYY-MM-DD.csv", split into files with the same date and delete the original file
-    if not re.match(r"\d{4}-\d{2}-\d{2}.csv", file) and file.endswith(".csv"):
-        print(f"File {file} does not match the format 'YYYY-MM-DD.csv'. Splitting the file...")
-        gps.split_file(GPS_FOLDER, file)
+def define_output_path(base_path, folder_name):
+    # Define the output path for the file
+    file_output_path = base_path + folder_name + "/"
+    # Create folder if it doesn't exist
+    if not os.path.exists(file_output_path):
+        os.makedirs(file_output_path)
+        return file_output_path
+    else:
+        # If the path already exists, skip the file
+        return None
 
-    # Update the list of files in the folder
-    files = os.listdir(GPS_FOLDER)
+def define_data_paths(base_path, route):
+    # Define the paths to append the training and validation data of the route
+    return base_path + f"{route}_train_data.csv", base_path + f"{route}_val_data.csv"
+
+def get_pipeline_version():
+    # Get the version of the pipeline, with a hash of the settings that change the data generated
+    settings = {"incremental_matching": INCREMENTAL_MATCHING, "speed_windows": list(SPEED_WINDOWS), "speed_companion_features": SPEED_COMPANION_FEATURES, "output_format": OUTPUT_FORMAT}
+    return f"{PIPELINE_VERSION}.{utils.hash_files([], extra=json.dumps(settings, sort_keys=True))[:8]}"
+
+def get_bus_statuses(manifest, day, route, buses, route_output_path, signature):
+    """
+    Get the status of each bus of a route in the manifest (see "ManifestHandler.get_unit_status"), checked against the output folders of the buses.
+    A bus with a folder and no record, or with a record and no folder, is considered incomplete.
+
+    Args:
+        manifest (manifest_handler.ManifestHandler): Manifest of the buses processed.
+        day (str): Date of the GPS data file ("YYYY-MM-DD").
+        route (str): Identifier of the route.
+        buses (list): Identifiers of the buses.
+        route_output_path (str): Path to the output folder of the route.
+        signature (dict): Hashes of the GPS data file and of the GTFS data, and the pipeline version.
+
+    Returns:
+        dict: Status of each bus ("new", "incomplete", "outdated" or "processed").
+    """
+
+    bus_statuses = {}
+    for bus in buses:
+        bus_statuses[bus] = manifest.get_unit_status(day, route, bus, signature)
+        if (bus_statuses[bus] == "new") == os.path.exists(route_output_path + f"{bus}/"):
+            bus_statuses[bus] = "incomplete"
+
+    return bus_statuses
+
+def process_route(gps, gtfs, day, route, route_output_path, training_append_output_path, validation_append_output_path, progress, parallel, writer, plotter, manifest, signature):
+    """
+    Process the buses of a route in the loaded GPS data file, and append their training and validation data to the given files.
+    With the Parquet output, the data is written to the partition of the day and route of the training and validation datasets instead.
+    Only the buses not processed yet from the same data (according to the manifest) are processed. With the Parquet output, if a bus is processed again, all the buses of the route are, as the partitions of the route are written again.
+
+    Args:
+        gps (GPSHandler): GPS handler with the data of the file loaded.
+        gtfs (GTFSHandler): GTFS handler.
+        day (str): Date of the GPS data file ("YYYY-MM-DD").
+        route (str): Identifier of the route.
+        route_output_path (str): Path to the output folder of the route.
+        training_append_output_path (str): Path to the file where the training data is appended.
+        validation_append_output_path (str): Path to the file where the validation data is appended.
+        progress (str): Description of the file and route being processed, printed with the progress.
+        parallel (bool): Whether to project the GPS points using the parallel kernels.
+        writer (utils.BackgroundWriter): Writer of the output files (which may still be pending when returning).
+        plotter (plotting.PlotRenderer): Renderer of the plots (which may still be pending when returning).
+        manifest (manifest_handler.ManifestHandler): Manifest of the buses processed, where the buses of the route are recorded.
+        signature (dict): Hashes of the GPS data file and of the GTFS data, and the pipeline version (see "ManifestHandler.get_unit_status").
+
+    Returns:
+        bool: Whether buses whose data could have been appended to the files before were processed again (so the files must be rebuilt, see "rebuild_route_data").
+    """
+
+    # Get the buses in the route that have a number of points between the defined boundaries
+    route_buses = gps.show_buses(route, filter_min=MIN_POINTS, filter_max=MAX_POINTS)
+    num_buses = len(route_buses)
+
+    # Get the status of each bus in the manifest, checked against the output folders
+    bus_statuses = get_bus_statuses(manifest, day, route, route_buses, route_output_path, signature)
+
+    # Check if buses processed before are processed again
+    invalidated = any(status in ("incomplete", "outdated") for status in bus_statuses.values())
+
+    # With the Parquet output, delete the partitions of the route, to be written again with all its buses
+    if OUTPUT_FORMAT == "parquet" and invalidated:
+        for dataset in ("train_data", "val_data"):
+            shutil.rmtree(utils.get_partition_path(OUTPUT_FOLDER + dataset, {"data": day, "servico": route}), ignore_errors=True)
+        bus_statuses = {bus: "outdated" if status == "processed" else status for bus, status in bus_statuses.items()}
+
+    buses_to_process = [bus for bus in route_buses if bus_statuses[bus] != "processed"]
+    if not buses_to_process:
+        print(f"Route {route} already processed. Skipping...")
+        return False
+
+    try:
+        # Get the route data and filter the GTFS data according to the route
+        gps.get_route_data(route)
+        gtfs.filter_by_route(str(route))
+    except Exception as e:
+        # If an error occurs, skip the route
+        print(f"Error filtering the GTFS data for the route {route}: {e}")
+        return False
+
+    # Record the buses as started, so they are processed again if the processing is interrupted
+    manifest.record_units(day, route, buses_to_process, "started", signature)
+
+    # Plot route, directions and stops
+    plotter.submit(gtfs.get_route_plot_job(title=f"Route {route}", save_path=route_output_path + f"route_{route}.png"))
+
+    # Get the buses plotted
+    plotted_buses = set(route_buses[::PLOT_EVERY_NTH_BUS]) if PLOT_EVERY_NTH_BUS > 0 else set()
+
+    # Create a progress bar for the buses of that specific route and file (day)
+    bus_progress_bar = tqdm(total=num_buses, position=0, leave=True)
+
+    # Define the output path for each bus, skipping the buses already processed and deleting the output of the buses processed again
+    bus_output_paths = []
+    for bus in route_buses:
+        if bus_statuses[bus] == "processed":
+            print(f"Bus {bus} already processed. Skipping...")
+            bus_progress_bar.update(1)
+            continue
 
-# Get the number of files in the folder
-num_files = len(files)
+        bus_output_path = route_output_path + f"{bus}/"
+        if os.path.exists(bus_output_path):
+            shutil.rmtree(bus_output_path)
+        os.makedirs(bus_output_path)
 
-# Get the end time
-loading_end_time = time.time()
+        bus_output_paths.append(bus_output_path)
 
-print(f"Data loaded in {loading_end_time - loading_start_time:.2f} seconds")
+    # Buses skipped because of an error
+    failed_buses = []
 
+    # Training and validation data of the route, written at the end with the Parquet output
+    training_dfs, validation_dfs = [], []
 
-print("Starting the data processing...")
+    def append_data():
+        # Append the training and validation data
+        if OUTPUT_FORMAT == "parquet":
+            training_dfs.append(gps.gps_df)
+            validation_dfs.append(gps.validation_df)
+        else:
+            writer.submit(utils.append_csv, gps.gps_df, training_append_output_path)
+            writer.submit(utils.append_csv, gps.validation_df, validation_append_output_path)
 
-# Iterate over the GPS data files
-for file_counter, file in enumerate(files, start=1):
+    # Process all the buses of the route at once
+    buses_left, bus_output_paths_left = buses_to_process, bus_output_paths
+    if BATCH_ROUTES and buses_to_process:
+        # Get the data of the buses, one after the other
+        gps.get_buses_data(buses_to_process)
 
-    # Skip files that are not csv files
-    if not file.endswith(".csv"):
-        print("Skipping file {file}...")
-        continue
+        print(f"{progress} - Buses: {len(buses_to_process)}: {gps.gps_df.shape[0]} points")
 
-    # Load the file data
-    gps.load_file_data(file)
+        try:
+            # Process the data of the buses
+            utils.process_route_data(gps, gtfs, buses_to_process, route, bus_output_paths, parallel=parallel, incremental=INCREMENTAL_MATCHING, speed_windows=SPEED_WINDOWS, companion_features=SPEED_COMPANION_FEATURES, write_bus_files=OUTPUT_FORMAT == "csv", writer=writer, plot_buses=[bus in plotted_buses for bus in buses_to_process], plotter=plotter)
+        except Exception as e:
+            # If an error occurs, process the buses one at a time
+            print(f"Error processing the data for the buses of the route {route}: {e}. Processing one bus at a time...")
+        else:
+            # Append the training and validation data of all the buses
+            append_data()
 
-    # Get the routes in the file
-    file_routes = gps.show_routes()
-    num_routes = len(file_routes)
+            # Update the progress bar
+            bus_progress_bar.update(len(buses_to_process))
+            buses_left, bus_output_paths_left = [], []
 
-    # Define the output path for the file and create the folder if it doesn't exist
-    file_output_path = define_output_path(OUTPUT_FOLDER, file.split(".")[0])
+    # Iterate over the buses
+    for bus_counter, (bus, bus_output_path) in enumerate(zip(buses_left, bus_output_paths_left), start=1):
 
-    # Iterate over the routes
-    for route_counter, route in enumerate(file_routes, start=1):
-        
-        # Define the output path for the route
-        route_output_path = define_output_path(file_output_path, str(route))
-        if route_output_path is None:
-            print(f"Route {route} already processed. Skipping...")
-            continue
+        # Get the bus data
+        gps.get_bus_data(bus)
+
+        print(f"{progress} - Bus: {bus} ({bus_counter}/{num_buses}): {gps.gps_df.shape[0]} points")
 
         try:
-            # Get the route data and filter the GTFS data according to the route
-            gps.get_route_data(route)
-            gtfs.filter_by_route(str(route))
+            # Process the bus data
+            utils.process_bus_data(gps, gtfs, bus, route, bus_output_path, parallel=parallel, incremental=INCREMENTAL_MATCHING, speed_windows=SPEED_WINDOWS, companion_features=SPEED_COMPANION_FEATURES, write_bus_files=OUTPUT_FORMAT == "csv", writer=writer, plot=bus in plotted_buses, plotter=plotter)
         except Exception as e:
-            # If an error occurs, skip the route
-            print(f"Error filtering the GTFS data for the route {route}: {e}")
+            # If an error occurs, skip the bus data
+            print(f"Error processing the data for the bus {bus}: {e}")
+            failed_buses.append(bus)
+            # Update the progress bar
+            bus_progress_bar.update(1)
             continue
 
-        # Plot route, directions and stops
-        gtfs.plot_route(title=f"Route {route}", save_path=route_output_path + f"route_{route}.png") 
+        # Append the training and validation data
+        append_data()
 
-        # Get the buses in the route that have a number of points between the defined boundaries
-        route_buses = gps.show_buses(route, filter_min=MIN_POINTS, filter_max=MAX_POINTS)
-        num_buses = len(route_buses)
+        # Update the progress bar
+        bus_progress_bar.update(1)
 
-        # Create a progress bar for the buses of that specific route and file (day)
-        bus_progress_bar = tqdm(total=num_buses, position=0, leave=True)
+    # Write the training and validation data of the route to their partitions, as a single row group
+    if OUTPUT_FORMAT == "parquet":
+        writer.submit(utils.write_parquet_partition, training_dfs, OUTPUT_FOLDER + "train_data", {"data": day, "servico": route}, compression=PARQUET_COMPRESSION)
+        writer.submit(utils.write_parquet_partition, validation_dfs, OUTPUT_FOLDER + "val_data", {"data": day, "servico": route}, compression=PARQUET_COMPRESSION)
 
-        # Iterate over the buses
-        for bus_counter, bus in enumerate(route_buses, start=1):
-                
-            # Define the output path for the bus
-            bus_output_path = define_output_path(route_output_path, str(bus))
-            if bus_output_path is None:
-                print(f"Bus {bus} already processed. Skipping...")
-                bus_progress_bar.update(1)
-                continue
+    # Record the buses as done (or failed) after all their data is written
+    writer.submit(manifest.record_units, day, route, [bus for bus in buses_to_process if bus not in failed_buses], "done", signature)
+    writer.submit(manifest.record_units, day, route, failed_buses, "failed", signature)
 
-            # Get the bus data
-            gps.get_bus_data(bus)            
+    return invalidated
 
-            print(f"File: {file}({file_counter}/{num_files}) - Route: {route}({route_counter}/{num_routes}) - Bus: {bus} ({bus_counter}/{num_buses}): {gps.gps_df.shape[0]} points")
+def init_worker(route_arrays_path=None):
+    """
+    Initialize a worker process, loading the GTFS data (or attaching to the shared route arrays) and creating its GPS handler.
+    The plots of the worker are kept, and returned with each pair to be rendered by the main process.
 
-            try:
-                # Process the bus data
-                utils.process_bus_data(gps, gtfs, bus, route, bus_output_path)
-            except Exception as e:
-                # If an error occurs, skip the bus data
-                print(f"Error processing the data for the bus {bus}: {e}")
-                # Update the progress bar
-                bus_progress_bar.update(1)
-                continue
+    Args:
+        route_arrays_path (str, optional): Path to the route arrays compiled by "GTFSHandler.compile_route_arrays". Defaults to None, which loads the GTFS data.
+    """
+
+    # Set the number of threads of the parallel kernels
+    worker_state["num_threads"] = utils.set_num_threads(NUM_THREADS) if NUM_THREADS != 1 else 1
 
-            # Append the training and validation data
-            training_append_output_path = OUTPUT_FOLDER + f"{route}_train_data.csv"
-            validation_append_output_path = OUTPUT_FOLDER + f"{route}_val_data.csv"
+    if route_arrays_path is not None:
+        worker_state["gtfs"] = gtfs_handler.GTFSRouteArrays(route_arrays_path)
+    else:
+        worker_state["gtfs"] = gtfs_handler.GTFSHandler(GTFS_FOLDER, simplify_tolerance_meters=SHAPE_SIMPLIFY_TOLERANCE)
+    worker_state["gps"] = gps_handler.GPSHandler(GPS_FOLDER)
+    worker_state["plotter"] = plotting.PlotRenderer(num_processes=None)
+    worker_state["manifest"] = manifest_handler.ManifestHandler(MANIFEST_PATH)
+    worker_state["file"] = None
+
+def process_route_in_worker(file, route, route_output_path, training_part_path, validation_part_path, progress, signature):
+    """
+    Process a (day, route) pair in a worker process, writing its training and validation data to its own part files.
+    The GPS data file is loaded only if it is not the file of the previous pair processed by the worker, and the files of the pair are all written when returning.
+
+    Args:
+        file (str): Name of the GPS data file (day).
+        route (str): Identifier of the route.
+        route_output_path (str): Path to the output folder of the route.
+        training_part_path (str): Path to the part file of the training data.
+        validation_part_path (str): Path to the part file of the validation data.
+        progress (str): Description of the file and route being processed, printed with the progress.
+        signature (dict): Hashes of the GPS data file and of the GTFS data, and the pipeline version (see "ManifestHandler.get_unit_status").
+
+    Returns:
+        tuple: Timings of the writes of the pair (see "utils.BackgroundWriter.get_timings"), the plots of the pair (PlotJob) to be rendered, and whether the files of the route must be rebuilt (see "process_route").
+    """
+
+    gps = worker_state["gps"]
+
+    # Load the file data, if it is not loaded yet
+    if worker_state["file"] != file:
+        gps.load_file_data(file)
+        worker_state["file"] = file
+
+    # Write the files of the pair in the background, waiting for them at the end, before the part files are merged
+    writer = utils.BackgroundWriter(WRITE_QUEUE_SIZE)
+    try:
+        invalidated = process_route(gps, worker_state["gtfs"], file.split(".")[0], route, route_output_path, training_part_path, validation_part_path, progress, parallel=worker_state["num_threads"] > 1 and not INCREMENTAL_MATCHING, writer=writer, plotter=worker_state["plotter"], manifest=worker_state["manifest"], signature=signature)
+    finally:
+        writer.close()
+
+    return writer.get_timings(), worker_state["plotter"].take_jobs(), invalidated
+
+def print_write_timings(processing_time, timings):
+    # Print the time spent processing the routes, and the time spent writing the output files and how much of it was hidden behind the processing
+    print(f"Routes processed in {processing_time:.2f} seconds")
+    print(f"Output written in {timings['write_time']:.2f} seconds ({timings['writes']} writes): {timings['wait_time']:.2f} seconds waiting for the writes, {timings['hidden_time']:.2f} seconds hidden in the background")
+
+def print_plot_timings(plotter):
+    # Print the number of plots and the time spent rendering them (or waiting for the processes that render them)
+    rendered_by = f"by {plotter.num_processes} process(es)" if plotter.num_processes else "in this process"
+    print(f"{plotter.num_plots} plots rendered {rendered_by}: {plotter.wait_time:.2f} seconds rendering or waiting for the plots")
+
+def merge_part_file(part_path, output_path, remove=True):
+    """
+    Append a part file to an output file (without its header, if the output file already exists) and delete it.
+
+    Args:
+        part_path (str): Path to the part file.
+        output_path (str): Path to the output file.
+        remove (bool, optional): Whether to delete the part file. Defaults to True.
+    """
+
+    # Skip the routes with no data written
+    if not os.path.exists(part_path):
+        return
+
+    with open(part_path, "rb") as part_file:
+        # Skip the header if the output file already has one
+        if os.path.exists(output_path):
+            part_file.readline()
+
+        with open(output_path, "ab") as output_file:
+            shutil.copyfileobj(part_file, output_file)
+
+    if remove:
+        os.remove(part_path)
+
+def rebuild_route_data(manifest, route):
+    """
+    Rebuild the training and validation files of a route from the files of its buses processed, in the order they were processed.
+    This removes the data appended by the buses processed again (e.g. after an interruption, or from new data).
+
+    Args:
+        manifest (manifest_handler.ManifestHandler): Manifest of the buses processed.
+        route (str): Identifier of the route.
+    """
+
+    print(f"Rebuilding the training and validation data of the route {route}...")
+
+    training_append_output_path, validation_append_output_path = define_data_paths(OUTPUT_FOLDER, route)
+    for output_path, bus_file_name in [(training_append_output_path, "raw_processed_gps_data.csv"), (validation_append_output_path, "validation_data.csv")]:
+        # Write to a temporary file, renamed at the end, so an interrupted rebuild keeps the previous file
+        temporary_path = f"{output_path}.{os.getpid()}.tmp"
+        for day, bus in manifest.get_done_units(route):
+            merge_part_file(OUTPUT_FOLDER + f"{day}/{route}/{bus}/{bus_file_name}", temporary_path, remove=False)
+
+        if os.path.exists(temporary_path):
+            os.replace(temporary_path, output_path)
+        elif os.path.exists(output_path):
+            os.remove(output_path)
+
+def main(num_workers=NUM_WORKERS):
+    """
+    Preprocess the GPS data files, processing each (day, route) pair in this process or in a pool of worker processes.
+    With several workers, each pair writes its training and validation data to its own part files, which are appended to the output files at the end, in the same order as processing the pairs one after the other.
+
+    Args:
+        num_workers (int, optional): Number of worker processes. Defaults to NUM_WORKERS.
+    """
+
+    # Get the start time of the loading process
+    loading_start_time = time.time()
+
+    # If the output folder exists and the OVERWRITE flag is set to True, delete the folder
+    if OVERWRITE:
+        if os.path.exists(OUTPUT_FOLDER):
+            print("Deleting the output folder...")
+            shutil.rmtree(OUTPUT_FOLDER)
+
+    # Delete the part files of an interrupted run
+    if os.path.exists(PARTS_FOLDER):
+        shutil.rmtree(PARTS_FOLDER)
+
+    # Load the manifest of the buses processed
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    manifest = manifest_handler.ManifestHandler(MANIFEST_PATH)
+
+    # Set the number of threads of the parallel kernels
+    num_threads = utils.set_num_threads(NUM_THREADS) if NUM_THREADS != 1 else 1
+    print(f"Using {num_threads} thread(s) to project the GPS points")
+
+    # Load the GTFS data (its tables are read on their first access, so they are not read here if each worker loads its own)
+    print("Loading GTFS data...")
+    gtfs = gtfs_handler.GTFSHandler(GTFS_FOLDER, simplify_tolerance_meters=SHAPE_SIMPLIFY_TOLERANCE)
+
+    # Get the hash of the GTFS data and the pipeline version, recorded in the manifest with each bus
+    gtfs_hash = gtfs.get_route_data_hash()
+    pipeline_version = get_pipeline_version()
+
+    # Load the GPS data
+    print("Loading GPS data...")
+    gps = gps_handler.GPSHandler(GPS_FOLDER)
+
+    # Check if the GPS data files are in the correct format (YYYY-MM-DD.csv)
+    # If not, split the files into files with the same date and remove the original file
+    original_files = os.listdir(GPS_FOLDER)
+    files = []
+    print("Files in the GPS data folder:")
+    for file in original_files:
+        print(file)
+        # If the filename is not in the format "YYYY-MM-DD.csv", split into files with the same date and delete the original file
+        if not re.match(r"\d{4}-\d{2}-\d{2}.csv", file) and file.endswith(".csv"):
+            print(f"File {file} does not match the format 'YYYY-MM-DD.csv'. Splitting the file...")
+            gps.split_file(GPS_FOLDER, file)
+
+        # Update the list of files in the folder
+        files = os.listdir(GPS_FOLDER)
+
+    # Convert the GPS data files that weren't converted yet to archives, and process only the archives
+    gps_file_extension = ".csv"
+    if GPS_ARCHIVE:
+        for file in files:
+            if file.endswith(".csv") and os.path.splitext(file)[0] + gps_handler.GPS_ARCHIVE_EXTENSION not in files:
+                gps.convert_file(GPS_FOLDER, file)
+
+        gps_file_extension = gps_handler.GPS_ARCHIVE_EXTENSION
+        files = [file for file in os.listdir(GPS_FOLDER) if file.endswith(gps_file_extension)]
+
+    # Get the number of files in the folder
+    num_files = len(files)
 
-            gps.gps_df.to_csv(training_append_output_path, mode='a', index=False, header=not os.path.exists(training_append_output_path))
-            gps.validation_df.to_csv(validation_append_output_path, mode='a', index=False, header=not os.path.exists(validation_append_output_path))
+    # Get the end time
+    loading_end_time = time.time()
 
-            # Update the progress bar
-            bus_progress_bar.update(1)
+    print(f"Data loaded in {loading_end_time - loading_start_time:.2f} seconds")
+
+
+    print("Starting the data processing...")
+
+    # Get the start time of the processing
+    processing_start_time = time.time()
+
+    # Create the renderer of the plots (before the writer, so its processes don't copy the writer thread)
+    plotter = plotting.PlotRenderer(PLOT_PROCESSES)
+
+    # Create the writer of the output files, when processing the routes in this process
+    writer = utils.BackgroundWriter(WRITE_QUEUE_SIZE) if num_workers == 1 else None
+
+    # Create the pool of workers, each one processing a (day, route) pair at a time
+    executor = None
+    if num_workers > 1:
+        # Compile the route data once, to be memory-mapped by all the workers
+        route_arrays_path = gtfs.compile_route_arrays() if SHARED_ROUTE_ARRAYS else None
+        # The workers are started with "spawn", as this process may have started the threads of the parallel kernels (each worker sets its own threads in "init_worker")
+        executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker, initargs=(route_arrays_path,))
 
+    # The (day, route) pairs submitted to the workers, in the order they would be processed one after the other
+    jobs = []
+
+    # The routes whose training and validation files must be rebuilt, as buses appended to them before were processed again
+    routes_to_rebuild = []
+
+    # Iterate over the GPS data files
+    for file_counter, file in enumerate(files, start=1):
+
+        # Skip files that are not csv files (or archive files)
+        if not file.endswith(gps_file_extension):
+            print("Skipping file {file}...")
+            continue
+
+        # Load the file data
+        gps.load_file_data(file)
+
+        # Get the signature of the data the buses of the file are processed from, compared to the one recorded in the manifest
+        signature = {"gps_hash": utils.hash_files([f"{GPS_FOLDER}/{file}"])[:32], "gtfs_hash": gtfs_hash, "pipeline_version": pipeline_version}
+
+        # Get the routes in the file
+        file_routes = gps.show_routes()
+        num_routes = len(file_routes)
+
+        # Define the output path for the file and create the folder if it doesn't exist
+        file_output_path = OUTPUT_FOLDER + file.split(".")[0] + "/"
+        os.makedirs(file_output_path, exist_ok=True)
+
+        # Iterate over the routes
+        for route_counter, route in enumerate(file_routes, start=1):
+
+            # Define the output path for the route (the buses already processed are skipped according to the manifest)
+            route_output_path = file_output_path + f"{route}/"
+            os.makedirs(route_output_path, exist_ok=True)
+
+            progress = f"File: {file}({file_counter}/{num_files}) - Route: {route}({route_counter}/{num_routes})"
+
+            # Process the route in this process, appending its data to the output files
+            if executor is None:
+                training_append_output_path, validation_append_output_path = define_data_paths(OUTPUT_FOLDER, route)
+                if process_route(gps, gtfs, file.split(".")[0], route, route_output_path, training_append_output_path, validation_append_output_path, progress, parallel=num_threads > 1 and not INCREMENTAL_MATCHING, writer=writer, plotter=plotter, manifest=manifest, signature=signature):
+                    routes_to_rebuild.append(route)
+                continue
+
+            # Submit the route to the workers, writing its data to its own part files
+            part_path = define_output_path(PARTS_FOLDER, f"{file_counter}_{route_counter}")
+            training_part_path, validation_part_path = define_data_paths(part_path, route)
+            future = executor.submit(process_route_in_worker, file, route, route_output_path, training_part_path, validation_part_path, progress, signature)
+            jobs.append((future, route, training_part_path, validation_part_path))
+
+    # Wait for the pending writes
+    if executor is None:
+        writer.close()
+        print_write_timings(time.time() - processing_start_time, writer.get_timings())
+    else:
+        # Wait for all the pairs (raising the errors of the workers), adding the timings of their writes and rendering their plots
+        timings = {"writes": 0, "write_time": 0.0, "wait_time": 0.0, "hidden_time": 0.0}
+        for future, route, _, _ in jobs:
+            pair_timings, plot_jobs, invalidated = future.result()
+            for key, value in pair_timings.items():
+                timings[key] += value
+            for plot_job in plot_jobs:
+                plotter.submit(plot_job)
+            if invalidated:
+                routes_to_rebuild.append(route)
+
+        executor.shutdown()
+
+        print_write_timings(time.time() - processing_start_time, timings)
+
+        # Append the part files to the output files, in the order of the pairs
+        print("Merging the part files...")
+        for _, route, training_part_path, validation_part_path in jobs:
+            training_append_output_path, validation_append_output_path = define_data_paths(OUTPUT_FOLDER, route)
+            merge_part_file(training_part_path, training_append_output_path)
+            merge_part_file(validation_part_path, validation_append_output_path)
+
+        # Delete the part files (the folder doesn't exist if no pair was submitted)
+        shutil.rmtree(PARTS_FOLDER, ignore_errors=True)
+
+        # Reload the manifest, with the buses recorded by the workers
+        manifest.load_manifest()
+
+    # Rebuild the training and validation files of the routes with buses processed again, from the files of their buses
+    if OUTPUT_FORMAT == "csv":
+        for route in dict.fromkeys(routes_to_rebuild):
+            rebuild_route_data(manifest, route)
+
+    # Wait for the pending plots
+    plotter.close()
+    print_plot_timings(plotter)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess the GPS data files.")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Number of processes that process the (day, route) pairs.")
+    args = parser.parse_args()
+
+    main(num_workers=args.workers)
@@ -1,10 +1,291 @@
+import json
 import os
+import src.plotting as plotting
 import src.utils as utils
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+# Columns of the GPS data that are not used by the pipeline (they are not read)
+GPS_UNUSED_COLUMNS = ['modo', 'flag_em_operacao', 'flag_linha_existe_sigmob', 'flag_trajeto_correto', 'flag_trajeto_correto_hist', 'versao']
+
+# Compact types of the GPS columns (categories for the ids and the repeated texts), the other columns have inferred types
+GPS_DTYPES = {"servico": "category", "id_veiculo": "category", "data": "category", "hora": "category", "status": "category", "latitude": "float64", "longitude": "float64"}
+
+# Number of records read at a time from the GPS files
+GPS_CHUNK_SIZE = 1_000_000
+
+# Number of records read at a time when splitting a GPS file by date (smaller, since all the columns are read as text)
+GPS_SPLIT_CHUNK_SIZE = 200_000
+
+def read_gps_files(file_paths, chunk_size=GPS_CHUNK_SIZE):
+    """
+    Read the used columns of the GPS CSV files in chunks, with compact types, and concatenate them once.
+    The 'timestamp_gps' column is parsed once, to datetime64[s] (its int64 view is the epoch in seconds).
+
+    Args:
+        file_paths (list): Paths of the CSV files to read.
+        chunk_size (int, optional): Number of records read at a time. Defaults to GPS_CHUNK_SIZE.
+
+    Returns:
+        pandas.DataFrame: The GPS records of all the files.
+    """
+
+    chunks = []
+
+    for file_path in file_paths:
+        # Read only the used columns, in chunks, so the text of the whole file is never held in memory
+        for chunk in pd.read_csv(file_path, usecols=lambda column: column not in GPS_UNUSED_COLUMNS, dtype=GPS_DTYPES, chunksize=chunk_size):
+            # Parse the timestamps once, to seconds
+            chunk['timestamp_gps'] = pd.to_datetime(chunk['timestamp_gps'], format='ISO8601').astype('datetime64[s]')
+            chunks.append(chunk)
+
+    if not chunks:
+        return pd.DataFrame()
+
+    # Use the same categories in every chunk, so the columns are concatenated as categories
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = chunks[0][column].cat.categories
+            for chunk in chunks[1:]:
+                categories = categories.union(chunk[column].cat.categories)
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+
+    # Concatenate all the chunks at once
+    return pd.concat(chunks, ignore_index=True)
+
+# Extension and magic number of the GPS archive files (see "write_gps_archive")
+GPS_ARCHIVE_EXTENSION = ".gpsa"
+GPS_ARCHIVE_MAGIC = b"GPSARCH1"
+
+# Columns stored only in the index of the archive blocks, as each block has a single route, bus and date
+GPS_ARCHIVE_KEY_COLUMNS = ['servico', 'id_veiculo', 'data']
+
+def write_gps_archive(gps_df, routes, buses, archive_path):
+    """
+    Write GPS data, sorted by route and bus (see "GPSHandler.index_groups"), to a compact archive file.
+    The records are stored in a block for each run of records of the same route, bus and date: the timestamps as int32 deltas (in seconds) from the previous record, the coordinates as int32 microdegrees, the categorical and text columns as int32 codes and the other columns as they are.
+    A JSON footer stores the index of the blocks (position, number of records, first timestamp, route, bus and date), the categories of each column and the order of the routes and buses, so the records of a block can be memory-mapped and decoded without reading the rest of the file.
+
+    Args:
+        gps_df (pandas.DataFrame): GPS data, with categorical 'servico', 'id_veiculo' and 'data' columns and 'timestamp_gps' as datetime64[s].
+        routes (pandas.CategoricalIndex): Routes, in the order of the group index.
+        buses (pandas.CategoricalIndex): Buses, in the order of the group index.
+        archive_path (str): Path of the archive file.
+
+    Returns:
+        tuple: Number of blocks written and the largest rounding error of the coordinates, in degrees.
+    """
+
+    num_records = len(gps_df)
+
+    # Split the records in runs of the same route, bus and date (if the data has dates)
+    key_columns = [column for column in GPS_ARCHIVE_KEY_COLUMNS if column in gps_df.columns]
+    key_codes = [gps_df[column].cat.codes.to_numpy() for column in key_columns]
+    block_changes = np.zeros(num_records, dtype=bool)
+    block_changes[:1] = True
+    for codes in key_codes:
+        block_changes[1:] |= codes[1:] != codes[:-1]
+    block_starts = np.flatnonzero(block_changes)
+    block_ends = np.append(block_starts[1:], num_records).astype(np.int64)
+
+    # Encode the timestamps as the difference from the previous record of the block (the first timestamp of each block is stored in the index)
+    timestamps = gps_df['timestamp_gps'].to_numpy().astype('datetime64[s]')
+    if np.any(np.isnat(timestamps)):
+        raise ValueError("The GPS data has records without a timestamp!")
+    timestamps = timestamps.view(np.int64)
+    timestamp_deltas = np.diff(timestamps, prepend=timestamps[:1])
+    timestamp_deltas[block_starts] = 0
+    if np.any(np.abs(timestamp_deltas) > np.iinfo(np.int32).max):
+        raise ValueError("The timestamps of a block are too far apart to be stored as int32 deltas!")
+
+    columns, arrays, max_coordinate_error = [], [], 0.0
+
+    for column in gps_df.columns:
+        values = gps_df[column]
+
+        if column in key_columns:
+            columns.append({"name": column, "kind": "key", "categories": values.cat.categories.tolist()})
+        elif column == 'timestamp_gps':
+            columns.append({"name": column, "kind": "timestamp"})
+            arrays.append(timestamp_deltas.astype(np.int32))
+        elif column in ['latitude', 'longitude']:
+            # Store the coordinates in microdegrees (the missing ones as the smallest int32)
+            coordinates = values.to_numpy(np.float64)
+            microdegrees = np.round(coordinates * 1e6)
+            max_coordinate_error = max(max_coordinate_error, float(np.nanmax(np.abs(microdegrees / 1e6 - coordinates), initial=0.0)))
+            columns.append({"name": column, "kind": "coordinate"})
+            arrays.append(np.where(np.isnan(microdegrees), np.iinfo(np.int32).min, microdegrees).astype(np.int32))
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            columns.append({"name": column, "kind": "categorical", "categories": values.cat.categories.tolist()})
+            arrays.append(values.cat.codes.to_numpy().astype(np.int32))
+        elif values.dtype == object:
+            # Encode the text (or mixed) columns as codes of their unique values (-1 for missing values)
+            codes, uniques = pd.factorize(values)
+            columns.append({"name": column, "kind": "text", "values": np.asarray(uniques, dtype=object).tolist()})
+            arrays.append(codes.astype(np.int32))
+        else:
+            columns.append({"name": column, "kind": "array", "dtype": values.dtype.str})
+            arrays.append(values.to_numpy())
+
+    # Write to a temporary file, renamed at the end, so an interrupted run never leaves a partial archive
+    temporary_path = f"{archive_path}.{os.getpid()}.tmp"
+
+    with open(temporary_path, "wb") as file:
+        file.write(GPS_ARCHIVE_MAGIC)
+
+        # Write the arrays of each block one after the other, aligned to 8 bytes
+        block_positions = []
+        for start, end in zip(block_starts, block_ends):
+            block_positions.append(file.tell())
+            for array in arrays:
+                data = np.ascontiguousarray(array[start:end]).tobytes()
+                file.write(data + bytes(-len(data) % 8))
+
+        footer = json.dumps({
+            "num_records": num_records,
+            "columns": columns,
+            "routes": np.asarray(routes.codes).tolist(),
+            "buses": np.asarray(buses.codes).tolist(),
+            "blocks": {
+                "positions": block_positions,
+                "counts": (block_ends - block_starts).tolist(),
+                "first_timestamps": timestamps[block_starts].tolist(),
+                **{column: codes[block_starts].tolist() for column, codes in zip(key_columns, key_codes)},
+            },
+        }).encode()
+
+        # The footer is followed by its size and the magic number, so it's found from the end of the file
+        file.write(footer)
+        file.write(len(footer).to_bytes(8, "little"))
+        file.write(GPS_ARCHIVE_MAGIC)
+
+    os.replace(temporary_path, archive_path)
+
+    return len(block_starts), max_coordinate_error
+
+class GPSArchive:
+
+    def __init__(self, archive_path):
+        """
+        Open a GPS archive file (see "write_gps_archive"), memory-mapping it and reading only its footer.
+
+        Args:
+            archive_path (str): Path of the archive file.
+        """
+
+        self.archive_path = archive_path
+
+        # Memory-map the file, so only the pages of the blocks decoded are read
+        self.data = np.memmap(archive_path, dtype=np.uint8, mode='r')
+
+        magic_size = len(GPS_ARCHIVE_MAGIC)
+        assert bytes(self.data[:magic_size]) == GPS_ARCHIVE_MAGIC and bytes(self.data[-magic_size:]) == GPS_ARCHIVE_MAGIC, f"The file {archive_path} is not a GPS archive!"
+
+        # Read the footer, from the end of the file
+        footer_size = int.from_bytes(bytes(self.data[-magic_size - 8:-magic_size]), "little")
+        footer = json.loads(bytes(self.data[-magic_size - 8 - footer_size:-magic_size - 8]))
+
+        self.columns = footer["columns"]
+        self.routes = np.array(footer["routes"], dtype=np.int64)
+        self.buses = np.array(footer["buses"], dtype=np.int64)
+
+        # Index of the blocks
+        blocks = footer["blocks"]
+        self.block_positions = np.array(blocks["positions"], dtype=np.int64)
+        self.block_counts = np.array(blocks["counts"], dtype=np.int64)
+        self.block_first_timestamps = np.array(blocks["first_timestamps"], dtype=np.int64)
+        self.block_keys = {column["name"]: np.array(blocks[column["name"]], dtype=np.int64) for column in self.columns if column["kind"] == "key"}
+
+        # Position of the first record of each block
+        self.block_offsets = np.zeros(len(self.block_counts) + 1, dtype=np.int64)
+        self.block_offsets[1:] = np.cumsum(self.block_counts)
+
+        # Categories of the categorical columns and unique values of the text columns (with a missing value at the end, for the code -1)
+        self.categories = {column["name"]: pd.Index(column["categories"]) for column in self.columns if "categories" in column}
+        self.values = {column["name"]: np.append(np.array(column["values"], dtype=object), np.nan) for column in self.columns if column["kind"] == "text"}
+
+    def read_block_arrays(self, block):
+        """
+        Get the stored arrays of a block, as views of the memory-mapped file.
+
+        Args:
+            block (int): Position of the block in the index.
+
+        Returns:
+            list: Array of each stored column, in the order of the columns.
+        """
+
+        count, position = int(self.block_counts[block]), int(self.block_positions[block])
+
+        arrays = []
+        for column in self.columns:
+            if column["kind"] == "key":
+                continue
+
+            dtype = np.dtype(column["dtype"]) if column["kind"] == "array" else np.dtype(np.int32)
+            arrays.append(np.frombuffer(self.data, dtype=dtype, count=count, offset=position))
+            position += count * dtype.itemsize + (-(count * dtype.itemsize) % 8)
+
+        return arrays
+
+    def read_records(self, start, end):
+        """
+        Decode a range of records of the archive, reading only the blocks that contain them.
+
+        Args:
+            start (int): Position of the first record.
+            end (int): Position after the last record.
+
+        Returns:
+            pandas.DataFrame: Dataframe containing the records, indexed from 0.
+        """
+
+        # Get the blocks that contain the records
+        first_block = np.searchsorted(self.block_offsets, start, side='right') - 1
+        last_block = np.searchsorted(self.block_offsets, end, side='left')
+        blocks = range(max(first_block, 0), min(last_block, len(self.block_counts)))
+
+        block_arrays = [self.read_block_arrays(block) for block in blocks]
+
+        # Position of the records in the decoded blocks
+        first = start - self.block_offsets[blocks.start] if len(blocks) > 0 else 0
+        records = slice(first, first + end - start)
+
+        data = {}
+        k = 0
+        for column in self.columns:
+            name, kind = column["name"], column["kind"]
+
+            if kind == "key":
+                # Repeat the route, bus or date of each block
+                codes = np.repeat(self.block_keys[name][blocks.start:blocks.stop], self.block_counts[blocks.start:blocks.stop])[records]
+                data[name] = pd.Categorical.from_codes(codes, categories=self.categories[name])
+                continue
+
+            values = np.concatenate([arrays[k] for arrays in block_arrays] + [np.empty(0, dtype=block_arrays[0][k].dtype if block_arrays else np.int32)])
+
+            if kind == "timestamp":
+                # Add the deltas to the first timestamp of each block
+                timestamps = np.empty(len(values), dtype=np.int64)
+                for block, block_start, block_end in zip(blocks, self.block_offsets[blocks.start:blocks.stop] - self.block_offsets[blocks.start], self.block_offsets[blocks.start + 1:blocks.stop + 1] - self.block_offsets[blocks.start]):
+                    timestamps[block_start:block_end] = self.block_first_timestamps[block] + np.cumsum(values[block_start:block_end], dtype=np.int64)
+                data[name] = timestamps[records].view('datetime64[s]')
+            elif kind == "coordinate":
+                values = values[records]
+                data[name] = np.where(values == np.iinfo(np.int32).min, np.nan, values / 1e6)
+            elif kind == "categorical":
+                data[name] = pd.Categorical.from_codes(values[records], categories=self.categories[name])
+            elif kind == "text":
+                data[name] = self.values[name][values[records]]
+            else:
+                data[name] = values[records]
+
+            k += 1
+
+        return pd.DataFrame(data)
+
 class GPSHandler:
 
     def __init__(self, gps_folder_path):
@@ -21,28 +302,163 @@ class GPSHandler:
 
         self.gps_df = pd.DataFrame()
 
+        # Archive of the loaded file, when the records are decoded from it on selection (see "GPSArchive")
+        self.archive = None
+
+    def index_groups(self):
+        """
+        Sort the GPS data by route and bus (keeping the timestamp order of each bus) and index the offsets of each route and bus, so selecting them doesn't need to filter the whole data.
+        The routes, and the buses of each route, are kept in the order of their first record.
+        """
+
+        # Get the code of the route, the bus and the (route, bus) pair of each record, in the order of their first record
+        route_codes, self.routes = pd.factorize(self.gps_all_df['servico'], use_na_sentinel=False)
+        bus_codes, self.buses = pd.factorize(self.gps_all_df['id_veiculo'], use_na_sentinel=False)
+        group_codes, group_pairs = pd.factorize(route_codes.astype(np.int64) * len(self.buses) + bus_codes, use_na_sentinel=False)
+
+        # Sort the records by route and by (route, bus) pair (the sort is stable, so the timestamp order is kept)
+        records = np.lexsort((group_codes, route_codes))
+        self.gps_all_df = self.gps_all_df.take(records).reset_index(drop=True)
+
+        # Sort the (route, bus) pairs by route in the same way, and get the bus of each pair
+        group_routes = group_pairs // len(self.buses)
+        groups = np.lexsort((np.arange(len(group_pairs)), group_routes))
+        self.group_buses = self.buses[group_pairs[groups] % len(self.buses)]
+        self.group_positions = dict(zip(zip(group_routes[groups].tolist(), self.group_buses), range(len(groups))))
+
+        # Get the offsets of the records of each (route, bus) pair, and the offsets of the pairs of each route
+        self.group_offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+        self.group_offsets[1:] = np.cumsum(np.bincount(group_codes, minlength=len(groups))[groups])
+        self.route_group_offsets = np.zeros(len(self.routes) + 1, dtype=np.int64)
+        self.route_group_offsets[1:] = np.cumsum(np.bincount(group_routes, minlength=len(self.routes)))
+
+        # The route of the selected data (None for all the routes)
+        self.route_position = None
+
+    def index_archive_blocks(self):
+        """
+        Index the routes and buses of the loaded archive from the index of its blocks, in the same way as "index_groups", without decoding the records.
+        The blocks are stored sorted by route and bus, so each (route, bus) pair is a run of blocks.
+        """
+
+        # Get the routes and buses in the order of the group index
+        self.routes = pd.CategoricalIndex(pd.Categorical.from_codes(self.archive.routes, categories=self.archive.categories['servico']))
+        self.buses = pd.CategoricalIndex(pd.Categorical.from_codes(self.archive.buses, categories=self.archive.categories['id_veiculo']))
+
+        # Get the position of the route and of the bus of each block
+        block_routes = pd.Index(self.archive.routes).get_indexer(self.archive.block_keys['servico'])
+        block_buses = pd.Index(self.archive.buses).get_indexer(self.archive.block_keys['id_veiculo'])
+
+        # Get the (route, bus) pair of each block (a new pair starts when the route or the bus changes)
+        group_starts = np.ones(len(block_routes), dtype=bool)
+        group_starts[1:] = (block_routes[1:] != block_routes[:-1]) | (block_buses[1:] != block_buses[:-1])
+        block_groups = np.cumsum(group_starts) - 1
+        group_routes = block_routes[group_starts]
+
+        self.group_buses = self.buses[block_buses[group_starts]]
+        self.group_positions = dict(zip(zip(group_routes.tolist(), self.group_buses), range(len(group_routes))))
+
+        # Get the offsets of the records of each (route, bus) pair, and the offsets of the pairs of each route
+        self.group_offsets = np.zeros(len(group_routes) + 1, dtype=np.int64)
+        self.group_offsets[1:] = np.cumsum(np.bincount(block_groups, weights=self.archive.block_counts, minlength=len(group_routes)).astype(np.int64))
+        self.route_group_offsets = np.zeros(len(self.routes) + 1, dtype=np.int64)
+        self.route_group_offsets[1:] = np.cumsum(np.bincount(group_routes, minlength=len(self.routes)))
+
+        # The route of the selected data (None for all the routes)
+        self.route_position = None
+
+    def get_route_groups(self, route_id):
+        """
+        Get the position of the (route, bus) pairs of a specific route in the group index.
+
+        Args:
+            route_id (str): Identifier of the route.
+
+        Returns:
+            range: Positions of the pairs of the route (empty if the route has no data).
+        """
+
+        if route_id not in self.routes:
+            return range(0)
+
+        route_position = self.routes.get_loc(route_id)
+
+        return range(self.route_group_offsets[route_position], self.route_group_offsets[route_position + 1])
+
+    def select_records(self, start, end):
+        """
+        Select a contiguous range of records of the GPS data, without copying them.
+
+        Args:
+            start (int): Position of the first record.
+            end (int): Position after the last record.
+
+        Returns:
+            pandas.DataFrame: Dataframe containing the selected records, re-indexed from 0.
+        """
+
+        # Decode the records from the archive, if the data was loaded from one
+        if self.archive is not None:
+            return self.archive.read_records(start, end)
+
+        # Take a shallow copy of the slice, so new columns are not set on the whole data
+        records = self.gps_all_df.iloc[start:end].copy(deep=False)
+        records.index = pd.RangeIndex(end - start)
+
+        return records
+
+    def select_groups(self, groups):
+        """
+        Select the records of several (route, bus) pairs, one pair after the other.
+
+        Args:
+            groups (list): Positions of the pairs in the group index.
+
+        Returns:
+            pandas.DataFrame: Dataframe containing the selected records, re-indexed from 0.
+        """
+
+        groups = np.asarray(groups, dtype=np.int64)
+        starts, ends = self.group_offsets[groups], self.group_offsets[groups + 1]
+
+        # Decode the records of each pair from the archive
+        if self.archive is not None:
+            return pd.concat([self.select_records(start, end) for start, end in zip(starts, ends)], ignore_index=True) if len(groups) > 0 else self.select_records(0, 0)
+
+        records = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)] + [np.empty(0, dtype=np.int64)])
+
+        return self.gps_all_df.take(records).reset_index(drop=True)
+
     def load_file_data(self, filename):
         """
-        Load GPS data from a specific CSV file.
+        Load GPS data from a specific CSV file, or from an archive file (see "convert_file"), whose records are only decoded when selected.
 
         Args:
-            filename (str): Name of the CSV file to load.
+            filename (str): Name of the CSV or archive file to load.
         """
     
-        print(f"Loading GPS data from the {filename} CSV file...")
+        print(f"Loading GPS data from the {filename} file...")
 
-        if filename.endswith(".csv"):
-            self.gps_all_df = pd.read_csv(f"{self.gps_folder_path}/{filename}")
+        self.archive = None
+
+        if filename.endswith(GPS_ARCHIVE_EXTENSION):
+            # Open the archive and index its routes and buses, without decoding the records
+            self.archive = GPSArchive(f"{self.gps_folder_path}/{filename}")
+            self.gps_all_df = None
+            self.index_archive_blocks()
 
-        # Drop unnecessary columns
-        unnecessary_columns = ['modo', 'flag_em_operacao', 'flag_linha_existe_sigmob', 'flag_trajeto_correto', 'flag_trajeto_correto_hist', 'versao']
-        self.gps_all_df = self.gps_all_df.drop(columns=unnecessary_columns)
+            print("GPS data loaded successfully!")
+            return
+
+        if filename.endswith(".csv"):
+            # Read the used columns of the file, with compact types
+            self.gps_all_df = read_gps_files([f"{self.gps_folder_path}/{filename}"])
 
         # Sort the dataframe by timestamp_gps
-        self.gps_all_df = self.gps_all_df.sort_values(by='timestamp_gps')
+        self.gps_all_df = self.gps_all_df.sort_values(by='timestamp_gps', kind='stable')
 
-        # Re-index the dataframe
-        self.gps_all_df = self.gps_all_df.reset_index(drop=True)
+        # Group the records by route and bus, and re-index the dataframe
+        self.index_groups()
 
         print("GPS data loaded successfully!")
 
@@ -56,25 +472,17 @@ class GPSHandler:
 
         print(f"Loading GPS data from {len(directory_files)} CSV files...")
 
-        self.gps_all_df = pd.DataFrame()
         self.gps_df = pd.DataFrame()
+        self.archive = None
 
-        # Iterate through all the files in the folder
-        for file in directory_files:
-            # If the file is a CSV file, read it and concatenate it to the main dataframe
-            if file.endswith(".csv"):
-                df = pd.read_csv(f"{self.gps_folder_path}/{file}")
-                self.gps_all_df = pd.concat([self.gps_all_df, df])
-
-        # Drop unnecessary columns
-        unnecessary_columns = ['modo', 'flag_em_operacao', 'flag_linha_existe_sigmob', 'flag_trajeto_correto', 'flag_trajeto_correto_hist', 'versao']
-        self.gps_all_df = self.gps_all_df.drop(columns=unnecessary_columns)
+        # Read the used columns of all the CSV files in the folder, and concatenate them once
+        self.gps_all_df = read_gps_files([f"{self.gps_folder_path}/{file}" for file in directory_files if file.endswith(".csv")])
 
         # Sort the dataframe by timestamp_gps
-        self.gps_all_df = self.gps_all_df.sort_values(by='timestamp_gps')
+        self.gps_all_df = self.gps_all_df.sort_values(by='timestamp_gps', kind='stable')
 
-        # Re-index the dataframe
-        self.gps_all_df = self.gps_all_df.reset_index(drop=True)
+        # Group the records by route and bus, and re-index the dataframe
+        self.index_groups()
 
         print("GPS data loaded successfully!")
 
@@ -86,8 +494,8 @@ class GPSHandler:
             numpy.ndarray: Array of unique route identifiers.
         """
 
-        # Get the unique routes
-        return self.gps_all_df['servico'].unique()
+        # Get the unique routes (in the order of their first record)
+        return self.routes.to_numpy()
     
     def get_routes_count(self):
         """
@@ -97,8 +505,10 @@ class GPSHandler:
             pandas.Series: Series with route identifiers as index and their counts as values.
         """
 
-        # Get the unique routes
-        return self.gps_all_df['servico'].value_counts()
+        # Get the number of records of each route from the group index
+        routes_count = pd.Series(np.diff(self.group_offsets[self.route_group_offsets]), index=pd.Index(self.routes, name='servico'), name='count')
+
+        return routes_count.sort_values(ascending=False, kind='stable')
     
     def show_routes(self):
         """
@@ -127,8 +537,8 @@ class GPSHandler:
             numpy.ndarray: Array of unique bus identifiers.
         """
 
-        # Get the unique buses
-        buses = self.gps_all_df['id_veiculo'].unique()
+        # Get the unique buses (in the order of their first record)
+        buses = self.buses.to_numpy()
 
         return buses
 
@@ -145,18 +555,21 @@ class GPSHandler:
             list: List of bus identifiers.
         """
 
-        # Get the buses for the route
-        buses = self.gps_df['id_veiculo'].unique()
-        buses_value_counts = self.gps_df['id_veiculo'].value_counts()
+        # Get the buses for the route and their number of records from the group index
+        route_groups = self.get_route_groups(route_id)
+        buses = self.group_buses[route_groups.start:route_groups.stop]
+        buses_counts = np.diff(self.group_offsets[route_groups.start:route_groups.stop + 1])
 
         total_num_buses = len(buses)
 
         # Filter the buses by the minimum and maximum values
         if filter_min is not None:
-            buses = [bus for bus in buses if buses_value_counts[bus] >= filter_min]
+            buses, buses_counts = buses[buses_counts >= filter_min], buses_counts[buses_counts >= filter_min]
         
         if filter_max is not None:
-            buses = [bus for bus in buses if buses_value_counts[bus] <= filter_max]
+            buses, buses_counts = buses[buses_counts <= filter_max], buses_counts[buses_counts <= filter_max]
+
+        buses = list(buses)
 
         print(f"Route {route_id} has {len(buses)}/{total_num_buses} elegible buses:")
         print(buses)
@@ -165,7 +578,7 @@ class GPSHandler:
 
     def get_bus_data(self, bus_id):
         """
-        Get the data for a specific bus.
+        Get the data for a specific bus (in the selected route, if any).
 
         Args:
             bus_id (str): Identifier of the bus.
@@ -174,14 +587,50 @@ class GPSHandler:
             pandas.DataFrame: Dataframe containing GPS data for the specified bus.
         """
 
-        # Get the data for a specific bus
-        self.gps_df = self.gps_all_df[self.gps_all_df['id_veiculo'] == bus_id]
+        # Without a selected route, get the data of the bus in every route (in the order of the routes) and sort it by timestamp
+        if self.route_position is None:
+            groups = [group for (_, bus), group in self.group_positions.items() if bus == bus_id]
+            self.gps_df = self.select_groups(groups).sort_values(by='timestamp_gps', kind='stable').reset_index(drop=True)
+            return self.gps_df
 
-        # Re-index the dataframe
-        self.gps_df = self.gps_df.reset_index(drop=True)
+        # Get the data for a specific bus from the group index
+        group = self.group_positions.get((self.route_position, bus_id))
+        if group is None:
+            self.gps_df = self.select_records(0, 0)
+        else:
+            self.gps_df = self.select_records(self.group_offsets[group], self.group_offsets[group + 1])
 
         return self.gps_df
     
+    def get_buses_data(self, bus_ids):
+        """
+        Get the data for several buses of the selected route, stored one after the other in the given order of the buses (and by timestamp for each bus), with the offsets of the data of each bus.
+
+        Args:
+            bus_ids (list): Identifiers of the buses.
+
+        Returns:
+            pandas.DataFrame: Dataframe containing GPS data for the specified buses.
+        """
+
+        assert self.route_position is not None, "Select a route with 'get_route_data' before getting the data of its buses!"
+
+        # Get the position of each bus in the group index
+        groups = np.array([self.group_positions[(self.route_position, bus_id)] for bus_id in bus_ids], dtype=np.int64)
+        starts, ends = self.group_offsets[groups], self.group_offsets[groups + 1]
+
+        # Get the offsets of the data of each bus
+        self.vehicle_offsets = np.zeros(len(bus_ids) + 1, dtype=np.int64)
+        self.vehicle_offsets[1:] = np.cumsum(ends - starts)
+
+        # If the buses are consecutive in the group index, their data is a single slice
+        if len(groups) > 0 and np.all(np.diff(groups) == 1):
+            self.gps_df = self.select_records(starts[0], ends[-1])
+        else:
+            self.gps_df = self.select_groups(groups)
+
+        return self.gps_df
+
     def get_route_data(self, route_id):
         """
         Get the data for a specific route.
@@ -193,53 +642,50 @@ class GPSHandler:
             pandas.DataFrame: Dataframe containing GPS data for the specified route.
         """
 
-        # Get the data for a specific route
-        self.gps_df = self.gps_all_df[self.gps_all_df['servico'] == route_id]
-
-        # Re-index the dataframe
-        self.gps_df = self.gps_df.reset_index(drop=True)
+        # Get the data for a specific route from the group index (a slice, as the records are sorted by route)
+        route_groups = self.get_route_groups(route_id)
+        self.route_position = self.routes.get_loc(route_id) if len(route_groups) > 0 else None
+        self.gps_df = self.select_records(self.group_offsets[route_groups.start], self.group_offsets[route_groups.stop]) if len(route_groups) > 0 else self.select_records(0, 0)
 
         return self.gps_df
 
-    def plot_gps_data(self, data=None, route=None, title='GPS Data', save_path=None):
+    def get_gps_plot_job(self, data=None, route=None, title='GPS Data', save_path=None):
         """
-        Plot GPS data on a map, optionally saving the plot.
+        Get the description of a plot of GPS data on a map, to be rendered by "plotting.render_plot" (or by a "plotting.PlotRenderer").
 
         Args:
             data (pandas.DataFrame, optional): Dataframe containing GPS data to plot. Defaults to None.
-            route (list, optional): List of route segments to plot as lines. Defaults to None.
+            route (np.array, optional): Route segments to plot as lines, with shape (S, 2, 2). Defaults to None.
             title (str, optional): Title of the plot. Defaults to 'GPS Data'.
             save_path (str, optional): Path to save the plot image. Defaults to None.
+
+        Returns:
+            plotting.PlotJob: The description of the plot, with copies of the coordinates.
         """
 
         if data is None:
             data = self.gps_df
 
-        fig, ax = plt.subplots(1, 1, figsize=(10, 8))
-
-        # Plot the GPS data
-        data.plot(x='longitude', y='latitude', ax=ax, color='blue', alpha=0.3, kind='scatter')
+        # Get the GPS coordinates
+        scatters = [(np.column_stack((data['longitude'].to_numpy(np.float64), data['latitude'].to_numpy(np.float64))), {"color": 'blue', "alpha": 0.3, "s": 20})]
 
-        # Plot the route segments as a line (if available)
-        if route is not None:
-            for segment in route:
-                x, y = zip(*segment)
-                ax.plot(x, y, color='black')
+        # Get the route segments, drawn as lines (if available)
+        line_collections = [(np.array(route, dtype=np.float64), {"color": 'black'})] if route is not None else []
 
-        ax.set_xlabel("Longitude")
-        ax.set_ylabel("Latitude")
-        ax.set_aspect('equal')
+        return plotting.PlotJob(title, save_path, scatters, line_collections, False)
 
-        plt.title(title)
-        plt.grid()
+    def plot_gps_data(self, data=None, route=None, title='GPS Data', save_path=None):
+        """
+        Plot GPS data on a map, optionally saving the plot.
 
-        if save_path:
-            plt.savefig(save_path)
-        else:
-            plt.show()
+        Args:
+            data (pandas.DataFrame, optional): Dataframe containing GPS data to plot. Defaults to None.
+            route (np.array, optional): Route segments to plot as lines, with shape (S, 2, 2). Defaults to None.
+            title (str, optional): Title of the plot. Defaults to 'GPS Data'.
+            save_path (str, optional): Path to save the plot image. Defaults to None.
+        """
 
-        # Close the plot
-        plt.close()
+        plotting.render_plot(self.get_gps_plot_job(data, route, title=title, save_path=save_path))
 
     def filter_gps_coordinates(self, gtfs, tolerance_meters=100):
         """
@@ -254,7 +700,7 @@ class GPSHandler:
         """
 
         # Get the route directions
-        self.route_directions = gtfs.route_stops['direction_id'].unique()
+        self.route_directions = gtfs.get_route_directions()
 
         # Get the route segments set for each direction
         route_segments_by_direction = [gtfs.get_route_segments_by_direction(direction) for direction in self.route_directions]
@@ -262,23 +708,15 @@ class GPSHandler:
         # Iterate over each direction and the corresponding route segments
         for direction, route_segments in zip(self.route_directions, route_segments_by_direction):
 
-            # Get the minimum distance from each point to the route
-            min_distances, closest_segment_indexes = utils.closest_projection(self.gps_df[['longitude', 'latitude']].values, route_segments)
-
-            # Store the minimum distance and the closest segment index on the dataframe
-            self.gps_df[f'min_distance_{direction}'] = min_distances
-            self.gps_df[f'closest_segment_index_{direction}'] = closest_segment_indexes
+            # Get the spatial index of the route segments (built once per route and direction)
+            segment_grid = gtfs.get_route_segment_grid_by_direction(direction)
 
-        # Get the mean latitude for distance conversion
-        mean_latitude = self.gps_df['latitude'].mean()
+            # Get the minimum distance from each point to the route, in the local metric frame of the segments
+            min_distances, closest_segment_indexes = utils.closest_projection(utils.project_to_local_meters(self.gps_df['longitude'], self.gps_df['latitude']), route_segments, segment_grid)
 
-        # Iterate over the directions, converting the values obtained to meters
-        for direction in self.route_directions:
-            min_distances = np.array(self.gps_df[f'min_distance_{direction}'])
-            min_distances = np.sqrt(min_distances) # Take the sqrt cause "closest_projection" reports the squared distance for optimization
-            
-            # Convert the minimum distances measures from degress to meters
-            self.gps_df[f'min_distance_{direction}'] = utils.degrees_to_meters(min_distances, mean_latitude)
+            # Store the minimum distance in meters (taking the sqrt cause "closest_projection" reports the squared distance for optimization) and the closest segment index on the dataframe
+            self.gps_df[f'min_distance_{direction}'] = np.sqrt(min_distances)
+            self.gps_df[f'closest_segment_index_{direction}'] = closest_segment_indexes
 
         # For each gps point, take the mimimum distance from the route among all directions
         min_distances = self.gps_df[[f'min_distance_{direction}' for direction in self.route_directions]].min(axis=1)
@@ -299,54 +737,150 @@ class GPSHandler:
         # Iterate over each direction and the corresponding route segments
         for direction in self.route_directions:
 
-            # Get the shape for the direction
-            route_shape = gtfs.get_shape_by_direction(direction)
+            # Get the segments of the direction and the distance traveled at their ends
+            route_segments = gtfs.get_route_segments_by_direction(direction)
+            route_segment_distances = gtfs.get_route_segment_distances_by_direction(direction)
 
-            # coord_x, coord_y, distance
-            route_points_array = np.array(route_shape[['shape_pt_lon', 'shape_pt_lat', 'shape_dist_traveled']], dtype=np.float32)
-
-            # Get the GPS point coordinates and the closest segment index for each GPS point
-            gps_points = np.array(self.gps_df[['longitude', 'latitude', f'closest_segment_index_{direction}']])
+            # Get the GPS point coordinates (in the local metric frame of the segments) and the closest segment index for each GPS point
+            gps_points = utils.project_to_local_meters(self.gps_df['longitude'], self.gps_df['latitude'])
+            closest_segment_indexes = self.gps_df[f'closest_segment_index_{direction}'].to_numpy()
 
             results = np.zeros(gps_points.shape[0], dtype=np.float32)
 
             for i, point in enumerate(gps_points):
 
-                closest_segment_index = int(point[2])
-                closest_segment_start = route_points_array[closest_segment_index]
-                closest_segment_end = route_points_array[closest_segment_index + 1]
-
-                # Get the distance from the start of the segment
-                results[i] = utils.distance_travelled(point[0], point[1],
-                                                    closest_segment_start[0], closest_segment_start[1], closest_segment_start[2],
-                                                    closest_segment_end[0], closest_segment_end[1], closest_segment_end[2])
+                # Get the distance from the start of the route until the projection on the closest segment
+                _, results[i] = utils.project_point_on_route_segment(point[0], point[1], route_segments, route_segment_distances, closest_segment_indexes[i])
                 
             self.gps_df[f'distance_from_start_{direction}'] = results
 
-    def split_file(self, file_path, file_name):
+    def project_on_route(self, gtfs, tolerance_meters=100, parallel=False, incremental=False, window=32, vehicle_offsets=None):
+        """
+        Project the GPS coordinates on the route, flagging the points near the route and calculating their distance from the start of each direction.
+        This is equivalent to "filter_gps_coordinates" followed by "get_distance_from_start", with a single kernel call per direction.
+
+        Args:
+            gtfs (object): GTFS data object containing route information.
+            tolerance_meters (int, optional): Tolerance distance in meters for filtering. Records that the minimum distance to the route is less than this value are considered to be on the route. Defaults to 100.
+            parallel (bool, optional): Whether to split the points among threads (see "utils.set_num_threads"). The results are the same either way. Defaults to False.
+            incremental (bool, optional): Whether to search each point around the segment matched to the previous one, falling back to the search on the whole route when no segment within the tolerance is found (see "utils.closest_projection_incremental"). Defaults to False.
+            window (int, optional): Number of segments searched before and after the previous match, when incremental. Defaults to 32.
+            vehicle_offsets (np.array, optional): Offsets of the GPS points of each vehicle, when the data of several vehicles is stored one after the other, so the incremental matching restarts at the first point of each one. Defaults to None (a single vehicle).
+
+        Returns:
+            pandas.DataFrame: Dataframe with filtered GPS data.
+        """
+
+        assert not (parallel and incremental), "The incremental matching depends on the previous point and can't be run in parallel!"
+
+        # Get the route directions
+        self.route_directions = gtfs.get_route_directions()
+
+        # Choose between the serial and the parallel kernel
+        closest_projection_with_distance = utils.closest_projection_with_distance_parallel if parallel else utils.closest_projection_with_distance
+
+        # Project the GPS points into the local metric frame of the route segments
+        gps_points = utils.project_to_local_meters(self.gps_df['longitude'], self.gps_df['latitude'])
+
+        # By default, all the points belong to a single vehicle
+        if vehicle_offsets is None:
+            vehicle_offsets = [0, len(gps_points)]
+
+        distances_from_start = {}
+        self.incremental_fallbacks = {}
+        for direction in self.route_directions:
+
+            # Get the segments, their distances and spatial index (built once per route and direction)
+            route_segments = gtfs.get_route_segments_by_direction(direction)
+            route_segment_distances = gtfs.get_route_segment_distances_by_direction(direction)
+            segment_grid = gtfs.get_route_segment_grid_by_direction(direction)
+
+            # Get the minimum distance from each point to the route, the closest segment and the distance from the start of the route
+            if incremental:
+                # Match the points of each vehicle separately, as each one depends on the previous point of the same vehicle
+                vehicle_results = [utils.closest_projection_incremental(gps_points[start:end], route_segments, route_segment_distances, tolerance_meters, window, segment_grid) for start, end in zip(vehicle_offsets[:-1], vehicle_offsets[1:])]
+                min_distances, closest_segment_indexes, _, distances_from_start[direction] = [np.concatenate([result[k] for result in vehicle_results]) for k in range(4)]
+                self.incremental_fallbacks[direction] = sum(result[4] for result in vehicle_results)
+            else:
+                min_distances, closest_segment_indexes, _, distances_from_start[direction] = closest_projection_with_distance(gps_points, route_segments, route_segment_distances, segment_grid)
+
+            # Store the minimum distance (in meters) and the closest segment index on the dataframe
+            self.gps_df[f'min_distance_{direction}'] = np.sqrt(min_distances)
+            self.gps_df[f'closest_segment_index_{direction}'] = closest_segment_indexes
+
+        # For each gps point, take the mimimum distance from the route among all directions
+        min_distances = self.gps_df[[f'min_distance_{direction}' for direction in self.route_directions]].min(axis=1)
+
+        # Assign the flag 'in_route' column based on the tolerance distance
+        self.gps_df['in_route'] = min_distances < tolerance_meters
+
+        # Store the distances from the start after the flag, keeping the column order of the two-step process
+        for direction in self.route_directions:
+            self.gps_df[f'distance_from_start_{direction}'] = distances_from_start[direction]
+
+        # Report how often the incremental matching needed the search on the whole route
+        if incremental:
+            for direction, num_fallbacks in self.incremental_fallbacks.items():
+                print(f"Incremental matching fallbacks (direction {direction}): {num_fallbacks}/{len(gps_points) - np.count_nonzero(np.diff(vehicle_offsets))} points")
+
+        return self.gps_df
+
+    def split_file(self, file_path, file_name, chunk_size=GPS_SPLIT_CHUNK_SIZE):
         """
         Split a GPS data file into separate files by date and delete the original file.
+        The file is read in chunks, and the records of each chunk are appended to the file of their date, so only one chunk is held in memory.
 
         Args:
             file_path (str): Path to the folder containing the file.
             file_name (str): Name of the file to split.
+            chunk_size (int, optional): Number of records read at a time. Defaults to GPS_SPLIT_CHUNK_SIZE.
         """
 
         # Split the file into the differente dates "YYYY-MM-DD" and delete the original file
-        raw_file = pd.read_csv(f"{file_path}/{file_name}")
+        # The values are read as text, so they are written back unchanged
+        raw_chunks = pd.read_csv(f"{file_path}/{file_name}", dtype=str, na_filter=False, chunksize=chunk_size)
+
+        # Open files of the dates found so far (buffered, and written with the header when opened)
+        date_files = {}
+
+        try:
+            for raw_chunk in raw_chunks:
+                # Append the records of each date of the chunk (in their order in the file) to the file of the date
+                for date, date_chunk in raw_chunk.groupby('data', sort=False):
+                    if date not in date_files:
+                        date_files[date] = open(f"{file_path}/{date}.csv", "w", buffering=2**20, newline="")
+                        date_chunk.to_csv(date_files[date], index=False)
+                    else:
+                        date_chunk.to_csv(date_files[date], index=False, header=False)
+        finally:
+            for date_file in date_files.values():
+                date_file.close()
+
+            raw_chunks.close()
 
-        # Get the unique dates
-        dates = raw_file['data'].unique()
+        # Delete the original file
+        os.remove(f"{file_path}/{file_name}")
 
-        # Iterate over the dates
-        for date in dates:
-            date_file = raw_file[raw_file['data'] == date]
+    def convert_file(self, file_path, file_name):
+        """
+        Convert a GPS data CSV file into an archive file with the same name (see "write_gps_archive"), keeping the CSV file.
+        The archive is read by "load_file_data" without parsing the text again, and the records of a bus can be decoded without reading the rest of the file.
+
+        Args:
+            file_path (str): Path to the folder containing the file.
+            file_name (str): Name of the CSV file to convert.
 
-            # Save the file
-            date_file.to_csv(f"{file_path}/{date}.csv", index=False)
+        Returns:
+            str: Name of the archive file.
+        """
 
-        # Delete the original file
-        os.remove(f"{file_path}/{file_name}")
+        # Load and index the file with another handler, so the data loaded in this one is kept
+        gps = GPSHandler(file_path)
+        gps.load_file_data(file_name)
 
+        archive_name = os.path.splitext(file_name)[0] + GPS_ARCHIVE_EXTENSION
+        num_blocks, max_coordinate_error = write_gps_archive(gps.gps_all_df, gps.routes, gps.buses, f"{file_path}/{archive_name}")
 
+        print(f"File {file_name} converted to {archive_name}: {len(gps.gps_all_df)} records in {num_blocks} blocks, max coordinate rounding error of {max_coordinate_error:.1e} degrees")
 
+        return archive_name
@@ -1,43 +1,498 @@
+import json
+import os
+import shutil
+
 import geopandas as gpd
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+import src.plotting as plotting
 import src.utils as utils
 
+# GTFS tables loaded by the handler, mapped to the files that contain them
+# For the tables used by the pipeline, only the used columns are read, with compact types (categories for the ids)
+GTFS_TABLES = {
+    "agencies": {"file": "agency.txt"},
+    "calendar": {"file": "calendar.txt"},
+    "calendar_dates": {"file": "calendar_dates.txt"},
+    "fare_tributtes": {"file": "fare_attributes.txt"},
+    "fare_rules": {"file": "fare_rules.txt"},
+    "feed_info": {"file": "feed_info.txt"},
+    "frequencies": {"file": "frequencies.txt"},
+    "routes": {
+        "file": "routes.txt",
+        "dtype": {"route_id": "category", "route_short_name": "category"},
+    },
+    "shapes": {
+        "file": "shapes.txt",
+        "dtype": {"shape_id": "category", "shape_pt_lat": "float64", "shape_pt_lon": "float64", "shape_dist_traveled": "float64"},
+    },
+    "stop_times": {
+        "file": "stop_times.txt",
+        "dtype": {"trip_id": "category", "stop_id": "category", "stop_sequence": "int32", "shape_dist_traveled": "float64"},
+    },
+    "stops": {
+        "file": "stops.txt",
+        "dtype": {"stop_id": "category", "stop_name": "category", "stop_lat": "float64", "stop_lon": "float64"},
+    },
+    "trips": {
+        "file": "trips.txt",
+        "dtype": {"trip_id": "category", "route_id": "category", "direction_id": "int8", "shape_id": "category"},
+    },
+}
+
+# GTFS tables the route index (and the route arrays compiled from it) is built from
+GTFS_ROUTE_TABLES = ["routes", "trips", "stop_times", "stops", "shapes"]
+
+# File of the snapshot folder where the hashes of the GTFS files are cached, with the size and modification time of each file when it was hashed
+GTFS_FILE_HASHES = "file_hashes.json"
+
 class GTFSHandler:
-    def __init__(self, gtfs_folder_path):
+    def __init__(self, gtfs_folder_path, snapshot_folder_path=None, use_snapshot=True, simplify_tolerance_meters=None):
         """
         Initialize the GTFSHandler with the path to the folder containing GTFS data files.
 
         Args:
             gtfs_folder_path (str): Path to the folder containing GTFS data files.
+            snapshot_folder_path (str, optional): Path to the folder where the binary snapshots of the GTFS data are stored. Defaults to a ".snapshots" folder inside the GTFS folder.
+            use_snapshot (bool, optional): Whether to load the data from (and save it to) a binary snapshot, instead of always parsing the text files. Defaults to True.
+            simplify_tolerance_meters (float, optional): Tolerance in meters used to simplify the shapes matched against the GPS data (see "simplify_shape"). Defaults to None, which keeps every shape point.
         """
 
         self.gtfs_folder_path = gtfs_folder_path
+        self.snapshot_folder_path = snapshot_folder_path if snapshot_folder_path is not None else f"{gtfs_folder_path}/.snapshots"
+        self.use_snapshot = use_snapshot
+        self.simplify_tolerance_meters = simplify_tolerance_meters
+
+        # Hashes of the GTFS files computed (or read from the snapshot folder) by this handler, by the path, size and modification time of each file
+        self.file_hashes = {}
 
         self.load_data()
 
-    def load_data(self):
+    def __getattr__(self, name):
+        """
+        Load a GTFS table on its first access.
+
+        Args:
+            name (str): Name of the attribute.
+
+        Returns:
+            pandas.DataFrame: Dataframe with the table data.
+        """
+
+        if name not in GTFS_TABLES:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        # Store the table as a regular attribute, so it is loaded only once
+        table = self.load_table(name)
+        setattr(self, name, table)
+
+        return table
+
+    def load_data(self, table_names=()):
         """
         Load GTFS data from the specified folder.
+        The tables are loaded on their first access, so only the tables (and columns) used are read.
+
+        Args:
+            table_names (list, optional): Names of the tables to be loaded right away. Defaults to none.
         """
 
-        self.agencies = pd.read_csv(f"{self.gtfs_folder_path}/agency.txt")
-        self.calendar = pd.read_csv(f"{self.gtfs_folder_path}/calendar.txt")
-        self.calendar_dates = pd.read_csv(f"{self.gtfs_folder_path}/calendar_dates.txt")
-        self.fare_tributtes = pd.read_csv(f"{self.gtfs_folder_path}/fare_attributes.txt")
-        self.fare_rules = pd.read_csv(f"{self.gtfs_folder_path}/fare_rules.txt")
-        self.feed_info = pd.read_csv(f"{self.gtfs_folder_path}/feed_info.txt")
-        self.frequencies = pd.read_csv(f"{self.gtfs_folder_path}/frequencies.txt")
-        self.routes = pd.read_csv(f"{self.gtfs_folder_path}/routes.txt")
-        self.shapes = pd.read_csv(f"{self.gtfs_folder_path}/shapes.txt")
-        self.stop_times = pd.read_csv(f"{self.gtfs_folder_path}/stop_times.txt")
-        self.stops = pd.read_csv(f"{self.gtfs_folder_path}/stops.txt")
-        self.trips = pd.read_csv(f"{self.gtfs_folder_path}/trips.txt")
+        # Discard the tables loaded before, so they are reloaded from the folder
+        for table_name in GTFS_TABLES:
+            self.__dict__.pop(table_name, None)
+
+        # Index of the GTFS data by route short name, built on the first route selection
+        self.route_index = None
+
+        for table_name in table_names:
+            getattr(self, table_name)
 
         print("GTFS data loaded successfully!")
 
+    def load_table(self, table_name):
+        """
+        Load a GTFS table, from its binary snapshot if snapshots are enabled.
+        The snapshot is compiled the first time the table file is seen.
+
+        Args:
+            table_name (str): Name of the table to load.
+
+        Returns:
+            pandas.DataFrame: Dataframe with the table data.
+        """
+
+        table_spec = GTFS_TABLES[table_name]
+        snapshot_path = self.get_table_snapshot_path(table_name) if self.use_snapshot else None
+
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            return self.load_table_snapshot(snapshot_path)
+
+        # Parse the text file, reading only the columns with a defined type (or all of them, if none is defined)
+        dtype = table_spec.get("dtype")
+        table = pd.read_csv(f"{self.gtfs_folder_path}/{table_spec['file']}", usecols=list(dtype) if dtype else None, dtype=dtype)
+
+        # Compile the snapshot to be used on the next accesses
+        if snapshot_path is not None:
+            self.save_table_snapshot(table, snapshot_path)
+
+        return table
+
+    def get_table_snapshot_path(self, table_name):
+        """
+        Get the path of the snapshot of a GTFS table, identified by the hash of the table file and of the columns and types read.
+
+        Args:
+            table_name (str): Name of the table.
+
+        Returns:
+            str: Path to the snapshot folder.
+        """
+
+        table_spec = GTFS_TABLES[table_name]
+
+        # Hash the table file, so any change in the data leads to a new snapshot
+        file_hash = self.get_file_hash(table_spec['file'])
+        # Hash the columns and types read, so any change in them also leads to a new snapshot
+        spec_hash = utils.hash_files([], extra=json.dumps(table_spec, sort_keys=True))
+
+        return f"{self.snapshot_folder_path}/{table_name}.{file_hash[:32]}.{spec_hash[:8]}"
+
+    def get_file_hash(self, file_name):
+        """
+        Get the hash of a GTFS file (see "utils.hash_files"), reading the file only if it changed since it was last hashed.
+        The hashes are cached by the path, size and modification time of the files, in the handler and (if snapshots are enabled) in the snapshot folder, so the next runs don't read the files again either.
+
+        Args:
+            file_name (str): Name of the file in the GTFS folder.
+
+        Returns:
+            str: The hexadecimal SHA-256 digest of the file.
+        """
+
+        file_path = os.path.abspath(f"{self.gtfs_folder_path}/{file_name}")
+        file_stat = os.stat(file_path)
+        key = (file_path, file_stat.st_size, file_stat.st_mtime_ns)
+
+        if key in self.file_hashes:
+            return self.file_hashes[key]
+
+        # Get the hash cached in the snapshot folder, if the file didn't change since it was hashed
+        hashes_path = f"{self.snapshot_folder_path}/{GTFS_FILE_HASHES}"
+        cached_hashes = self.load_file_hashes(hashes_path) if self.use_snapshot else {}
+        cached_hash = cached_hashes.get(file_path)
+
+        if cached_hash is not None and (cached_hash["size"], cached_hash["mtime_ns"]) == key[1:]:
+            self.file_hashes[key] = cached_hash["hash"]
+            return cached_hash["hash"]
+
+        # Otherwise, hash the file and cache its hash
+        self.file_hashes[key] = utils.hash_files([file_path])
+
+        if self.use_snapshot:
+            cached_hashes[file_path] = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns, "hash": self.file_hashes[key]}
+            self.save_file_hashes(cached_hashes, hashes_path)
+
+        return self.file_hashes[key]
+
+    def load_file_hashes(self, hashes_path):
+        """
+        Load the hashes of the GTFS files cached in the snapshot folder (none if the file doesn't exist or can't be read).
+
+        Args:
+            hashes_path (str): Path to the file of the cached hashes.
+
+        Returns:
+            dict: Size, modification time and hash of each file, by its path.
+        """
+
+        try:
+            with open(hashes_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_file_hashes(self, file_hashes, hashes_path):
+        """
+        Save the hashes of the GTFS files to the snapshot folder.
+
+        Args:
+            file_hashes (dict): Size, modification time and hash of each file, by its path.
+            hashes_path (str): Path to the file of the cached hashes.
+        """
+
+        # Write to a temporary file, renamed at the end, so an interrupted (or concurrent) run never leaves a partial file
+        temporary_path = f"{hashes_path}.{os.getpid()}.tmp"
+
+        try:
+            os.makedirs(os.path.dirname(hashes_path), exist_ok=True)
+            with open(temporary_path, "w") as file:
+                json.dump(file_hashes, file)
+            os.replace(temporary_path, hashes_path)
+
+        except OSError as e:
+            # The cache is only an optimization, so the hashes are computed again without it
+            print(f"Error saving the GTFS file hashes {hashes_path}: {e}")
+
+    def save_table_snapshot(self, table, snapshot_path):
+        """
+        Save a table as a binary snapshot, with one NumPy file per column.
+        Text columns are stored as integer codes and a table of unique strings (categorical encoding).
+
+        Args:
+            table (pandas.DataFrame): Dataframe with the table data.
+            snapshot_path (str): Path to the snapshot folder.
+        """
+
+        # Write to a temporary folder, renamed at the end, so an interrupted (or concurrent) run never leaves a partial snapshot
+        temporary_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        os.makedirs(temporary_path, exist_ok=True)
+
+        try:
+            columns = []
+
+            for i, column in enumerate(table.columns):
+                values = table[column]
+
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    # Store the codes (-1 for missing values) and the categories of the categorical columns
+                    codes, categories, kind = values.cat.codes.to_numpy(), values.cat.categories, "categorical"
+                elif values.dtype == object:
+                    # Encode the text columns in the same way
+                    codes, categories = pd.factorize(values)
+                    kind = "text"
+                else:
+                    np.save(f"{temporary_path}/{i}.npy", values.to_numpy())
+                    columns.append({"name": column, "kind": "array"})
+                    continue
+
+                if len(categories) > 0 and pd.api.types.infer_dtype(categories) != 'string':
+                    raise ValueError(f"The column {column} has values that are not strings.")
+
+                np.save(f"{temporary_path}/{i}.npy", codes.astype(np.int32))
+                np.save(f"{temporary_path}/{i}.categories.npy", np.array(categories, dtype=str))
+                columns.append({"name": column, "kind": kind})
+
+            with open(f"{temporary_path}/columns.json", "w") as file:
+                json.dump(columns, file)
+
+            os.rename(temporary_path, snapshot_path)
+
+        except (OSError, ValueError) as e:
+            # The snapshot is only an optimization, so the data is still usable without it
+            print(f"Error saving the GTFS snapshot {snapshot_path}: {e}")
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+    def load_table_snapshot(self, snapshot_path):
+        """
+        Load a table from a binary snapshot, memory-mapping its columns.
+
+        Args:
+            snapshot_path (str): Path to the snapshot folder.
+
+        Returns:
+            pandas.DataFrame: Dataframe with the table data.
+        """
+
+        with open(f"{snapshot_path}/columns.json") as file:
+            columns = json.load(file)
+
+        data = {}
+
+        for i, column in enumerate(columns):
+            values = np.load(f"{snapshot_path}/{i}.npy", mmap_mode='r')
+
+            if column["kind"] == "categorical":
+                # Rebuild the categorical column from the codes, without decoding the strings
+                values = pd.Categorical.from_codes(values, categories=np.load(f"{snapshot_path}/{i}.categories.npy").astype(object))
+            elif column["kind"] == "text":
+                # Decode the strings, mapping the code -1 to a missing value
+                categories = np.load(f"{snapshot_path}/{i}.categories.npy").astype(object)
+                values = np.append(categories, np.nan)[values]
+
+            data[column["name"]] = values
+
+        return pd.DataFrame(data)
+
+    def build_route_index(self):
+        """
+        Build an index of the GTFS data by route short name, grouping each table only once.
+        Each route is mapped to its trips, stops (with sequences and distances) and shapes for each direction, so selecting a route is a dictionary lookup.
+        """
+
+        print("Building the GTFS route index...")
+
+        # Get the positions of the rows of each table, grouped by the key used to filter them
+        routes_positions = self.routes.groupby('route_short_name', sort=False, observed=True).indices
+        trips_positions = self.trips.groupby('route_id', sort=False, observed=True).indices
+        shapes_positions = self.shapes.groupby('shape_id', sort=False, observed=True).indices
+
+        # Group the stop times by the route of their trips
+        trip_route_ids = self.stop_times['trip_id'].map(self.trips.drop_duplicates(subset='trip_id').set_index('trip_id')['route_id'])
+        stop_times_positions = self.stop_times.groupby(trip_route_ids, sort=False, observed=True).indices
+
+        # Index the stops by their id
+        stops_index = pd.Index(np.asarray(self.stops['stop_id']))
+
+        def get_rows(df, positions_by_key, keys):
+            # Get the rows of the given keys, keeping the original order of the table
+            positions = [positions_by_key[key] for key in keys if key in positions_by_key]
+            positions = np.sort(np.concatenate(positions)) if positions else np.array([], dtype=np.int64)
+            return df.iloc[positions]
+
+        # Plain values of the categories of each table column, decoded only once (with a missing value at the end, for the code -1)
+        decoded_categories = {}
+
+        def decode_categories(df, table_name):
+            # Convert the categorical columns of a (small) slice to plain values, so merging slices of different tables doesn't recode their categories
+            df = df.copy()
+            for column in df.columns:
+                if isinstance(df[column].dtype, pd.CategoricalDtype):
+                    if (table_name, column) not in decoded_categories:
+                        decoded_categories[(table_name, column)] = np.append(np.asarray(df[column].cat.categories, dtype=object), np.nan)
+                    df[column] = decoded_categories[(table_name, column)][df[column].cat.codes.to_numpy()]
+            return df
+
+        self.route_index = {}
+
+        for route_short_name, route_positions in routes_positions.items():
+
+            # The first route with the short name is used
+            route = self.routes.iloc[route_positions]
+            route_id = route['route_id'].values[0]
+
+            # Get the trips and stop times of the route
+            route_trips = get_rows(self.trips, trips_positions, [route_id])
+            route_stop_times = get_rows(self.stop_times, stop_times_positions, [route_id])
+
+            # Get the stops of the route
+            route_stop_ids = np.asarray(route_stop_times['stop_id'].unique())
+            stops_positions = stops_index.get_indexer(route_stop_ids)
+            route_stops = self.stops.iloc[np.sort(stops_positions[stops_positions >= 0])]
+
+            # Get a summary of the stops data merging the stop times and trips
+            merged_df = pd.merge(decode_categories(route_stop_times, "stop_times"), decode_categories(route_trips[["trip_id", "direction_id", "shape_id"]], "trips"), on='trip_id')
+            merged_df = pd.merge(merged_df, decode_categories(route_stops[["stop_id", "stop_name", "stop_lat", "stop_lon"]], "stops"), on='stop_id')
+            # Drop duplicates and unnecessary columns
+            merged_df = merged_df.drop(columns=["trip_id", "arrival_time", "departure_time", "stop_headsign", "timepoint"], errors="ignore")
+            # Rename the shape_dist_traveled column
+            merged_df = merged_df.rename(columns={"shape_dist_traveled": "stop_distance"})
+            merged_df = merged_df.drop_duplicates()
+            # Sort by direction_id and stop_sequence
+            merged_df = merged_df.sort_values(by=["direction_id", "stop_sequence"])
+
+            # Get the shapes of the route, and of each direction
+            route_shape_ids = np.asarray(route_trips['shape_id'].unique())
+            route_shapes = get_rows(self.shapes, shapes_positions, route_shape_ids)
+
+            shapes_by_direction = {}
+            simplified_shapes_by_direction = {}
+            segments_by_direction = {}
+            segment_distances_by_direction = {}
+
+            # Number of segments of the route before and after the simplification of the shapes, and the largest distance error it introduced
+            simplification = {'num_segments': 0, 'num_simplified_segments': 0, 'max_distance_error': 0.0}
+
+            for direction_id in route_trips['direction_id'].unique():
+                shape_ids = np.asarray(route_trips[route_trips['direction_id'] == direction_id]['shape_id'].unique())
+                shapes = get_rows(self.shapes, shapes_positions, shape_ids)
+                shapes_by_direction[direction_id] = shapes
+
+                # Simplify the shapes of the direction, if a tolerance was set
+                if self.simplify_tolerance_meters is not None:
+                    simplified_shapes, distance_error = self.simplify_shape(shapes, self.simplify_tolerance_meters)
+                    simplification['max_distance_error'] = max(simplification['max_distance_error'], distance_error)
+                else:
+                    simplified_shapes = shapes
+
+                simplification['num_segments'] += len(shapes) - shapes['shape_id'].nunique()
+                simplification['num_simplified_segments'] += len(simplified_shapes) - simplified_shapes['shape_id'].nunique()
+                simplified_shapes_by_direction[direction_id] = simplified_shapes
+
+                # Build the segments of the direction once, in the local metric frame, as contiguous float32 arrays shared by every bus of the route
+                segments, segment_distances = utils.build_shape_segments(utils.project_to_local_meters(simplified_shapes['shape_pt_lon'], simplified_shapes['shape_pt_lat']).astype(np.float32),
+                                                                         simplified_shapes['shape_dist_traveled'].to_numpy(np.float32),
+                                                                         simplified_shapes['shape_id'].cat.codes.to_numpy())
+                segments_by_direction[direction_id] = segments
+                segment_distances_by_direction[direction_id] = segment_distances
+
+            # Segments of the whole route (used for plotting)
+            route_shape_segments, _ = utils.build_shape_segments(route_shapes[['shape_pt_lon', 'shape_pt_lat']].to_numpy(),
+                                                                 route_shapes['shape_dist_traveled'].to_numpy(),
+                                                                 route_shapes['shape_id'].cat.codes.to_numpy())
+
+            self.route_index[route_short_name] = {
+                'route': route,
+                'route_id': route_id,
+                'route_trips': route_trips,
+                'route_stop_times': route_stop_times,
+                'route_stop_ids': route_stop_ids,
+                # Store the stops as geopandas dataframe
+                'route_stops': gpd.GeoDataFrame(merged_df, geometry=gpd.points_from_xy(merged_df.stop_lon, merged_df.stop_lat)),
+                'route_shape_ids': route_shape_ids,
+                'route_shapes': route_shapes,
+                'route_shape_points': route_shapes[['shape_pt_lon', 'shape_pt_lat']].to_numpy(),
+                'route_shape_segments': route_shape_segments,
+                'shapes_by_direction': shapes_by_direction,
+                'simplified_shapes_by_direction': simplified_shapes_by_direction,
+                'segments_by_direction': segments_by_direction,
+                'segment_distances_by_direction': segment_distances_by_direction,
+                'simplification': simplification,
+                # Spatial indexes of the route segments, built on demand for each direction
+                'segment_grids': {},
+            }
+
+        print(f"GTFS route index built with {len(self.route_index)} routes!")
+
+        if self.simplify_tolerance_meters is not None:
+            report = self.get_simplification_report()
+            print(f"Shapes simplified with a tolerance of {self.simplify_tolerance_meters} meters: {report['num_segments'].sum()} -> {report['num_simplified_segments'].sum()} segments, max distance error of {report['max_distance_error'].max():.2f} meters")
+
+    def simplify_shape(self, shapes, tolerance_meters):
+        """
+        Simplify a set of shapes with the Douglas-Peucker algorithm, keeping the first and last point of each shape.
+        The points kept are rows of the original shapes, so their "shape_dist_traveled" values are preserved.
+        A point is only removed if the distance interpolated for it on the simplified shape differs from its "shape_dist_traveled" by no more than the tolerance, so the returned error is never above it.
+
+        Args:
+            shapes (pandas.DataFrame): Dataframe with the shape points, ordered by shape and point sequence.
+            tolerance_meters (float): Maximum distance in meters from a removed point to the simplified shape, and maximum error of its interpolated distance (in the "shape_dist_traveled" units, meters in the GTFS data).
+
+        Returns:
+            tuple: Dataframe with the points kept and the largest difference (in the "shape_dist_traveled" units) between the original distance of a removed point and the distance interpolated for it on the simplified shape.
+        """
+
+        # Simplify the shapes in the local metric frame, where the tolerance applies directly
+        shape_points = utils.project_to_local_meters(shapes['shape_pt_lon'], shapes['shape_pt_lat'])
+        shape_distances = shapes['shape_dist_traveled'].to_numpy(np.float64)
+        shape_ids = shapes['shape_id'].cat.codes.to_numpy()
+
+        if len(shapes) == 0:
+            return shapes, 0.0
+
+        keep = utils.simplify_shapes(shape_points, shape_distances, shape_ids, tolerance_meters)
+        distance_error = utils.simplification_distance_error(shape_points, shape_distances, keep)
+
+        return shapes[keep], distance_error
+
+    def get_simplification_report(self):
+        """
+        Get the reduction of the number of segments of each route by the simplification of its shapes (see "simplify_shape"), building the route index if needed.
+
+        Returns:
+            pandas.DataFrame: Dataframe indexed by the route short name, with the number of segments of the route before and after the simplification, their ratio and the largest distance error introduced (in the "shape_dist_traveled" units).
+        """
+
+        # Build the route index, where the shapes are simplified
+        if self.route_index is None:
+            self.build_route_index()
+
+        report = pd.DataFrame([route_data['simplification'] for route_data in self.route_index.values()], index=pd.Index(list(self.route_index), name='route_short_name'),
+                              columns=['num_segments', 'num_simplified_segments', 'max_distance_error'])
+        report['reduction'] = report['num_segments'] / report['num_simplified_segments'].where(report['num_simplified_segments'] > 0)
+
+        return report
+
     def filter_by_route(self, route_short_name):
         """
         Filter the GTFS data by the specified route short name.
@@ -47,40 +502,54 @@ class GTFSHandler:
         """
 
         print(f"Filtering the data by the route {route_short_name}...")
-        print("DF ROUTE ID HEAD:", self.routes[self.routes['route_short_name'] == route_short_name].head())
-
-        # Get the route id
-        self.route_id = self.routes[self.routes['route_short_name'] == route_short_name]['route_id'].values[0]
-
-        # Filter the trips by the route id
-        self.route_trips = self.trips[self.trips['route_id'] == self.route_id]
-
-        # Filter the stops data by the route trips
-        self.route_stop_times = self.stop_times[self.stop_times['trip_id'].isin(self.route_trips['trip_id'])]
-        self.route_stop_ids = self.route_stop_times['stop_id'].unique()
-        self.route_stops = self.stops[self.stops['stop_id'].isin(self.route_stop_ids)]
-
-        # Get a summary of the stops data merging the stop times and trips
-        merged_df = pd.merge(self.route_stop_times, self.route_trips[["trip_id", "direction_id", "shape_id"]], on='trip_id')
-        merged_df = pd.merge(merged_df, self.route_stops[["stop_id", "stop_name", "stop_lat", "stop_lon"]], on='stop_id')
-        # Drop duplicates and unnecessary columns
-        merged_df = merged_df.drop(columns=["trip_id", "arrival_time", "departure_time", "stop_headsign", "timepoint"])
-        # Rename the shape_dist_traveled column
-        merged_df = merged_df.rename(columns={"shape_dist_traveled": "stop_distance"})
-        merged_df = merged_df.drop_duplicates()
-        # Sort by direction_id and stop_sequence
-        merged_df = merged_df.sort_values(by=["direction_id", "stop_sequence"])
-        # Update the route stops data with the merged data as geopandas dataframe
-        self.route_stops = gpd.GeoDataFrame(merged_df, geometry=gpd.points_from_xy(merged_df.stop_lon, merged_df.stop_lat))
-
-        # Filter the shapes data by the route trips
-        self.route_shape_ids = self.route_trips['shape_id'].unique()
+
+        # Build the route index on the first selection
+        if self.route_index is None:
+            self.build_route_index()
+
+        assert route_short_name in self.route_index, f"The route {route_short_name} was not found in the GTFS data!"
+
+        route_data = self.route_index[route_short_name]
+
+        print("DF ROUTE ID HEAD:", route_data['route'].head())
+
+        # Report the reduction of the segments of the route by the simplification of its shapes
+        if self.simplify_tolerance_meters is not None:
+            simplification = route_data['simplification']
+            print(f"Shapes of the route simplified: {simplification['num_segments']} -> {simplification['num_simplified_segments']} segments, max distance error of {simplification['max_distance_error']:.2f} meters")
+
+        # Get the route data from the index
+        self.route_id = route_data['route_id']
+        self.route_trips = route_data['route_trips']
+        self.route_stop_times = route_data['route_stop_times']
+        self.route_stop_ids = route_data['route_stop_ids']
+        self.route_stops = route_data['route_stops']
+        self.route_shape_ids = route_data['route_shape_ids']
 
         assert len(self.route_shape_ids) >= 1, "The route must have at least one shape!"
 
-        self.route_shapes = self.shapes[self.shapes['shape_id'].isin(self.route_shape_ids)]
-        self.route_shape_points = [tuple(x) for x in self.route_shapes[['shape_pt_lon', 'shape_pt_lat']].values]
-        self.route_shape_segments = [tuple(self.route_shape_points[i:i+2]) for i in range(len(self.route_shape_points)-1)]
+        self.route_shapes = route_data['route_shapes']
+        self.route_shape_points = [tuple(x) for x in route_data['route_shape_points']]
+        self.route_shape_segments = route_data['route_shape_segments']
+
+        # Get the shapes, segments and the spatial indexes of the segments of each direction (kept between selections of the same route)
+        self.route_shapes_by_direction = route_data['shapes_by_direction']
+        self.route_simplified_shapes_by_direction = route_data['simplified_shapes_by_direction']
+        self.route_segments_by_direction = route_data['segments_by_direction']
+        self.route_segment_distances_by_direction = route_data['segment_distances_by_direction']
+        self.route_segment_grids = route_data['segment_grids']
+
+    def get_route_directions(self):
+        """
+        Get the directions of the filtered route, as found in its stops.
+
+        Returns:
+            np.array: Array of direction identifiers, in increasing order.
+        """
+
+        assert len(self.route_shape_ids) >= 1, "Please filter the data by a route first!"
+
+        return self.route_stops['direction_id'].unique()
 
     def get_route_segments_by_direction(self, direction_id):
         """
@@ -90,22 +559,50 @@ class GTFSHandler:
             direction_id (int): Identifier of the direction.
 
         Returns:
-            list: List of route segments for the specified direction.
+            np.array: Array of route segments with shape (M, 2, 2) for the specified direction, in the local metric frame (see "utils.project_to_local_meters"), as np.float32.
+        """
+
+        assert len(self.route_shape_ids) >= 1, "Please filter the data by a route first!"
+
+        # Get the segments of the direction, built when the route index was created
+        return self.route_segments_by_direction.get(direction_id, np.empty((0, 2, 2), dtype=np.float32))
+
+    def get_route_segment_distances_by_direction(self, direction_id):
+        """
+        Get the distance traveled at the start and at the end of each route segment for the specified direction.
+
+        Args:
+            direction_id (int): Identifier of the direction.
+
+        Returns:
+            np.array: Array of distances with shape (M, 2) for the specified direction, matching the route segments, as np.float32.
         """
 
         assert len(self.route_shape_ids) >= 1, "Please filter the data by a route first!"
 
-        # Get the shape ids for the direction
-        shape_ids = self.route_trips[self.route_trips['direction_id'] == direction_id]['shape_id'].unique()
+        # Get the segment distances of the direction, built when the route index was created
+        return self.route_segment_distances_by_direction.get(direction_id, np.empty((0, 2), dtype=np.float32))
 
-        # Get the shape points for the direction
-        shape_points = [tuple(x) for x in self.shapes[self.shapes['shape_id'].isin(shape_ids)][['shape_pt_lon', 'shape_pt_lat']].values]
 
-        # Get the shape segments for the direction
-        shape_segments = [tuple(shape_points[i:i+2]) for i in range(len(shape_points)-1)]
+    def get_route_segment_grid_by_direction(self, direction_id):
+        """
+        Get the spatial index of the route segments for the specified direction, building it on the first call for the filtered route.
+
+        Args:
+            direction_id (int): Identifier of the direction.
+
+        Returns:
+            tuple: Spatial index of the route segments, as returned by "utils.build_segment_grid".
+        """
+
+        assert len(self.route_shape_ids) >= 1, "Please filter the data by a route first!"
+
+        # Build the index only once per route and direction
+        if direction_id not in self.route_segment_grids:
+            self.route_segment_grids[direction_id] = utils.build_segment_grid(self.get_route_segments_by_direction(direction_id))
+
+        return self.route_segment_grids[direction_id]
 
-        return shape_segments
-    
     def get_shape_by_direction(self, direction_id):
         """
         Get the shape for the specified direction.
@@ -119,51 +616,66 @@ class GTFSHandler:
 
         assert len(self.route_shape_ids) >= 1, "Please filter the data by a route first!"
 
-        # Get the shape ids for the direction
-        shape_ids = self.route_trips[self.route_trips['direction_id'] == direction_id]['shape_id'].unique()
-
         # Get the shape for the direction
-        return self.shapes[self.shapes['shape_id'].isin(shape_ids)]
+        return self.route_shapes_by_direction.get(direction_id, self.shapes.iloc[0:0])
 
-    def plot_route(self, title='Route', save_path=None):
+    def get_simplified_shape_by_direction(self, direction_id):
         """
-        Plot the route on a map, optionally saving the plot.
+        Get the simplified shape for the specified direction, used to build the route segments.
+        It's the same as "get_shape_by_direction" if no simplification tolerance was set.
+
+        Args:
+            direction_id (int): Identifier of the direction.
+
+        Returns:
+            pandas.DataFrame: Dataframe containing the simplified shape points for the specified direction.
+        """
+
+        assert len(self.route_shape_ids) >= 1, "Please filter the data by a route first!"
+
+        # Get the simplified shape for the direction
+        return self.route_simplified_shapes_by_direction.get(direction_id, self.shapes.iloc[0:0])
+
+    def get_route_plot_job(self, title='Route', save_path=None):
+        """
+        Get the description of a plot of the route on a map, to be rendered by "plotting.render_plot" (or by a "plotting.PlotRenderer").
 
         Args:
             title (str, optional): Title of the plot. Defaults to 'Route'.
             save_path (str, optional): Path to save the plot image. Defaults to None.
+
+        Returns:
+            plotting.PlotJob: The description of the plot.
         """
-        
+
         assert len(self.route_shape_ids) >= 1, "Please filter the data by a route first!"
 
-        fig, ax = plt.subplots(1, 1, figsize=(10, 8))
-        
+        line_collections = []
         for direction_id in self.route_trips['direction_id'].unique():
-            route_segments = self.get_route_segments_by_direction(direction_id)
-            color = 'orange' if direction_id == 0 else 'green'
-            for segment in route_segments:
-                x, y = zip(*segment)
-                ax.plot(x, y, color=color)
+            # Get the shape segments of the direction in degrees (the route segments are in meters)
+            route_shape = self.get_simplified_shape_by_direction(direction_id)
+            route_segments, _ = utils.build_shape_segments(route_shape[['shape_pt_lon', 'shape_pt_lat']].to_numpy(), route_shape['shape_dist_traveled'].to_numpy(), route_shape['shape_id'].cat.codes.to_numpy())
+            line_collections.append((np.asarray(route_segments, dtype=np.float64), {"color": 'orange' if direction_id == 0 else 'green'}))
 
-        # Plot the stops, colored according to the direction id
-        self.route_stops[self.route_stops['direction_id'] == 0].plot(ax=ax, color='orange', label='Direction 0')
-        self.route_stops[self.route_stops['direction_id'] == 1].plot(ax=ax, color='green', label='Direction 1')
+        # Get the stops, colored according to the direction id
+        scatters = []
+        for direction_id, color in [(0, 'orange'), (1, 'green')]:
+            direction_stops = self.route_stops[self.route_stops['direction_id'] == direction_id]
+            if len(direction_stops) > 0:
+                scatters.append((direction_stops[['stop_lon', 'stop_lat']].to_numpy(np.float64), {"color": color, "label": f'Direction {direction_id}'}))
 
-        ax.set_xlabel('Longitude')
-        ax.set_ylabel('Latitude')
-        ax.set_aspect('equal')
+        return plotting.PlotJob(title, save_path, scatters, line_collections, True)
 
-        plt.title(title)
-        plt.legend()
-        plt.grid()
+    def plot_route(self, title='Route', save_path=None):
+        """
+        Plot the route on a map, optionally saving the plot.
 
-        if save_path:
-            plt.savefig(save_path)
-        else:
-            plt.show()
+        Args:
+            title (str, optional): Title of the plot. Defaults to 'Route'.
+            save_path (str, optional): Path to save the plot image. Defaults to None.
+        """
 
-        # Close the plot
-        plt.close()
+        plotting.render_plot(self.get_route_plot_job(title=title, save_path=save_path))
 
     def get_stops_by_direction(self):
         """
@@ -184,3 +696,299 @@ class GTFSHandler:
             self.stops_by_direction.append(self.route_stops[self.route_stops['direction_id'] == direction])
             # Get a np array with the stop_distance for each stop and each direction
             self.stops_distances_by_direction.append(np.array(self.stops_by_direction[direction]['stop_distance'].values))
+
+    def get_route_data_hash(self):
+        """
+        Get the hash of the GTFS data used to process the routes, identified by the hashes of the tables used and by the simplification tolerance.
+
+        Returns:
+            str: The hexadecimal hash (32 characters).
+        """
+
+        # The table snapshot names already identify the table files and the columns and types read
+        tables = [os.path.basename(self.get_table_snapshot_path(table_name)) for table_name in GTFS_ROUTE_TABLES]
+        spec_hash = utils.hash_files([], extra=json.dumps({"tables": tables, "simplify_tolerance_meters": self.simplify_tolerance_meters}))
+
+        return spec_hash[:32]
+
+    def get_route_arrays_path(self):
+        """
+        Get the path of the route arrays compiled from the GTFS data, identified by the hash of the GTFS data used to process the routes (see "get_route_data_hash").
+
+        Returns:
+            str: Path to the route arrays folder.
+        """
+
+        return f"{self.snapshot_folder_path}/route_arrays.{self.get_route_data_hash()}"
+
+    def compile_route_arrays(self):
+        """
+        Compile the route data used to process the GPS data (segments, segment distances, stops and plotted shapes of each direction) into flat NumPy arrays, with the offsets of each route and direction.
+        The arrays are saved in the snapshot folder, and can be memory-mapped by several processes at once (see "GTFSRouteArrays"). They are compiled only once for the same GTFS data.
+
+        Returns:
+            str: Path to the route arrays folder.
+        """
+
+        route_arrays_path = self.get_route_arrays_path()
+
+        if os.path.exists(route_arrays_path):
+            return route_arrays_path
+
+        if self.route_index is None:
+            self.build_route_index()
+
+        print("Compiling the GTFS route arrays...")
+
+        def concatenate(arrays, empty):
+            # Concatenate the arrays, getting the offsets of each one
+            offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(array) for array in arrays])
+            return np.concatenate(arrays + [empty]), offsets
+
+        route_names, route_num_shapes, route_shape_segments = [], [], []
+        directions, segments, segment_distances, stop_distances, stop_points = [], [], [], [], []
+        plot_directions, plot_segments = [], []
+        route_direction_counts, route_plot_direction_counts = [], []
+
+        for route_short_name, route_data in self.route_index.items():
+            route_names.append(route_short_name)
+            route_num_shapes.append(len(route_data['route_shape_ids']))
+            route_shape_segments.append(np.asarray(route_data['route_shape_segments'], dtype=np.float64).reshape(-1, 2, 2))
+
+            # Get the segments and the stops of each direction of the stops (the directions used to process the GPS data)
+            route_stops = route_data['route_stops']
+            route_directions = route_stops['direction_id'].unique()
+            route_direction_counts.append(len(route_directions))
+            for direction in route_directions:
+                directions.append(direction)
+                segments.append(route_data['segments_by_direction'].get(direction, np.empty((0, 2, 2), dtype=np.float32)))
+                segment_distances.append(route_data['segment_distances_by_direction'].get(direction, np.empty((0, 2), dtype=np.float32)))
+                direction_stops = route_stops[route_stops['direction_id'] == direction]
+                stop_distances.append(direction_stops['stop_distance'].to_numpy(np.float64))
+                stop_points.append(direction_stops[['stop_lon', 'stop_lat']].to_numpy(np.float64))
+
+            # Get the segments (in degrees) of the simplified shape of each direction of the trips, as plotted by "plot_route"
+            route_plot_directions = route_data['route_trips']['direction_id'].unique()
+            route_plot_direction_counts.append(len(route_plot_directions))
+            for direction in route_plot_directions:
+                plot_directions.append(direction)
+                route_shape = route_data['simplified_shapes_by_direction'].get(direction, self.shapes.iloc[0:0])
+                route_segments, _ = utils.build_shape_segments(route_shape[['shape_pt_lon', 'shape_pt_lat']].to_numpy(), route_shape['shape_dist_traveled'].to_numpy(), route_shape['shape_id'].cat.codes.to_numpy())
+                plot_segments.append(np.asarray(route_segments, dtype=np.float64).reshape(-1, 2, 2))
+
+        arrays = {"route_names": np.array(route_names, dtype=str), "route_num_shapes": np.array(route_num_shapes, dtype=np.int64),
+                  "directions": np.array(directions, dtype=np.int64), "plot_directions": np.array(plot_directions, dtype=np.int64)}
+        arrays["route_shape_segments"], arrays["route_shape_segment_offsets"] = concatenate(route_shape_segments, np.empty((0, 2, 2)))
+        arrays["segments"], arrays["segment_offsets"] = concatenate(segments, np.empty((0, 2, 2), dtype=np.float32))
+        arrays["segment_distances"], _ = concatenate(segment_distances, np.empty((0, 2), dtype=np.float32))
+        arrays["stop_distances"], arrays["stop_offsets"] = concatenate(stop_distances, np.empty(0))
+        arrays["stop_points"], _ = concatenate(stop_points, np.empty((0, 2)))
+        arrays["plot_segments"], arrays["plot_segment_offsets"] = concatenate(plot_segments, np.empty((0, 2, 2)))
+        arrays["route_direction_offsets"] = np.concatenate([[0], np.cumsum(route_direction_counts, dtype=np.int64)])
+        arrays["route_plot_direction_offsets"] = np.concatenate([[0], np.cumsum(route_plot_direction_counts, dtype=np.int64)])
+
+        # Write to a temporary folder, renamed at the end, so an interrupted (or concurrent) run never leaves partial arrays
+        temporary_path = f"{route_arrays_path}.{os.getpid()}.tmp"
+        os.makedirs(temporary_path, exist_ok=True)
+
+        for name, array in arrays.items():
+            np.save(f"{temporary_path}/{name}.npy", array)
+
+        with open(f"{temporary_path}/arrays.json", "w") as file:
+            json.dump(list(arrays), file)
+
+        try:
+            os.rename(temporary_path, route_arrays_path)
+        except OSError:
+            # Another process compiled the same arrays first
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+        print(f"GTFS route arrays compiled with {len(route_names)} routes!")
+
+        return route_arrays_path
+
+class GTFSRouteArrays:
+    def __init__(self, route_arrays_path):
+        """
+        Initialize the read-only route data compiled by "GTFSHandler.compile_route_arrays", memory-mapping its arrays, so processes sharing them don't copy them.
+        It has the route methods of GTFSHandler used to process the GPS data, without loading the GTFS tables.
+
+        Args:
+            route_arrays_path (str): Path to the route arrays folder.
+        """
+
+        self.route_arrays_path = route_arrays_path
+
+        with open(f"{route_arrays_path}/arrays.json") as file:
+            array_names = json.load(file)
+
+        # Memory-map the arrays (as plain read-only arrays, so the compiled kernels accept them)
+        self.arrays = {name: np.asarray(np.load(f"{route_arrays_path}/{name}.npy", mmap_mode='r')) for name in array_names}
+
+        # Position of each route in the arrays
+        self.route_positions = {str(route_short_name): i for i, route_short_name in enumerate(self.arrays["route_names"])}
+
+        # Spatial indexes of the route segments, built on demand for each route and direction
+        self.segment_grids = {}
+
+        self.route_position = None
+
+        print("GTFS route arrays loaded successfully!")
+
+    def filter_by_route(self, route_short_name):
+        """
+        Filter the route data by the specified route short name.
+
+        Args:
+            route_short_name (str): Short name of the route to filter by.
+        """
+
+        print(f"Filtering the data by the route {route_short_name}...")
+
+        assert route_short_name in self.route_positions, f"The route {route_short_name} was not found in the GTFS data!"
+
+        route_position = self.route_positions[route_short_name]
+
+        assert self.arrays["route_num_shapes"][route_position] >= 1, "The route must have at least one shape!"
+
+        self.route_position = route_position
+
+        # Get the positions of the directions of the route in the arrays
+        start, end = self.arrays["route_direction_offsets"][route_position:route_position + 2]
+        self.route_direction_positions = dict(zip(self.arrays["directions"][start:end].tolist(), range(start, end)))
+
+        # Get the segments of the whole route (used for plotting)
+        start, end = self.arrays["route_shape_segment_offsets"][route_position:route_position + 2]
+        self.route_shape_segments = self.arrays["route_shape_segments"][start:end]
+
+    def get_route_directions(self):
+        """
+        Get the directions of the filtered route, as found in its stops.
+
+        Returns:
+            np.array: Array of direction identifiers, in increasing order.
+        """
+
+        assert self.route_position is not None, "Please filter the data by a route first!"
+
+        return np.array(list(self.route_direction_positions), dtype=np.int64)
+
+    def get_route_segments_by_direction(self, direction_id):
+        """
+        Get the route segments for the specified direction.
+
+        Args:
+            direction_id (int): Identifier of the direction.
+
+        Returns:
+            np.array: Read-only array of route segments with shape (M, 2, 2) for the specified direction, in the local metric frame (see "utils.project_to_local_meters"), as np.float32.
+        """
+
+        assert self.route_position is not None, "Please filter the data by a route first!"
+
+        if direction_id not in self.route_direction_positions:
+            return np.empty((0, 2, 2), dtype=np.float32)
+
+        position = self.route_direction_positions[direction_id]
+        start, end = self.arrays["segment_offsets"][position:position + 2]
+
+        return self.arrays["segments"][start:end]
+
+    def get_route_segment_distances_by_direction(self, direction_id):
+        """
+        Get the distance traveled at the start and at the end of each route segment for the specified direction.
+
+        Args:
+            direction_id (int): Identifier of the direction.
+
+        Returns:
+            np.array: Read-only array of distances with shape (M, 2) for the specified direction, matching the route segments, as np.float32.
+        """
+
+        assert self.route_position is not None, "Please filter the data by a route first!"
+
+        if direction_id not in self.route_direction_positions:
+            return np.empty((0, 2), dtype=np.float32)
+
+        position = self.route_direction_positions[direction_id]
+        start, end = self.arrays["segment_offsets"][position:position + 2]
+
+        return self.arrays["segment_distances"][start:end]
+
+    def get_route_segment_grid_by_direction(self, direction_id):
+        """
+        Get the spatial index of the route segments for the specified direction, building it on the first call for the route.
+
+        Args:
+            direction_id (int): Identifier of the direction.
+
+        Returns:
+            tuple: Spatial index of the route segments, as returned by "utils.build_segment_grid".
+        """
+
+        assert self.route_position is not None, "Please filter the data by a route first!"
+
+        # Build the index only once per route and direction
+        if (self.route_position, direction_id) not in self.segment_grids:
+            self.segment_grids[(self.route_position, direction_id)] = utils.build_segment_grid(self.get_route_segments_by_direction(direction_id))
+
+        return self.segment_grids[(self.route_position, direction_id)]
+
+    def get_stops_by_direction(self):
+        """
+        Get the distances to the stops by direction for the filtered route.
+        """
+
+        assert self.route_position is not None, "Please filter the data by a route first!"
+
+        self.stops_distances_by_direction = []
+
+        positions = []
+        for direction, position in self.route_direction_positions.items():
+            # Select the direction by its identifier among the directions seen so far, as "GTFSHandler.get_stops_by_direction" does
+            positions.append(position)
+            start, end = self.arrays["stop_offsets"][positions[direction]:positions[direction] + 2]
+            self.stops_distances_by_direction.append(self.arrays["stop_distances"][start:end])
+
+    def get_route_plot_job(self, title='Route', save_path=None):
+        """
+        Get the description of a plot of the route on a map, to be rendered by "plotting.render_plot" (or by a "plotting.PlotRenderer").
+
+        Args:
+            title (str, optional): Title of the plot. Defaults to 'Route'.
+            save_path (str, optional): Path to save the plot image. Defaults to None.
+
+        Returns:
+            plotting.PlotJob: The description of the plot, with copies of the arrays.
+        """
+
+        assert self.route_position is not None, "Please filter the data by a route first!"
+
+        # Get the shape segments of each direction in degrees (the route segments are in meters)
+        line_collections = []
+        start, end = self.arrays["route_plot_direction_offsets"][self.route_position:self.route_position + 2]
+        for position in range(start, end):
+            segment_start, segment_end = self.arrays["plot_segment_offsets"][position:position + 2]
+            line_collections.append((np.array(self.arrays["plot_segments"][segment_start:segment_end]), {"color": 'orange' if self.arrays["plot_directions"][position] == 0 else 'green'}))
+
+        # Get the stops, colored according to the direction id
+        scatters = []
+        for direction, color in [(0, 'orange'), (1, 'green')]:
+            if direction in self.route_direction_positions:
+                position = self.route_direction_positions[direction]
+                stop_start, stop_end = self.arrays["stop_offsets"][position:position + 2]
+                scatters.append((np.array(self.arrays["stop_points"][stop_start:stop_end]), {"color": color, "label": f'Direction {direction}'}))
+
+        return plotting.PlotJob(title, save_path, scatters, line_collections, True)
+
+    def plot_route(self, title='Route', save_path=None):
+        """
+        Plot the route on a map, optionally saving the plot.
+
+        Args:
+            title (str, optional): Title of the plot. Defaults to 'Route'.
+            save_path (str, optional): Path to save the plot image. Defaults to None.
+        """
+
+        plotting.render_plot(self.get_route_plot_job(title=title, save_path=save_path))
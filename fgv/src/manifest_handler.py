@@ -0,0 +1,116 @@
+import json
+import os
+
+# Statuses of the units in the manifest: being processed, processed (with its data written) and skipped because of an error
+UNIT_STATUSES = ("started", "done", "failed")
+
+class ManifestHandler:
+    def __init__(self, manifest_path):
+        """
+        Initialize the ManifestHandler with the path to the manifest of the units processed (the buses of each day and route).
+        The manifest is a JSON Lines file, where a record is appended each time a unit changes status, with the signature of the data it was processed from
+        (the hashes of the GPS data file and of the GTFS data, and the pipeline version). The last record of each unit is its current status.
+        Records are appended with a single write, so several processes can record their units in the same manifest.
+
+        Args:
+            manifest_path (str): Path to the manifest file.
+        """
+
+        self.manifest_path = manifest_path
+
+        self.load_manifest()
+
+    def load_manifest(self):
+        """
+        Load the last record of each unit from the manifest file (none if it doesn't exist).
+        """
+
+        # Last record of each (day, route, bus) unit, in the order of their last records
+        self.units = {}
+
+        if not os.path.exists(self.manifest_path):
+            return
+
+        with open(self.manifest_path, "r") as manifest_file:
+            for line in manifest_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Skip a line left incomplete by an interrupted run
+                    continue
+
+                key = (record["day"], record["route"], record["bus"])
+                self.units.pop(key, None)
+                self.units[key] = record
+
+    def get_unit_status(self, day, route, bus, signature):
+        """
+        Get the status of a unit, comparing its last record to the signature of the data it would be processed from.
+
+        Args:
+            day (str): Date of the GPS data file ("YYYY-MM-DD").
+            route (str): Identifier of the route.
+            bus (str): Identifier of the bus.
+            signature (dict): Hashes of the GPS data file ("gps_hash") and of the GTFS data ("gtfs_hash"), and the pipeline version ("pipeline_version").
+
+        Returns:
+            str: "new" if the unit was never processed, "incomplete" if its processing was started and never finished, "outdated" if it was processed from other data
+                 or by another pipeline version, or "processed" if it was processed (or skipped because of an error) from the same data.
+        """
+
+        record = self.units.get((day, str(route), str(bus)))
+
+        if record is None:
+            return "new"
+
+        if record["status"] == "started":
+            return "incomplete"
+
+        if any(record[key] != value for key, value in signature.items()):
+            return "outdated"
+
+        return "processed"
+
+    def record_units(self, day, route, buses, status, signature):
+        """
+        Append a record to the manifest for each of the buses of a route, with their new status.
+
+        Args:
+            day (str): Date of the GPS data file ("YYYY-MM-DD").
+            route (str): Identifier of the route.
+            buses (list): Identifiers of the buses.
+            status (str): New status of the units ("started", "done" or "failed").
+            signature (dict): Hashes of the GPS data file ("gps_hash") and of the GTFS data ("gtfs_hash"), and the pipeline version ("pipeline_version").
+        """
+
+        assert status in UNIT_STATUSES, f"Invalid unit status: {status}"
+
+        if not buses:
+            return
+
+        records = [{"day": day, "route": str(route), "bus": str(bus), "status": status, **signature} for bus in buses]
+
+        # Append all the records with a single write, so the records of other processes are never interleaved with them
+        manifest_file = os.open(self.manifest_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(manifest_file, "".join(json.dumps(record) + "\n" for record in records).encode())
+        finally:
+            os.close(manifest_file)
+
+        for record in records:
+            key = (record["day"], record["route"], record["bus"])
+            self.units.pop(key, None)
+            self.units[key] = record
+
+    def get_done_units(self, route):
+        """
+        Get the units of a route processed with their data written, in the order they were processed.
+
+        Args:
+            route (str): Identifier of the route.
+
+        Returns:
+            list: List of (day, bus) pairs.
+        """
+
+        return [(day, bus) for (day, unit_route, bus), record in self.units.items() if unit_route == str(route) and record["status"] == "done"]
@@ -0,0 +1,143 @@
+import multiprocessing
+import time
+
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+# Description of a plot, rendered by "render_plot" (in this process or in another one, as it only holds arrays and texts):
+# - scatters: list of (points, style) pairs, with the points as an array with shape (N, 2) of (longitude, latitude)
+# - line_collections: list of (segments, style) pairs, with the segments as an array with shape (S, 2, 2), drawn as a single collection
+# The style of each layer is a dict of keyword arguments for matplotlib (e.g. color, alpha and label)
+PlotJob = namedtuple("PlotJob", ["title", "save_path", "scatters", "line_collections", "legend"])
+
+def render_plot(job):
+    """
+    Render a plot on a map, saving it (or showing it, if it has no save path).
+
+    Args:
+        job (PlotJob): Description of the plot.
+    """
+
+    # Draw on a figure not managed by pyplot when saving, so the rendering doesn't depend on the interactive backend
+    fig = Figure(figsize=(10, 8)) if job.save_path else plt.figure(figsize=(10, 8))
+    ax = fig.add_subplot(1, 1, 1)
+
+    # Draw the segments of each layer at once
+    for segments, style in job.line_collections:
+        ax.add_collection(LineCollection(np.asarray(segments).reshape(-1, 2, 2), **style))
+
+    for points, style in job.scatters:
+        points = np.asarray(points).reshape(-1, 2)
+        ax.scatter(points[:, 0], points[:, 1], **style)
+
+    # Fit the axes to the segments (the collections don't update the view limits)
+    ax.autoscale_view()
+
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    ax.set_aspect('equal')
+
+    ax.set_title(job.title)
+    if job.legend:
+        ax.legend()
+    ax.grid()
+
+    if job.save_path:
+        fig.savefig(job.save_path)
+    else:
+        plt.show()
+        # Close the plot
+        plt.close(fig)
+
+class PlotRenderer:
+    """
+    Renders plots in a pool of processes, while the caller keeps processing the data.
+    The number of plots waiting to be rendered is bounded: submitting a plot when the limit is reached waits for the oldest one to be rendered.
+    """
+
+    def __init__(self, num_processes=1, max_pending=256):
+        """
+        Initialize the renderer.
+
+        Args:
+            num_processes (int, optional): Number of processes rendering the plots. 0 renders each plot when it is submitted, and None keeps the plots in "jobs", to be rendered by another renderer (e.g. in the main process). Defaults to 1.
+            max_pending (int, optional): Maximum number of plots submitted and not rendered yet. Defaults to 256.
+        """
+
+        self.num_processes = num_processes
+        self.max_pending = max_pending
+
+        # Plots kept to be rendered by another renderer
+        self.jobs = []
+
+        # Total number of plots, and time the caller spent rendering them or waiting for them (on the limit of plots, or at the end)
+        self.num_plots = 0
+        self.wait_time = 0.0
+
+        # Plots being rendered by the pool, in the order they were submitted
+        self.pending = deque()
+
+        # The processes are started with "spawn", as they may be started while other threads (e.g. of the background writer) are running
+        self.executor = ProcessPoolExecutor(max_workers=num_processes, mp_context=multiprocessing.get_context("spawn")) if num_processes else None
+
+    def submit(self, job):
+        """
+        Submit a plot to be rendered.
+
+        Args:
+            job (PlotJob): Description of the plot.
+        """
+
+        self.num_plots += 1
+
+        # Keep the plot to be rendered by another renderer
+        if self.num_processes is None:
+            self.jobs.append(job)
+            return
+
+        start_time = time.perf_counter()
+
+        # Render the plot in this process when there's no pool
+        if self.executor is None:
+            render_plot(job)
+        else:
+            # Collect the plots rendered (raising their errors), waiting for the oldest ones if the limit is reached
+            while self.pending and (self.pending[0].done() or len(self.pending) >= self.max_pending):
+                self.pending.popleft().result()
+
+            self.pending.append(self.executor.submit(render_plot, job))
+
+        self.wait_time += time.perf_counter() - start_time
+
+    def take_jobs(self):
+        """
+        Get the plots kept to be rendered by another renderer, removing them from the renderer.
+
+        Returns:
+            list: The plots (PlotJob) in the order they were submitted.
+        """
+
+        jobs, self.jobs = self.jobs, []
+        return jobs
+
+    def close(self):
+        """
+        Wait for all the plots to be rendered and stop the processes.
+        """
+
+        if self.executor is None:
+            return
+
+        start_time = time.perf_counter()
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+            self.wait_time += time.perf_counter() - start_time
@@ -1,7 +1,47 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+
+from collections import namedtuple
+
+import numba
 import numpy as np
 import pandas as pd
 
-from numba import jit # Numba is a Just-In-Time Compiler for Python that works best with python code that uses NumPy arrays and functions.
+import src.plotting as plotting
+
+from numba import jit, prange # Numba is a Just-In-Time Compiler for Python that works best with python code that uses NumPy arrays and functions.
+
+# Machine epsilon of np.float32, the precision used by the projection kernels
+FLOAT32_EPSILON = 1.1920929e-07
+
+# Origin (longitude, latitude) of the local metric frame, at the center of Rio de Janeiro, and the mean radius of the Earth in meters
+PROJECTION_ORIGIN = (-43.2, -22.9)
+EARTH_RADIUS_METERS = 6371008.8
+
+def project_to_local_meters(longitudes, latitudes, origin=PROJECTION_ORIGIN):
+    """
+    Projects coordinates in degrees into a local planar frame in meters, with an equirectangular projection centered on the origin.
+    The scale error is below 0.2% within 0.1 degree of latitude from the origin, which covers the city.
+
+    Args:
+        longitudes (np.array): Array of longitudes in degrees.
+        latitudes (np.array): Array of latitudes in degrees.
+        origin (tuple, optional): Longitude and latitude of the origin of the frame. Defaults to the center of Rio de Janeiro.
+
+    Returns:
+        np.array: Array of projected points with shape (N, 2), as (x, y) in meters (np.float64).
+    """
+
+    origin_longitude, origin_latitude = origin
+
+    # Scale the longitudes by the cosine of the origin latitude, so both axes are in meters
+    x = np.radians(np.asarray(longitudes, dtype=np.float64) - origin_longitude) * (EARTH_RADIUS_METERS * np.cos(np.radians(origin_latitude)))
+    y = np.radians(np.asarray(latitudes, dtype=np.float64) - origin_latitude) * EARTH_RADIUS_METERS
+
+    return np.column_stack((x, y))
 
 @jit(nopython=True)
 def project_point_on_segment(px, py, ax, ay, bx, by):
@@ -71,50 +111,711 @@ def squared_distance_to_segment(px, py, ax, ay, bx, by):
     # Get the difference between the point and the closest point
     dx, dy = px - closest_x, py - closest_y
 
-    # Return the squared distance (to avoid the square root operation)
-    return dx * dx + dy * dy
+    # Return the squared distance (to avoid the square root operation)
+    return dx * dx + dy * dy
+
+@jit(nopython=True)
+def find_closest_segment_brute_force(px, py, route_segments):
+    """
+    Finds the closest segment to a point (px, py), comparing the point against every segment.
+
+    Args:
+        px (float): x-coordinate of the point.
+        py (float): y-coordinate of the point.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+
+    Returns:
+        tuple: The minimum squared distance from the point to the segments and the index of the closest segment.
+    """
+
+    min_squared_distance = np.inf
+    closest_segment_index = 0
+
+    for j in range(route_segments.shape[0]):
+        # Get the squared distance from the point to the segment
+        # We used the squared distance to avoid the square root operation, as the magnitude is not needed, just the order of the sorted distances
+        distance = squared_distance_to_segment(px, py,
+                                               route_segments[j][0][0], route_segments[j][0][1],
+                                               route_segments[j][1][0], route_segments[j][1][1])
+        # Save the minimum distance and the closest segment index
+        if distance < min_squared_distance:
+            min_squared_distance = distance
+            closest_segment_index = j
+
+    return min_squared_distance, closest_segment_index
+
+@jit(nopython=True)
+def closest_projection_brute_force(points, route_segments):
+    """
+    Finds the closest projection of each point onto a set of route segments, comparing every point against every segment.
+
+    Args:
+        points (np.array): Array of points with shape (N, 2), where N is the number of points.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+    
+    Returns:
+        min_squared_distances (np.array): Array of minimum squared distances from each point to its closest segment.
+        closest_segment_indexes (np.array): Array of indexes of the closest segment for each point.
+    """
+    
+    # Convert the numpy arrays to store data as np.float32
+    points = points.astype(np.float32)
+    route_segments = np.asarray(route_segments, dtype=np.float32)
+
+    # Get the number of points to iterate over
+    num_points = points.shape[0]
+
+    # Initialize with infinity
+    min_squared_distances = np.full(num_points, np.inf)
+    closest_segment_indexes = np.zeros(num_points, np.int32)
+
+    # Iterate over each point, comparing it against each segment
+    for i in range(num_points):
+        min_squared_distances[i], closest_segment_indexes[i] = find_closest_segment_brute_force(points[i, 0], points[i, 1], route_segments)
+
+    # Return the best results for each point
+    return min_squared_distances, closest_segment_indexes
+
+@jit(nopython=True, nogil=True)
+def build_segment_grid(route_segments, segment_lengths_per_cell=4.0, max_cells=1048576):
+    """
+    Builds a uniform grid spatial index over the bounding boxes of a set of route segments.
+    Each cell stores the indexes of the segments whose bounding box overlaps it, in a CSR layout (offsets + flat indexes).
+
+    Args:
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_lengths_per_cell (float, optional): Size of each cell, as a multiple of the mean segment extent. Defaults to 4.0.
+        max_cells (int, optional): Maximum number of cells in the grid, the cell size is enlarged to respect it. Defaults to 1048576.
+
+    Returns:
+        tuple: Grid origin (x, y), cell size, number of cells in each axis (x, y), cell offsets and segment indexes of each cell.
+    """
+
+    # Use the same precision as the projection kernels
+    route_segments = np.asarray(route_segments, dtype=np.float32)
+    num_segments = route_segments.shape[0]
+
+    # Without segments, return a single empty cell, so the indexed search finds no candidate (infinite distance, as the brute force search)
+    if num_segments == 0:
+        return 0.0, 0.0, 1.0, 1, 1, np.zeros(2, dtype=np.int64), np.empty(0, dtype=np.int32)
+
+    # Get the bounding box of each segment and of the whole set of segments (binned in float64, as the queries)
+    min_x = np.minimum(route_segments[:, 0, 0], route_segments[:, 1, 0]).astype(np.float64)
+    max_x = np.maximum(route_segments[:, 0, 0], route_segments[:, 1, 0]).astype(np.float64)
+    min_y = np.minimum(route_segments[:, 0, 1], route_segments[:, 1, 1]).astype(np.float64)
+    max_y = np.maximum(route_segments[:, 0, 1], route_segments[:, 1, 1]).astype(np.float64)
+
+    origin_x, origin_y = min_x.min(), min_y.min()
+    width, height = max_x.max() - origin_x, max_y.max() - origin_y
+
+    # The cell size is proportional to the mean segment extent, so each occupied cell holds a few segments
+    mean_extent = np.mean(np.maximum(max_x - min_x, max_y - min_y))
+    cell_size = max(mean_extent * segment_lengths_per_cell, max(width, height) / 1024.0, 1e-9)
+
+    # Enlarge the cells if the grid would be too large
+    while (int(width / cell_size) + 1) * (int(height / cell_size) + 1) > max_cells:
+        cell_size *= 2.0
+
+    num_cells_x = int(width / cell_size) + 1
+    num_cells_y = int(height / cell_size) + 1
+
+    # First pass: count the number of segments overlapping each cell
+    cell_counts = np.zeros(num_cells_x * num_cells_y + 1, dtype=np.int64)
+    for j in range(num_segments):
+        for cx in range(int((min_x[j] - origin_x) / cell_size), min(int((max_x[j] - origin_x) / cell_size), num_cells_x - 1) + 1):
+            for cy in range(int((min_y[j] - origin_y) / cell_size), min(int((max_y[j] - origin_y) / cell_size), num_cells_y - 1) + 1):
+                cell_counts[cx * num_cells_y + cy + 1] += 1
+
+    # Turn the counts into offsets
+    cell_offsets = np.cumsum(cell_counts)
+
+    # Second pass: fill the segment indexes of each cell (in increasing segment order)
+    cell_segments = np.empty(cell_offsets[-1], dtype=np.int32)
+    cell_fill = cell_offsets[:-1].copy()
+    for j in range(num_segments):
+        for cx in range(int((min_x[j] - origin_x) / cell_size), min(int((max_x[j] - origin_x) / cell_size), num_cells_x - 1) + 1):
+            for cy in range(int((min_y[j] - origin_y) / cell_size), min(int((max_y[j] - origin_y) / cell_size), num_cells_y - 1) + 1):
+                cell_segments[cell_fill[cx * num_cells_y + cy]] = j
+                cell_fill[cx * num_cells_y + cy] += 1
+
+    return origin_x, origin_y, cell_size, num_cells_x, num_cells_y, cell_offsets, cell_segments
+
+@jit(nopython=True)
+def find_closest_segment_indexed(px, py, route_segments, segment_grid):
+    """
+    Finds the closest segment to a point (px, py), checking only the segments near the point.
+    The grid cells are visited in rings around the cell of the point, stopping once the nearest unvisited cell is farther than the best segment found.
+    Ties are broken by the smallest segment index, so the results are the same as "find_closest_segment_brute_force".
+
+    Args:
+        px (float): x-coordinate of the point.
+        py (float): y-coordinate of the point.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_grid (tuple): Spatial index of the route segments, as returned by "build_segment_grid".
+
+    Returns:
+        tuple: The minimum squared distance from the point to the segments and the index of the closest segment.
+    """
+
+    origin_x, origin_y, cell_size, num_cells_x, num_cells_y, cell_offsets, cell_segments = segment_grid
+
+    min_squared_distance = np.inf
+    closest_segment_index = 0
+
+    # Get the cell of the point (it may lie outside the grid)
+    cx = int(np.floor((px - origin_x) / cell_size))
+    cy = int(np.floor((py - origin_y) / cell_size))
+
+    # Start from the first ring that intersects the grid
+    ring = max(0, -cx, -cy, cx - (num_cells_x - 1), cy - (num_cells_y - 1))
+
+    while True:
+        # Visit the cells of the current ring that are inside the grid
+        for gx in range(max(cx - ring, 0), min(cx + ring, num_cells_x - 1) + 1):
+            # Cells on the vertical edges of the ring are visited entirely, the others only on the top and bottom rows
+            step = 1 if gx == cx - ring or gx == cx + ring else max(2 * ring, 1)
+            for gy in range(cy - ring, cy + ring + 1, step):
+                if gy < 0 or gy >= num_cells_y:
+                    continue
+
+                cell = gx * num_cells_y + gy
+                for k in range(cell_offsets[cell], cell_offsets[cell + 1]):
+                    j = cell_segments[k]
+                    distance = squared_distance_to_segment(px, py,
+                                                           route_segments[j][0][0], route_segments[j][0][1],
+                                                           route_segments[j][1][0], route_segments[j][1][1])
+                    # Save the minimum distance and the closest segment index (the smallest index wins on ties)
+                    if distance < min_squared_distance or (distance == min_squared_distance and j < closest_segment_index):
+                        min_squared_distance = distance
+                        closest_segment_index = j
+
+        # Stop if all the grid has been visited
+        if cx - ring <= 0 and cy - ring <= 0 and cx + ring >= num_cells_x - 1 and cy + ring >= num_cells_y - 1:
+            break
+
+        # Any segment not visited yet lies outside the visited block of cells, so it can't be closer than the block border
+        lower_bound = min(px - (origin_x + (cx - ring) * cell_size), (origin_x + (cx + ring + 1) * cell_size) - px,
+                          py - (origin_y + (cy - ring) * cell_size), (origin_y + (cy + ring + 1) * cell_size) - py)
+
+        # A margin compensates for the rounding of the float32 distances, which grows with the magnitude of the coordinates
+        lower_bound -= 32 * FLOAT32_EPSILON * (abs(px) + abs(py))
+        if lower_bound > 0 and lower_bound * lower_bound > min_squared_distance:
+            break
+
+        ring += 1
+
+    return min_squared_distance, closest_segment_index
+
+@jit(nopython=True)
+def closest_projection_indexed(points, route_segments, segment_grid):
+    """
+    Finds the closest projection of each point onto a set of route segments, checking only the segments near each point.
+
+    Args:
+        points (np.array): Array of points with shape (N, 2), where N is the number of points.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_grid (tuple): Spatial index of the route segments, as returned by "build_segment_grid".
+
+    Returns:
+        min_squared_distances (np.array): Array of minimum squared distances from each point to its closest segment.
+        closest_segment_indexes (np.array): Array of indexes of the closest segment for each point.
+    """
+
+    # Convert the numpy arrays to store data as np.float32
+    points = points.astype(np.float32)
+    route_segments = np.asarray(route_segments, dtype=np.float32)
+
+    # Get the number of points to iterate over
+    num_points = points.shape[0]
+
+    # Initialize with infinity
+    min_squared_distances = np.full(num_points, np.inf)
+    closest_segment_indexes = np.zeros(num_points, np.int32)
+
+    # Iterate over each point, checking only the segments near it
+    for i in range(num_points):
+        min_squared_distances[i], closest_segment_indexes[i] = find_closest_segment_indexed(points[i, 0], points[i, 1], route_segments, segment_grid)
+
+    # Return the best results for each point
+    return min_squared_distances, closest_segment_indexes
+
+@jit(nopython=True)
+def find_closest_segment(px, py, route_segments, segment_grid=None):
+    """
+    Finds the closest segment to a point (px, py).
+    If a spatial index of the segments is provided, only the segments near the point are checked.
+
+    Args:
+        px (float): x-coordinate of the point.
+        py (float): y-coordinate of the point.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_grid (tuple, optional): Spatial index of the route segments, as returned by "build_segment_grid". Defaults to None.
+
+    Returns:
+        tuple: The minimum squared distance from the point to the segments and the index of the closest segment.
+    """
+
+    # Without an index, compare the point against every segment
+    if segment_grid is None:
+        return find_closest_segment_brute_force(px, py, route_segments)
+
+    return find_closest_segment_indexed(px, py, route_segments, segment_grid)
+
+@jit(nopython=True, nogil=True)
+def closest_projection(points, route_segments, segment_grid=None):
+    """
+    Finds the closest projection of each point onto a set of route segments.
+    If a spatial index of the segments is provided, only the segments near each point are checked.
+
+    Args:
+        points (np.array): Array of points with shape (N, 2), where N is the number of points.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_grid (tuple, optional): Spatial index of the route segments, as returned by "build_segment_grid". Defaults to None.
+    
+    Returns:
+        min_squared_distances (np.array): Array of minimum squared distances from each point to its closest segment.
+        closest_segment_indexes (np.array): Array of indexes of the closest segment for each point.
+    """
+
+    # Without an index, compare every point against every segment
+    if segment_grid is None:
+        return closest_projection_brute_force(points, route_segments)
+
+    return closest_projection_indexed(points, route_segments, segment_grid)
+
+@jit(nopython=True, parallel=True, nogil=True)
+def closest_projection_parallel(points, route_segments, segment_grid=None):
+    """
+    Finds the closest projection of each point onto a set of route segments, splitting the points among threads.
+    The results are the same as "closest_projection", as each point is processed independently by the same search.
+
+    Args:
+        points (np.array): Array of points with shape (N, 2), where N is the number of points.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_grid (tuple, optional): Spatial index of the route segments, as returned by "build_segment_grid". Defaults to None.
+
+    Returns:
+        min_squared_distances (np.array): Array of minimum squared distances from each point to its closest segment.
+        closest_segment_indexes (np.array): Array of indexes of the closest segment for each point.
+    """
+
+    # Convert the numpy arrays to store data as np.float32
+    points = points.astype(np.float32)
+    route_segments = np.asarray(route_segments, dtype=np.float32)
+
+    # Get the number of points to iterate over
+    num_points = points.shape[0]
+
+    # Initialize with infinity
+    min_squared_distances = np.full(num_points, np.inf)
+    closest_segment_indexes = np.zeros(num_points, np.int32)
+
+    # Iterate over the points in parallel
+    for i in prange(num_points):
+        min_squared_distances[i], closest_segment_indexes[i] = find_closest_segment(points[i, 0], points[i, 1], route_segments, segment_grid)
+
+    # Return the best results for each point
+    return min_squared_distances, closest_segment_indexes
+
+@jit(nopython=True)
+def projection_parameter(px, py, ax, ay, bx, by):
+    """
+    Calculates the position of the projection of a point (px, py) onto a line segment defined by two points (ax, ay) and (bx, by), as a fraction of the segment.
+
+    Args:
+        px (float): x-coordinate of the point.
+        py (float): y-coordinate of the point.
+        ax (float): x-coordinate of the first point of the line segment.
+        ay (float): y-coordinate of the first point of the line segment.
+        bx (float): x-coordinate of the second point of the line segment.
+        by (float): y-coordinate of the second point of the line segment.
+
+    Returns:
+        float: The projection parameter t, between 0 (segment start) and 1 (segment end).
+    """
+
+    # Vector from A to B (squared magnitude)
+    abx, aby = bx - ax, by - ay
+    ab2 = abx * abx + aby * aby
+
+    if ab2 == 0:
+        # A and B are the same points, the projection is the segment start
+        return 0.0
+
+    # Project AP onto AB, clamping to the segment
+    t = ((px - ax) * abx + (py - ay) * aby) / ab2
+    return min(max(t, 0.0), 1.0)
+
+@jit(nopython=True)
+def project_point_on_route_segment(px, py, route_segments, segment_distances, j):
+    """
+    Projects a point (px, py) onto a given route segment, getting the position of the projection and the distance traveled from the route start until it.
+    The distance is interpolated linearly between the distances at the segment ends, according to the position of the projection.
+
+    Args:
+        px (float): x-coordinate of the point.
+        py (float): y-coordinate of the point.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_distances (np.array): Array with the distance traveled at the start and at the end of each segment, with shape (M, 2).
+        j (int): Index of the segment to project the point onto.
+
+    Returns:
+        tuple: The projection parameter (0 at the segment start, 1 at the segment end) and the distance from the route start.
+    """
+
+    # Without segments there is nothing to project onto
+    if route_segments.shape[0] == 0:
+        return 0.0, np.float32(0.0)
+
+    t = projection_parameter(px, py,
+                             route_segments[j][0][0], route_segments[j][0][1],
+                             route_segments[j][1][0], route_segments[j][1][1])
+    distance_from_start = segment_distances[j][0] + t * (segment_distances[j][1] - segment_distances[j][0])
+
+    return t, np.float32(distance_from_start)
+
+@jit(nopython=True)
+def project_point_with_distance(px_search, py_search, px, py, route_segments, segment_distances, segment_grid=None):
+    """
+    Finds the closest projection of a point onto a set of route segments, along with the distance traveled from the route start until the projected point.
+
+    Args:
+        px_search (float): x-coordinate of the point, with the precision used by the search (np.float32).
+        py_search (float): y-coordinate of the point, with the precision used by the search (np.float32).
+        px (float): x-coordinate of the point, with the precision used to interpolate the distance.
+        py (float): y-coordinate of the point, with the precision used to interpolate the distance.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_distances (np.array): Array with the distance traveled at the start and at the end of each segment, with shape (M, 2).
+        segment_grid (tuple, optional): Spatial index of the route segments, as returned by "build_segment_grid". Defaults to None.
+
+    Returns:
+        tuple: The minimum squared distance to the segments, the index of the closest segment, the projection parameter and the distance from the route start.
+    """
+
+    # Find the closest segment (checking only the segments near the point if an index is provided)
+    min_squared_distance, j = find_closest_segment(px_search, py_search, route_segments, segment_grid)
+
+    # Get the position of the projection on the segment and the distance traveled until it
+    t, distance_from_start = project_point_on_route_segment(px, py, route_segments, segment_distances, j)
+
+    return min_squared_distance, j, t, distance_from_start
+
+@jit(nopython=True, nogil=True)
+def closest_projection_with_distance(points, route_segments, segment_distances, segment_grid=None):
+    """
+    Finds the closest projection of each point onto a set of route segments, along with the distance traveled from the route start until the projected point.
+    The closest segment is searched as in "closest_projection", and the distance is interpolated from the position of the projection on it, in a single pass over the points.
+
+    Args:
+        points (np.array): Array of points with shape (N, 2), where N is the number of points.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_distances (np.array): Array with the distance traveled at the start and at the end of each segment, with shape (M, 2).
+        segment_grid (tuple, optional): Spatial index of the route segments, as returned by "build_segment_grid". Defaults to None.
+
+    Returns:
+        min_squared_distances (np.array): Array of minimum squared distances from each point to its closest segment.
+        closest_segment_indexes (np.array): Array of indexes of the closest segment for each point.
+        projection_parameters (np.array): Array with the position of the projection of each point on its closest segment (0 at the start, 1 at the end).
+        distances_from_start (np.array): Array with the distance traveled from the route start until the projection of each point.
+    """
+
+    # The search uses np.float32, as "closest_projection", while the projection on the closest segment uses the original precision of the points
+    points_search = points.astype(np.float32)
+    route_segments = np.asarray(route_segments, dtype=np.float32)
+    segment_distances = np.asarray(segment_distances, dtype=np.float32)
+
+    # Get the number of points to iterate over
+    num_points = points.shape[0]
+
+    # Initialize with infinity
+    min_squared_distances = np.full(num_points, np.inf)
+    closest_segment_indexes = np.zeros(num_points, np.int32)
+    projection_parameters = np.zeros(num_points, np.float64)
+    distances_from_start = np.zeros(num_points, np.float32)
+
+    for i in range(num_points):
+        min_squared_distances[i], closest_segment_indexes[i], projection_parameters[i], distances_from_start[i] = project_point_with_distance(points_search[i, 0], points_search[i, 1], points[i, 0], points[i, 1], route_segments, segment_distances, segment_grid)
+
+    return min_squared_distances, closest_segment_indexes, projection_parameters, distances_from_start
+
+@jit(nopython=True, parallel=True, nogil=True)
+def closest_projection_with_distance_parallel(points, route_segments, segment_distances, segment_grid=None):
+    """
+    Parallel version of "closest_projection_with_distance", splitting the points among threads.
+    The results are the same as the serial version, as each point is processed independently by the same function.
+
+    Args:
+        points (np.array): Array of points with shape (N, 2), where N is the number of points.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_distances (np.array): Array with the distance traveled at the start and at the end of each segment, with shape (M, 2).
+        segment_grid (tuple, optional): Spatial index of the route segments, as returned by "build_segment_grid". Defaults to None.
+
+    Returns:
+        min_squared_distances (np.array): Array of minimum squared distances from each point to its closest segment.
+        closest_segment_indexes (np.array): Array of indexes of the closest segment for each point.
+        projection_parameters (np.array): Array with the position of the projection of each point on its closest segment (0 at the start, 1 at the end).
+        distances_from_start (np.array): Array with the distance traveled from the route start until the projection of each point.
+    """
+
+    # The search uses np.float32, as "closest_projection", while the projection on the closest segment uses the original precision of the points
+    points_search = points.astype(np.float32)
+    route_segments = np.asarray(route_segments, dtype=np.float32)
+    segment_distances = np.asarray(segment_distances, dtype=np.float32)
+
+    # Get the number of points to iterate over
+    num_points = points.shape[0]
+
+    # Initialize with infinity
+    min_squared_distances = np.full(num_points, np.inf)
+    closest_segment_indexes = np.zeros(num_points, np.int32)
+    projection_parameters = np.zeros(num_points, np.float64)
+    distances_from_start = np.zeros(num_points, np.float32)
+
+    # Iterate over the points in parallel
+    for i in prange(num_points):
+        min_squared_distances[i], closest_segment_indexes[i], projection_parameters[i], distances_from_start[i] = project_point_with_distance(points_search[i, 0], points_search[i, 1], points[i, 0], points[i, 1], route_segments, segment_distances, segment_grid)
+
+    return min_squared_distances, closest_segment_indexes, projection_parameters, distances_from_start
+
+@jit(nopython=True, nogil=True)
+def closest_projection_incremental(points, route_segments, segment_distances, tolerance, window=32, segment_grid=None):
+    """
+    Finds the projection of each point onto a set of route segments, along with the distance traveled from the route start, using the continuity of time-ordered points.
+    Each point is first searched among the segments within a window around the segment matched to the previous point, falling back to a search on all the segments
+    (as in "closest_projection_with_distance") when the best distance in the window is not below the tolerance. The first point is always searched on all the segments.
+    Points within the tolerance may be matched to a different segment than the global search, for routes that pass near themselves, but never to a farther one than the tolerance.
+
+    Args:
+        points (np.array): Array of time-ordered points with shape (N, 2), where N is the number of points.
+        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
+        segment_distances (np.array): Array with the distance traveled at the start and at the end of each segment, with shape (M, 2).
+        tolerance (float): Maximum distance (in the units of the points) for a segment of the window to be accepted.
+        window (int, optional): Number of segments searched before and after the previous matched segment. Defaults to 32.
+        segment_grid (tuple, optional): Spatial index of the route segments used by the fallback search, as returned by "build_segment_grid". Defaults to None.
+
+    Returns:
+        min_squared_distances (np.array): Array of squared distances from each point to its matched segment.
+        closest_segment_indexes (np.array): Array of indexes of the matched segment for each point.
+        projection_parameters (np.array): Array with the position of the projection of each point on its matched segment (0 at the start, 1 at the end).
+        distances_from_start (np.array): Array with the distance traveled from the route start until the projection of each point.
+        num_fallbacks (int): Number of points (besides the first one) that needed the search on all the segments.
+    """
+
+    # The search uses np.float32, as "closest_projection", while the projection on the closest segment uses the original precision of the points
+    points_search = points.astype(np.float32)
+    route_segments = np.asarray(route_segments, dtype=np.float32)
+    segment_distances = np.asarray(segment_distances, dtype=np.float32)
+
+    # Get the number of points and segments
+    num_points = points.shape[0]
+    num_segments = route_segments.shape[0]
+
+    # Compare squared distances, as the search
+    tolerance_squared = tolerance * tolerance
+
+    # Initialize with infinity
+    min_squared_distances = np.full(num_points, np.inf)
+    closest_segment_indexes = np.zeros(num_points, np.int32)
+    projection_parameters = np.zeros(num_points, np.float64)
+    distances_from_start = np.zeros(num_points, np.float32)
+    num_fallbacks = 0
+
+    for i in range(num_points):
+        px, py = points_search[i, 0], points_search[i, 1]
+
+        min_squared_distance = np.inf
+        j = 0
+
+        if i > 0:
+            # Search the segments around the previous match (the smallest index wins on ties)
+            previous = closest_segment_indexes[i - 1]
+            for k in range(max(previous - window, 0), min(previous + window + 1, num_segments)):
+                distance = squared_distance_to_segment(px, py,
+                                                       route_segments[k][0][0], route_segments[k][0][1],
+                                                       route_segments[k][1][0], route_segments[k][1][1])
+                if distance < min_squared_distance:
+                    min_squared_distance = distance
+                    j = k
+
+            # Search all the segments if no segment of the window is within the tolerance
+            if not min_squared_distance < tolerance_squared:
+                num_fallbacks += 1
+
+        if i == 0 or not min_squared_distance < tolerance_squared:
+            min_squared_distance, j = find_closest_segment(px, py, route_segments, segment_grid)
+
+        min_squared_distances[i] = min_squared_distance
+        closest_segment_indexes[i] = j
+
+        # Get the position of the projection on the segment and the distance traveled until it
+        projection_parameters[i], distances_from_start[i] = project_point_on_route_segment(points[i, 0], points[i, 1], route_segments, segment_distances, j)
+
+    return min_squared_distances, closest_segment_indexes, projection_parameters, distances_from_start, num_fallbacks
+
+def set_num_threads(num_threads=None):
+    """
+    Sets the number of threads used by the parallel kernels.
+
+    Args:
+        num_threads (int, optional): Number of threads. Defaults to None, which uses all the threads available to numba (the number of cores, unless NUMBA_NUM_THREADS is set).
+
+    Returns:
+        int: The number of threads that will be used.
+    """
+
+    # Numba can't use more threads than the ones launched at startup
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    if num_threads is None:
+        num_threads = max_threads
+
+    assert num_threads >= 1, "The number of threads must be at least 1!"
+
+    numba.set_num_threads(min(num_threads, max_threads))
+
+    return numba.get_num_threads()
+
+@jit(nopython=True)
+def simplify_shapes(shape_points, shape_distances, shape_ids, tolerance):
+    """
+    Simplifies a set of shapes with the Douglas-Peucker algorithm, keeping the first and last point of each shape.
+    A point is removed only if its distance to the segment between the points kept around it is not greater than the tolerance,
+    and if the distance traveled interpolated for it on that segment differs from its own by no more than the tolerance (as measured by "simplification_distance_error").
+    The second condition is needed for shapes that wander within the tolerance (e.g. zig-zags), where the distance traveled along the removed points is longer than the segment.
+
+    Args:
+        shape_points (np.array): Array of shape points with shape (N, 2), ordered by shape and point sequence.
+        shape_distances (np.array): Array with the distance traveled from the start of the shape up to each point, with shape (N,).
+        shape_ids (np.array): Array with the shape identifier of each point, with shape (N,).
+        tolerance (float): Maximum distance (in the units of the points) from a removed point to the simplified shape, and maximum error (in the units of the distances) of its interpolated distance traveled.
+
+    Returns:
+        np.array: Boolean array with shape (N,), indicating the points kept.
+    """
+
+    num_points = shape_points.shape[0]
+    tolerance_squared = tolerance * tolerance
+
+    keep = np.zeros(num_points, np.bool_)
+
+    # Ranges of points (first and last index) still to be simplified
+    ranges = np.empty((num_points, 2), np.int64)
+
+    start = 0
+    while start < num_points:
+        # Get the last point of the shape
+        end = start
+        while end + 1 < num_points and shape_ids[end + 1] == shape_ids[start]:
+            end += 1
+
+        # The first and last points of each shape are always kept
+        keep[start] = True
+        keep[end] = True
+
+        ranges[0, 0], ranges[0, 1] = start, end
+        num_ranges = 1
+
+        while num_ranges > 0:
+            num_ranges -= 1
+            first, last = ranges[num_ranges, 0], ranges[num_ranges, 1]
+
+            # Get the farthest point from the segment between the first and last points of the range, and the point with the largest error of the interpolated distance
+            max_squared_distance, farthest = -1.0, -1
+            max_distance_error, worst = -1.0, -1
+            for i in range(first + 1, last):
+                distance = squared_distance_to_segment(shape_points[i, 0], shape_points[i, 1],
+                                                       shape_points[first, 0], shape_points[first, 1],
+                                                       shape_points[last, 0], shape_points[last, 1])
+                if distance > max_squared_distance:
+                    max_squared_distance, farthest = distance, i
+
+                # Interpolate the distance of the point on the segment, as "simplification_distance_error"
+                t = projection_parameter(shape_points[i, 0], shape_points[i, 1],
+                                         shape_points[first, 0], shape_points[first, 1],
+                                         shape_points[last, 0], shape_points[last, 1])
+                distance_error = abs(shape_distances[first] + t * (shape_distances[last] - shape_distances[first]) - shape_distances[i])
+                if distance_error > max_distance_error:
+                    max_distance_error, worst = distance_error, i
+
+            # Keep the farthest point if it's out of the tolerance (or else the point with the largest distance error, if it's out of the tolerance), and simplify the ranges before and after it
+            split = -1
+            if farthest >= 0 and max_squared_distance > tolerance_squared:
+                split = farthest
+            elif worst >= 0 and not max_distance_error <= tolerance:
+                split = worst
+
+            if split >= 0:
+                keep[split] = True
+                ranges[num_ranges, 0], ranges[num_ranges, 1] = first, split
+                ranges[num_ranges + 1, 0], ranges[num_ranges + 1, 1] = split, last
+                num_ranges += 2
+
+        start = end + 1
+
+    return keep
+
+@jit(nopython=True)
+def simplification_distance_error(shape_points, shape_distances, keep):
+    """
+    Measures the error of the distances traveled interpolated on a simplified shape, at the points removed by the simplification.
+
+    Args:
+        shape_points (np.array): Array of shape points with shape (N, 2), ordered by shape and point sequence.
+        shape_distances (np.array): Array with the distance traveled from the start of the shape up to each point, with shape (N,).
+        keep (np.array): Boolean array with shape (N,), indicating the points kept (including the first and last point of each shape), as returned by "simplify_shapes".
+
+    Returns:
+        float: The largest difference between the original distance of a removed point and the distance interpolated for it on the simplified shape.
+    """
+
+    max_error = 0.0
 
-@jit(nopython=True)
-def closest_projection(points, route_segments):
+    # Last point kept before the current one
+    previous = 0
+    for i in range(shape_points.shape[0]):
+        if keep[i]:
+            previous = i
+            continue
+
+        # Get the next point kept (the removed points always lie between two kept points of the same shape)
+        following = i + 1
+        while not keep[following]:
+            following += 1
+
+        # Interpolate the distance of the removed point on the segment that replaced it
+        t = projection_parameter(shape_points[i, 0], shape_points[i, 1],
+                                 shape_points[previous, 0], shape_points[previous, 1],
+                                 shape_points[following, 0], shape_points[following, 1])
+        distance = shape_distances[previous] + t * (shape_distances[following] - shape_distances[previous])
+        max_error = max(max_error, abs(distance - shape_distances[i]))
+
+    return max_error
+
+def build_shape_segments(shape_points, shape_distances, shape_ids):
     """
-    Finds the closest projection of each point onto a set of route segments.
+    Builds the segments between consecutive points of a set of shapes, leaving out the segments that would join the end of a shape to the start of the next one.
 
     Args:
-        points (np.array): Array of points with shape (N, 2), where N is the number of points.
-        route_segments (np.array): Array of route segments with shape (M, 2, 2), where M is the number of segments.
-    
+        shape_points (np.array): Array of shape points with shape (N, 2), ordered by shape and point sequence.
+        shape_distances (np.array): Array with the distance traveled from the start of the shape up to each point, with shape (N,).
+        shape_ids (np.array): Array with the shape identifier of each point, with shape (N,).
+
     Returns:
-        min_squared_distances (np.array): Array of minimum squared distances from each point to its closest segment.
-        closest_segment_indexes (np.array): Array of indexes of the closest segment for each point.
+        segments (np.array): Array of segments with shape (M, 2, 2), where M is the number of segments.
+        segment_distances (np.array): Array with the distance traveled at the start and at the end of each segment, with shape (M, 2).
     """
-    
-    # Convert the numpy arrays to store data as np.float32
-    points = points.astype(np.float32)
-    route_segments = np.array(route_segments).astype(np.float32)
 
-    # Get the number of points and route segments to iterate over
-    num_points = points.shape[0]
-    num_segments = route_segments.shape[0]
+    shape_points = np.asarray(shape_points)
+    shape_distances = np.asarray(shape_distances)
+    shape_ids = np.asarray(shape_ids)
 
-    # Initialize with infinity
-    min_squared_distances = np.full(num_points, np.inf)
-    closest_segment_indexes = np.zeros(num_points, np.int32)
+    # Keep only the pairs of consecutive points that belong to the same shape
+    same_shape = shape_ids[1:] == shape_ids[:-1]
 
-    # Iterate over each point and each segment
-    for i in range(num_points):
-        for j in range(num_segments):
-            # Get the squared distance from the point to the segment
-            # We used the squared distance to avoid the square root operation, as the magnitude is not needed, just the order of the sorted distances
-            distance = squared_distance_to_segment(points[i, 0], points[i, 1],
-                                                   route_segments[j][0][0], route_segments[j][0][1],
-                                                   route_segments[j][1][0], route_segments[j][1][1])
-            # Save the minimum distance and the closest segment index
-            if distance < min_squared_distances[i]:
-                min_squared_distances[i] = distance
-                closest_segment_indexes[i] = j
+    # Pair each point with the next one, as contiguous arrays so they can be passed to the kernels without copies
+    segments = np.ascontiguousarray(np.stack([shape_points[:-1], shape_points[1:]], axis=1)[same_shape])
+    segment_distances = np.ascontiguousarray(np.stack([shape_distances[:-1], shape_distances[1:]], axis=1)[same_shape])
 
-    # Return the best results for each point
-    return min_squared_distances, closest_segment_indexes
+    return segments, segment_distances
 
 @jit(cache=True)
 def get_latitude_meters_coefficient(latitude):
@@ -240,6 +941,10 @@ def infer_bus_direction(distance_traveled_inbound, distance_traveled_outbound, t
 def assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N=5, terminal_tolerance=500):
     """
     Assigns the direction to a GPS point based on the distance from the start of the route.
+    The means of the last N distances are kept as rolling sums, and the points with unknown direction are filled with the next inferred direction in a final reverse sweep.
+    The cost is O(1) per point, except for the points whose difference of the means is within the rounding bound of the tolerance (or not a number): those are re-evaluated exactly by "infer_bus_direction", in O(N),
+    as the float32 means it sums in order can't be reproduced by rolling sums. The rolling sums are also summed again every 256 points, adding O(points * N / 256).
+    So the cost is O(points) for typical data, and O(points * N) in the worst case, where every window falls within the rounding bound (which grows with N and the distances: about 0.15 meters for N=5 and distances of 25 kilometers).
     
     Args:
         gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
@@ -252,12 +957,38 @@ def assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N=5,
         tuple: Arrays of inferred directions and the method used to infer them (directly (using the last N points) or indirectly (using the next direction inference)).
     """
     
+    # The direction is inferred from at least one previous point
+    assert N > 0
+
+    num_points = len(gps_in_route)
+
     # Initialize the result array with -1 for unknown direction
-    result = np.full(len(gps_in_route), -1)
-    directly_infered = np.full(len(gps_in_route), False)
+    result = np.full(num_points, -1)
+    directly_infered = np.full(num_points, False)
+
+    # Tolerance used by "infer_bus_direction"
+    tolerance = 100
+
+    # Rolling sums of the last N distances in each direction (and of their absolute values, to bound the rounding errors)
+    sum_dir_0, sum_dir_1, abs_sum_dir_0, abs_sum_dir_1 = 0.0, 0.0, 0.0, 0.0
 
     # Iterate over the GPS points, starting from the N-th point
-    for i in range(N, len(gps_in_route)):
+    for i in range(N, num_points):
+
+        # Update the sums of the window [i-N, i), summing the whole window again from time to time so the rounding errors don't accumulate
+        if i == N or (i - N) % 256 == 0:
+            sum_dir_0, sum_dir_1, abs_sum_dir_0, abs_sum_dir_1 = 0.0, 0.0, 0.0, 0.0
+            for k in range(i - N, i):
+                sum_dir_0 += gps_distance_dir_0[k]
+                sum_dir_1 += gps_distance_dir_1[k]
+                abs_sum_dir_0 += abs(gps_distance_dir_0[k])
+                abs_sum_dir_1 += abs(gps_distance_dir_1[k])
+        else:
+            sum_dir_0 += gps_distance_dir_0[i-1] - gps_distance_dir_0[i-N-1]
+            sum_dir_1 += gps_distance_dir_1[i-1] - gps_distance_dir_1[i-N-1]
+            abs_sum_dir_0 += abs(gps_distance_dir_0[i-1]) - abs(gps_distance_dir_0[i-N-1])
+            abs_sum_dir_1 += abs(gps_distance_dir_1[i-1]) - abs(gps_distance_dir_1[i-N-1])
+
         # If the GPS point is not in the route, skip
         if gps_in_route[i] == False:
             continue
@@ -267,17 +998,32 @@ def assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N=5,
             result[i] = result[i-1]
             continue
 
-        # Get the last N elements of each direction
-        result[i] = infer_bus_direction(gps_distance_dir_0[i-N:i], gps_distance_dir_1[i-N:i])
+        # Get the difference between the mean distances traveled in each direction from the rolling sums, as "infer_bus_direction"
+        diff_mean_distance_traveled = (sum_dir_0 / N - gps_distance_dir_0[i-N]) - (sum_dir_1 / N - gps_distance_dir_1[i-N])
+
+        # Bound of the difference to the value "infer_bus_direction" gets summing the distances with their own precision (np.float32)
+        rounding_error = 4 * FLOAT32_EPSILON * (abs_sum_dir_0 + abs_sum_dir_1 + abs(gps_distance_dir_0[i-N]) + abs(gps_distance_dir_1[i-N]))
+
+        if abs(abs(diff_mean_distance_traveled) - tolerance) > rounding_error:
+            # The difference is clearly on one side of the tolerance
+            if abs(diff_mean_distance_traveled) > tolerance:
+                result[i] = 0 if diff_mean_distance_traveled > 0 else 1
+        else:
+            # Too close to the tolerance (or not a number, as the comparison above is then False): get the last N elements of each direction and infer the direction exactly
+            result[i] = infer_bus_direction(gps_distance_dir_0[i-N:i], gps_distance_dir_1[i-N:i])
+
         if result[i] != -1:
             directly_infered[i] = True
 
-        # If the last datapoints are in route and the directions are still unknown, assign the direction infered
-        for j in range(i, 0, -1):
-            if result[j] != -1 and result[j-1] == -1 and gps_in_route[j-1] == True:
-                result[j-1] = result[j]
-            else:
-                break
+    # If the last datapoints are in route and the directions are still unknown, assign the next direction infered (in a single reverse sweep)
+    next_direction = -1
+    for i in range(num_points - 1, -1, -1):
+        if result[i] != -1:
+            next_direction = result[i]
+        elif gps_in_route[i] == True:
+            result[i] = next_direction
+        else:
+            next_direction = -1
 
     # Return the array with the infered directions and the method used to infer them
     return result, directly_infered
@@ -396,6 +1142,109 @@ def assign_mean_speed(gps_in_route, gps_timestamps, gps_cumulative_distance, N=3
     # Return the array with the mean speeds
     return mean_speeds
 
+@jit(nopython=True)
+def assign_window_speeds(gps_in_route, gps_timestamps, gps_cumulative_distance, windows, companion_features=False, stop_speed=2.0):
+    """
+    Assigns the mean speed over each of the given windows of the last minutes of GPS data.
+    The start of each window is tracked with a pointer that only moves forward, so the mean speeds are the same as "assign_mean_speed" in linear time
+    (for timestamps in ascending order, otherwise each start is searched backwards as in "assign_mean_speed").
+    Optionally, the speed variance and the fraction of time stopped in each window are calculated from prefix sums of the speeds between consecutive points, weighted by the time between them.
+
+    Args:
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_timestamps (np.array): Array of timestamps (in seconds) for each GPS point.
+        gps_cumulative_distance (np.array): Array of cumulative distances traveled for each GPS point.
+        windows (np.array): Array with the number of last minutes of each window.
+        companion_features (bool, optional): Whether to calculate the speed variances and stop fractions. Defaults to False.
+        stop_speed (float, optional): Speed (in km/h) below which the bus is considered stopped between two points. Defaults to 2.0.
+
+    Returns:
+        mean_speeds (np.array): Array of mean speeds (in km/h) with shape (N, W), where W is the number of windows.
+        speed_variances (np.array): Array of variances of the speeds between consecutive points within each window, with shape (N, W) (or (0, W) if not calculated).
+        stop_fractions (np.array): Array of fractions of the time of each window with the bus stopped, with shape (N, W) (or (0, W) if not calculated).
+    """
+
+    num_points = len(gps_timestamps)
+    num_windows = len(windows)
+
+    # Initialize the arrays to store the features of each window
+    mean_speeds = np.zeros((num_points, num_windows), dtype=np.float64)
+    num_companion_points = num_points if companion_features else 0
+    speed_variances = np.zeros((num_companion_points, num_windows), dtype=np.float64)
+    stop_fractions = np.zeros((num_companion_points, num_windows), dtype=np.float64)
+
+    # Check if the timestamps are in ascending order, so the window starts only move forward
+    ascending = True
+    for i in range(1, num_points):
+        if gps_timestamps[i] < gps_timestamps[i-1]:
+            ascending = False
+            break
+
+    # Prefix sums of the time, the time-weighted speed and squared speed, and the time stopped, between consecutive points
+    prefix_time = np.zeros(num_companion_points, dtype=np.float64)
+    prefix_speed = np.zeros(num_companion_points, dtype=np.float64)
+    prefix_squared_speed = np.zeros(num_companion_points, dtype=np.float64)
+    prefix_stopped_time = np.zeros(num_companion_points, dtype=np.float64)
+
+    for i in range(1, num_companion_points):
+        prefix_time[i] = prefix_time[i-1]
+        prefix_speed[i] = prefix_speed[i-1]
+        prefix_squared_speed[i] = prefix_squared_speed[i-1]
+        prefix_stopped_time[i] = prefix_stopped_time[i-1]
+
+        time_diff = gps_timestamps[i] - gps_timestamps[i-1]
+        if time_diff > 0:
+            speed = (gps_cumulative_distance[i] - gps_cumulative_distance[i-1]) / time_diff * 3.6
+            prefix_time[i] += time_diff
+            prefix_speed[i] += speed * time_diff
+            prefix_squared_speed[i] += speed * speed * time_diff
+            if abs(speed) < stop_speed:
+                prefix_stopped_time[i] += time_diff
+
+    for w in range(num_windows):
+        window_seconds = 60 * windows[w]
+
+        # Initial point of the window
+        j = 0
+
+        for i in range(1, num_points):
+            current_timestamp = gps_timestamps[i]
+
+            # Get the initial point of the window: the last one at least N minutes before the current point (or the first point)
+            if ascending:
+                # The initial point of the previous point is at least as old, so the search continues from it
+                while j + 1 < i and current_timestamp - gps_timestamps[j + 1] >= window_seconds:
+                    j += 1
+            else:
+                j = i - 1
+                while j > 0 and current_timestamp - gps_timestamps[j] < window_seconds:
+                    j -= 1
+
+            # Skip the points that are not in the route
+            if gps_in_route[i] == False or gps_in_route[i-1] == False:
+                continue
+
+            # Evaluate the time and distance differences
+            time_diff = current_timestamp - gps_timestamps[j]
+            distance_diff = gps_cumulative_distance[i] - gps_cumulative_distance[j]
+
+            # Ensure time_diff is not zero to avoid division by zero
+            if time_diff > 0:
+                # Calculate the mean speed (in km/h)
+                mean_speeds[i, w] = distance_diff / time_diff * 3.6
+
+            # Get the variance of the speeds and the fraction of time stopped from the prefix sums
+            if not companion_features:
+                continue
+
+            window_time = prefix_time[i] - prefix_time[j]
+            if window_time > 0:
+                weighted_mean_speed = (prefix_speed[i] - prefix_speed[j]) / window_time
+                speed_variances[i, w] = max((prefix_squared_speed[i] - prefix_squared_speed[j]) / window_time - weighted_mean_speed * weighted_mean_speed, 0.0)
+                stop_fractions[i, w] = (prefix_stopped_time[i] - prefix_stopped_time[j]) / window_time
+
+    return mean_speeds, speed_variances, stop_fractions
+
 @jit(nopython=True)
 def get_closest_stop(gps_distance, stop_distances, mode="next"):
     """
@@ -456,8 +1305,50 @@ def get_next_stop(gps_distance, stop_distances):
     """
     return get_closest_stop(gps_distance, stop_distances, mode="next")
 
-@ jit(nopython=True)
-def assign_stops(gps_in_route, gps_direction, gps_distance, stops_distances_by_direction):
+def concatenate_stop_distances(stops_distances_by_direction):
+    """
+    Concatenate the distances to the stops of every direction into a single array, so they can be used by the compiled kernels.
+
+    Args:
+        stops_distances_by_direction (list): List of distances to each stop for each direction.
+
+    Returns:
+        tuple: Array of the distances to the stops of every direction (np.float64) and array of the offsets of each direction in it, with one more element than the number of directions.
+    """
+
+    stop_offsets = np.zeros(len(stops_distances_by_direction) + 1, dtype=np.int64)
+    stop_offsets[1:] = np.cumsum([len(stop_distances) for stop_distances in stops_distances_by_direction])
+    stop_distances = np.concatenate([np.asarray(stop_distances, dtype=np.float64) for stop_distances in stops_distances_by_direction] + [np.empty(0)])
+
+    return stop_distances, stop_offsets
+
+@jit(nopython=True)
+def get_stop_distances(stop_distances, stop_offsets, direction):
+    """
+    Get the distances to the stops of a direction, indexed as the list of distances by direction (-1 is the last direction).
+
+    Args:
+        stop_distances (np.array): Distances to each stop of every direction, concatenated.
+        stop_offsets (np.array): Offsets of the stops of each direction in stop_distances.
+        direction (int): The direction of the bus.
+
+    Raises:
+        IndexError: If there are no stops for the direction.
+
+    Returns:
+        np.array: The distances to each stop of the direction.
+    """
+
+    num_directions = len(stop_offsets) - 1
+    direction_index = direction if direction >= 0 else num_directions + direction
+
+    if direction_index < 0 or direction_index >= num_directions:
+        raise IndexError("list index out of range")
+
+    return stop_distances[stop_offsets[direction_index]:stop_offsets[direction_index + 1]]
+
+@jit(nopython=True)
+def assign_stops(gps_in_route, gps_direction, gps_distance, stop_distances_all, stop_offsets):
     """
     Assigns the stops to the GPS data based on the direction and distance from the start of the route.
 
@@ -465,21 +1356,25 @@ def assign_stops(gps_in_route, gps_direction, gps_distance, stops_distances_by_d
         gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
         gps_direction (np.array): Array of inferred directions for each GPS point (-1 for unknown, 0 for inbound, 1 for outbound).
         gps_distance (np.array): Array of distances traveled for each GPS point.
-        stops_distances_by_direction (dict): Dictionary of distances to each stop for each direction.
+        stop_distances_all (np.array): Distances to each stop of every direction, concatenated (see "concatenate_stop_distances").
+        stop_offsets (np.array): Offsets of the stops of each direction in stop_distances_all.
     
     Returns:
         tuple: Arrays of indexes of the last and next stops, and distances to the last and next stops.
     """
 
-    # By default, the first direction is the first one in the list
-    stop_distances = stops_distances_by_direction[gps_direction[0]]
-
     # Initialize the lists of last and next stops with -1, by default
     last_stops = np.full(len(gps_in_route), -1, dtype=np.int32)
     next_stops = np.full(len(gps_in_route), -1, dtype=np.int32)
     distance_to_last_stop = np.full(len(gps_in_route), -1, dtype=np.float32)
     distance_to_next_stop = np.full(len(gps_in_route), -1, dtype=np.float32)
 
+    if len(gps_in_route) == 0:
+        return last_stops, next_stops, distance_to_last_stop, distance_to_next_stop
+
+    # By default, the first direction is the first one in the list
+    stop_distances = get_stop_distances(stop_distances_all, stop_offsets, gps_direction[0])
+
     # Iterate over the GPS data
     for i in range(len(gps_in_route)):
         # Skip the points that are not in the route
@@ -488,7 +1383,7 @@ def assign_stops(gps_in_route, gps_direction, gps_distance, stops_distances_by_d
 
         # Update the list of stops by direction if it has changed
         if i > 0 and gps_direction[i] != gps_direction[i-1]:
-            stop_distances = stops_distances_by_direction[gps_direction[i]]
+            stop_distances = get_stop_distances(stop_distances_all, stop_offsets, gps_direction[i])
 
         # Assign the indexes of the last and next stops
         next_stops[i] = get_next_stop(gps_distance[i], stop_distances)
@@ -505,21 +1400,38 @@ def assign_stops(gps_in_route, gps_direction, gps_distance, stops_distances_by_d
 @jit(nopython=True)
 def map_distance_into_timestamp(current_distance, initial_distance, final_distance, initial_timestamp, final_timestamp):
     """
-    Map a distance into a timestamp using a linear interpolation
-    
+    Map a distance into a timestamp using a linear interpolation.
+    The timestamps are in nanoseconds, and the result is truncated as in the operations of np.timedelta64 with floats.
+
     Args:
         current_distance (float): The distance to be mapped
         initial_distance (float): The initial distance
         final_distance (float): The final distance
-        initial_timestamp (int): The initial timestamp
-        final_timestamp (int): The final timestamp
+        initial_timestamp (int): The initial timestamp (in nanoseconds)
+        final_timestamp (int): The final timestamp (in nanoseconds)
 
     Returns:
-        float: The mapped timestamp
+        tuple: The mapped timestamp (in nanoseconds) and whether it is valid (False where np.timedelta64 would be NaT).
     """
-    return (current_distance - initial_distance) * (final_timestamp - initial_timestamp) / (final_distance - initial_distance) + initial_timestamp
 
-def generate_virtual_point(initial_distance, final_distance, initial_cumulative_distance, initial_timestamp, initial_cumulative_time, final_timestamp, stop_num, stop_distances, direction):
+    # Scale the time difference by the distance difference, truncating it to nanoseconds
+    scaled_time_diff = (final_timestamp - initial_timestamp) * (current_distance - initial_distance)
+    if not np.isfinite(scaled_time_diff):
+        return initial_timestamp, False
+
+    # Divide it by the distance between the datapoints, truncating it again
+    distance_diff = final_distance - initial_distance
+    if distance_diff == 0:
+        return initial_timestamp, False
+
+    time_diff = np.int64(scaled_time_diff) / distance_diff
+    if not np.isfinite(time_diff):
+        return initial_timestamp, False
+
+    return initial_timestamp + np.int64(time_diff), True
+
+@jit(nopython=True)
+def generate_virtual_point(initial_distance, final_distance, initial_cumulative_distance, initial_timestamp, initial_cumulative_time, final_timestamp, stop_num, stop_distances):
     """
     Generate a virtual datapoint for a bus stop based on the location of the next stop, simulating the time when the bus would stop at that location.
 
@@ -527,54 +1439,53 @@ def generate_virtual_point(initial_distance, final_distance, initial_cumulative_
         initial_distance (float): The distance of the initial GPS datapoint.
         final_distance (float): The distance of the final GPS datapoint.
         initial_cumulative_distance (float): The cumulative distance of the initial GPS datapoint.
-        initial_timestamp (int): The timestamp of the initial GPS datapoint.
+        initial_timestamp (int): The timestamp of the initial GPS datapoint (in nanoseconds).
         initial_cumulative_time (int): The cumulative time of the initial GPS datapoint.
-        final_timestamp (int): The timestamp of the final GPS datapoint.
+        final_timestamp (int): The timestamp of the final GPS datapoint (in nanoseconds).
         stop_num (int): The index of the stop to generate the virtual datapoint.
         stop_distances (np.array): The distances of each stop.
-        direction (int): The direction of the bus.
 
     Returns:
-        list: The virtual datapoint with the timestamp, distance traveled, cumulative distance traveled, time traveled, cumulative time traveled, direction, current stop index, and next stop distance.
+        tuple: The error code (0 for valid, 1 for timestamp error and 2 for distance error), and the timestamp, distance traveled, cumulative distance traveled, time traveled, cumulative time traveled and next stop distance of the virtual datapoint.
     """
 
     # Get the timestamp and distance of the virtual datapoint
-    virtual_timestamp = map_distance_into_timestamp(stop_distances[stop_num], initial_distance, final_distance, initial_timestamp, final_timestamp)
+    virtual_timestamp, valid_timestamp = map_distance_into_timestamp(stop_distances[stop_num], initial_distance, final_distance, initial_timestamp, final_timestamp)
     virtual_distance = stop_distances[stop_num]
 
-    try:
-        # Assert if both values are valid
-        # It seems obvious that the virtual timestamp should be between the initial and final timestamps
-        # But, in a case of wrong direction inference, the virtual distance probably will be out of bounds
-        # This is a way to avoid this kind of error, as the main can catch this error and skip the virtual datapoint or the entire bus data
-        assert virtual_timestamp >= initial_timestamp and virtual_timestamp <= final_timestamp, f"TIMESTAMP ERROR: {virtual_timestamp} {initial_timestamp} {final_timestamp}"
-        assert virtual_distance >= initial_distance and virtual_distance <= final_distance, f"DISTANCE ERROR: {virtual_distance} {initial_distance} {final_distance}"
-
-        next_stop_index = min(stop_num + 1, len(stop_distances) - 1)
-        
-        # Evaluate the time diff as an integer
-        time_diff = pd.Timedelta(virtual_timestamp - initial_timestamp).seconds
-
-        # Append the virtual datapoints to alist
-        return [virtual_timestamp, # timestamp
-                virtual_distance, # distance_traveled
-                initial_cumulative_distance + (virtual_distance - initial_distance), # cumulative_distance_traveled
-                time_diff, # time_traveled
-                initial_cumulative_time + time_diff, # cumulative_time_traveled
-                direction, # direction
-                stop_num, # current_stop_index
-                stop_distances[next_stop_index] - stop_distances[stop_num]] # next_stop_distance
-    
-    except AssertionError as e:
-        print(e)
-        return None
+    next_stop_index = min(stop_num + 1, len(stop_distances) - 1)
+
+    # Evaluate the time diff as an integer (the seconds of the day, as pd.Timedelta.seconds)
+    time_diff = (virtual_timestamp - initial_timestamp) // 10**9 % 86400
+
+    # Values of the virtual datapoint
+    virtual_datapoint = (virtual_timestamp, # timestamp
+                         virtual_distance, # distance_traveled
+                         initial_cumulative_distance + (virtual_distance - initial_distance), # cumulative_distance_traveled
+                         time_diff, # time_traveled
+                         initial_cumulative_time + time_diff, # cumulative_time_traveled
+                         stop_distances[next_stop_index] - stop_distances[stop_num]) # next_stop_distance
+
+    # Check if both values are valid
+    # It seems obvious that the virtual timestamp should be between the initial and final timestamps
+    # But, in a case of wrong direction inference, the virtual distance probably will be out of bounds
+    # This is a way to avoid this kind of error, as the caller can count and skip the invalid virtual datapoints
+    if not (valid_timestamp and virtual_timestamp >= initial_timestamp and virtual_timestamp <= final_timestamp):
+        return 1, virtual_datapoint
+    if not (virtual_distance >= initial_distance and virtual_distance <= final_distance):
+        return 2, virtual_datapoint
 
-def virtualize_stop_points(gps_timestamps, gps_in_route, gps_direction, gps_last_stop_index, gps_next_stop_index, gps_distances, gps_cumulative_distances, gps_cumulative_time, mean_speeds, stops_distances_by_direction, vehicle_id, service_id):
+    return 0, virtual_datapoint
+
+@jit(nopython=True, nogil=True)
+def generate_virtual_points(gps_timestamps, gps_in_route, gps_direction, gps_last_stop_index, gps_next_stop_index, gps_distances, gps_cumulative_distances, gps_cumulative_time, mean_speeds, stop_distances, stop_offsets, vehicle_offsets, num_virtual_points):
     """
-    Generate virtual datapoints for each bus stop based on the location of each stop, simulating the time when the bus would stop at each one.
+    Generate the virtual datapoints for each bus stop into preallocated arrays.
+    It must be called twice: first with num_virtual_points=0, only to count the virtual datapoints, and then with the count, to fill the arrays.
+    The GPS points may belong to several vehicles, stored one after the other, and the datapoints of each vehicle are generated independently.
 
     Args:
-        gps_timestamps (np.array): Array of timestamps for each GPS point.
+        gps_timestamps (np.array): Array of timestamps for each GPS point (in nanoseconds).
         gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
         gps_direction (np.array): Array of inferred directions for each GPS point (-1 for unknown, 0 for inbound, 1 for outbound).
         gps_last_stop_index (np.array): Array of indexes of the last stop for each GPS point.
@@ -582,109 +1493,300 @@ def virtualize_stop_points(gps_timestamps, gps_in_route, gps_direction, gps_last
         gps_distances (np.array): Array of distances traveled for each GPS point.
         gps_cumulative_distances (np.array): Array of cumulative distances traveled for each GPS point.
         gps_cumulative_time (np.array): Array of cumulative times traveled for each GPS point.
-        mean_speeds (np.array): Array of mean speeds for each GPS point.
-        stops_distances_by_direction (dict): Dictionary of distances to each stop for each direction.
-        vehicle_id (str): The vehicle identifier.
-        service_id (str): The service identifier.
+        mean_speeds (np.array): Array of mean speeds for each GPS point, with shape (N, S).
+        stop_distances (np.array): Distances to each stop of every direction, concatenated.
+        stop_offsets (np.array): Offsets of the stops of each direction in stop_distances, with one more element than the number of directions.
+        vehicle_offsets (np.array): Offsets of the GPS points of each vehicle, with one more element than the number of vehicles.
+        num_virtual_points (int): Number of virtual datapoints to be filled (0 to only count them).
 
     Returns:
-        pd.DataFrame: DataFrame with the virtual datapoints for each bus stop.
+        tuple: Number of virtual datapoints, numbers of timestamp and distance errors, offsets of the virtual datapoints of each vehicle, and the arrays of timestamps, cumulative distances traveled, times traveled, cumulative times traveled, directions, current stop indexes, next stop distances and mean speeds of the virtual datapoints.
     """
 
-    # By default, the first direction is the first one in the list
-    current_direction = gps_direction[0]
-    stop_distances = stops_distances_by_direction[current_direction]
-    
-    # Initialize the list of virtual datapoints
-    virtual_datapoints = list()
-
-    # Iterate over the gps data
-    for i in range(1, len(gps_timestamps)):
-
-        # Ensure that the last and current datapoint are in the route
-        if gps_in_route[i-1] == False or gps_in_route[i] == False:
-            continue
+    # Initialize the arrays of the virtual datapoints
+    timestamps = np.empty(num_virtual_points, dtype=np.int64)
+    cumulative_distances = np.empty(num_virtual_points, dtype=np.float64)
+    times_traveled = np.empty(num_virtual_points, dtype=np.int64)
+    cumulative_times = np.empty(num_virtual_points, dtype=np.int64)
+    directions = np.empty(num_virtual_points, dtype=np.int64)
+    stop_indexes = np.empty(num_virtual_points, dtype=np.int64)
+    next_stop_distances = np.empty(num_virtual_points, dtype=np.float64)
+    virtual_mean_speeds = np.empty((num_virtual_points, mean_speeds.shape[1]), dtype=np.float64)
+
+    # Counters of the virtual datapoints and of the rejected ones
+    count = 0
+    timestamp_errors = 0
+    distance_errors = 0
+    virtual_offsets = np.zeros(len(vehicle_offsets), dtype=np.int64)
+
+    # Iterate over the vehicles
+    for vehicle in range(len(vehicle_offsets) - 1):
+        start, end = vehicle_offsets[vehicle], vehicle_offsets[vehicle + 1]
+
+        if end > start:
+            # By default, the first direction is the first one in the list (-1 is the last one, as a Python list)
+            current_direction = gps_direction[start]
+            stop_distances_by_direction = get_stop_distances(stop_distances, stop_offsets, current_direction)
+
+        # Iterate over the gps data of the vehicle
+        for i in range(start + 1, end):
+            # Ensure that the last and current datapoint are in the route
+            if gps_in_route[i-1] == False or gps_in_route[i] == False:
+                continue
 
-        # If the direction changes
-        if gps_direction[i] != current_direction:
+            # If the direction changes
+            if gps_direction[i] != current_direction:
 
-            # TODO: Generate a virtual datapoint to represent the final station (predict the time where the bus will stop at distance=MAX, i.e., the end of the route)
+                # TODO: Generate a virtual datapoint to represent the final station (predict the time where the bus will stop at distance=MAX, i.e., the end of the route)
 
-            current_direction = gps_direction[i] # Update the current direction
-            stop_distances = stops_distances_by_direction[current_direction] # Update the stop distances
+                # Update the current direction and the stop distances
+                current_direction = gps_direction[i]
+                stop_distances_by_direction = get_stop_distances(stop_distances, stop_offsets, current_direction)
 
-            # TODO: Generate a virtual datapoint for the initial station (predict the time where the bus started the movement at distance=0)
+                # TODO: Generate a virtual datapoint for the initial station (predict the time where the bus started the movement at distance=0)
 
-            continue # To ensure that we have 2 consecutive datapoints with the same direction
+                continue # To ensure that we have 2 consecutive datapoints with the same direction
 
-        # Check if the bus went through a bus stop between the last and current datapoints
-        if gps_last_stop_index[i-1] != gps_last_stop_index[i] or gps_next_stop_index[i-1] != gps_next_stop_index[i]:
+            # Check if the bus went through a bus stop between the last and current datapoints
+            if gps_last_stop_index[i-1] == gps_last_stop_index[i] and gps_next_stop_index[i-1] == gps_next_stop_index[i]:
+                continue
 
             # Get the indexes of the stops to be generated
             initial_stop_index = gps_next_stop_index[i-1]
             final_stop_index = gps_last_stop_index[i]
 
-            if initial_stop_index >= len(stop_distances) or final_stop_index >= len(stop_distances):
-                # print(f"ERROR: Stop index out of bounds: {initial_stop_index} {final_stop_index}")
+            if initial_stop_index >= len(stop_distances_by_direction) or final_stop_index >= len(stop_distances_by_direction):
                 continue
 
-            # Get the distances of the last and current datapoint, to be used in the interpolation
-            initial_distance = gps_distances[i-1]
-            final_distance = gps_distances[i]
-
-            initial_timestamp = gps_timestamps[i-1]
-            final_timestamp = gps_timestamps[i]
-
-            initial_cumulative_distance = gps_cumulative_distances[i-1]
-
             # Iteratate over the stops to be generated
             for stop_num in range(initial_stop_index, final_stop_index + 1):
                 # Generate a virtual datapoint for each stop
-                virtual_datapoint = generate_virtual_point(initial_distance, final_distance, initial_cumulative_distance, initial_timestamp, gps_cumulative_time[i-1], final_timestamp, stop_num, stop_distances, gps_direction[i])
+                error, virtual_datapoint = generate_virtual_point(gps_distances[i-1], gps_distances[i], gps_cumulative_distances[i-1], gps_timestamps[i-1], gps_cumulative_time[i-1], gps_timestamps[i], stop_num, stop_distances_by_direction)
 
-                # Check if the virtual datapoint is valid
-                if virtual_datapoint is None:
+                # Count the invalid virtual datapoints
+                if error == 1:
+                    timestamp_errors += 1
                     continue
+                if error == 2:
+                    distance_errors += 1
+                    continue
+
+                # Fill the virtual datapoint, with the mean speeds of the current datapoint
+                if count < num_virtual_points:
+                    timestamps[count] = virtual_datapoint[0]
+                    cumulative_distances[count] = virtual_datapoint[2]
+                    times_traveled[count] = virtual_datapoint[3]
+                    cumulative_times[count] = virtual_datapoint[4]
+                    directions[count] = gps_direction[i]
+                    stop_indexes[count] = stop_num
+                    next_stop_distances[count] = virtual_datapoint[5]
+                    virtual_mean_speeds[count] = mean_speeds[i]
+
+                count += 1
+
+        virtual_offsets[vehicle + 1] = count
+
+    return count, timestamp_errors, distance_errors, virtual_offsets, timestamps, cumulative_distances, times_traveled, cumulative_times, directions, stop_indexes, next_stop_distances, virtual_mean_speeds
+
+def virtualize_route_stop_points(gps_timestamps, gps_in_route, gps_direction, gps_last_stop_index, gps_next_stop_index, gps_distances, gps_cumulative_distances, gps_cumulative_time, mean_speeds, stops_distances_by_direction, vehicle_ids, service_id, vehicle_offsets, speed_columns=('mean_speed_1_min', 'mean_speed_3_min', 'mean_speed_5_min')):
+    """
+    Generate virtual datapoints for each bus stop for several vehicles at once, with the GPS points of each vehicle stored one after the other (see "virtualize_stop_points").
+
+    Args:
+        gps_timestamps (np.array): Array of timestamps for each GPS point.
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_direction (np.array): Array of inferred directions for each GPS point (-1 for unknown, 0 for inbound, 1 for outbound).
+        gps_last_stop_index (np.array): Array of indexes of the last stop for each GPS point.
+        gps_next_stop_index (np.array): Array of indexes of the next stop for each GPS point.
+        gps_distances (np.array): Array of distances traveled for each GPS point.
+        gps_cumulative_distances (np.array): Array of cumulative distances traveled for each GPS point.
+        gps_cumulative_time (np.array): Array of cumulative times traveled for each GPS point.
+        mean_speeds (np.array): Array of mean speeds for each GPS point, with one column for each name in speed_columns.
+        stops_distances_by_direction (list): List of distances to each stop for each direction.
+        vehicle_ids (list): The identifier of each vehicle.
+        service_id (str): The service identifier.
+        vehicle_offsets (np.array): Offsets of the GPS points of each vehicle, with one more element than the number of vehicles.
+        speed_columns (tuple, optional): Names of the speed columns. Defaults to the mean speeds of the last 1, 3 and 5 minutes.
+
+    Returns:
+        tuple: DataFrame with the virtual datapoints for each bus stop, and the offsets of the virtual datapoints of each vehicle.
+    """
+
+    # Concatenate the stop distances of every direction, with the offsets of each one
+    stop_distances, stop_offsets = concatenate_stop_distances(stops_distances_by_direction)
 
-                # Append the mean and accumulated mean speeds to the virtual datapoint (the same as the current datapoint)
-                for j in range(mean_speeds.shape[1]):
-                    virtual_datapoint.append(mean_speeds[i, j])
+    # Timestamps in nanoseconds
+    gps_timestamps = np.asarray(gps_timestamps).astype('datetime64[ns]').view(np.int64)
 
-                # Append the virtual datapoints to a list
-                virtual_datapoints.append(virtual_datapoint)                
+    arguments = (gps_timestamps, gps_in_route, gps_direction, gps_last_stop_index, gps_next_stop_index, gps_distances, gps_cumulative_distances, gps_cumulative_time, np.asarray(mean_speeds, dtype=np.float64).reshape(len(gps_timestamps), len(speed_columns)), stop_distances, stop_offsets, np.asarray(vehicle_offsets, dtype=np.int64))
 
-    # Set the name of the columns
-    columns = ['timestamp_gps', 'distance_traveled', 'cumulative_distance_traveled', 'time_traveled', 'cumulative_time_traveled', 'direction', 'current_stop_index',  'next_stop_distance']
-    # Add the name of the mean and accumulated mean speeds to the columns
-    for i in range(1, 5+1, 2):
-        columns.append(f'mean_speed_{i}_min')
+    # Count the virtual datapoints, and then fill them into arrays with this size
+    num_virtual_points = generate_virtual_points(*arguments, 0)[0]
+    num_virtual_points, timestamp_errors, distance_errors, virtual_offsets, timestamps, cumulative_distances, times_traveled, cumulative_times, directions, stop_indexes, next_stop_distances, virtual_mean_speeds = generate_virtual_points(*arguments, num_virtual_points)
 
-    # Convert the list into a pandas dataframe
-    virtual_df = pd.DataFrame(virtual_datapoints, columns=columns)
+    if timestamp_errors > 0 or distance_errors > 0:
+        print(f"Skipped virtual datapoints: {timestamp_errors} with timestamp errors and {distance_errors} with distance errors")
 
-    virtual_df['timestamp_gps'] = pd.to_datetime(virtual_df['timestamp_gps'])
+    timestamps = timestamps.view('datetime64[ns]')
 
-    # Split day and hour
-    virtual_df['data'] = virtual_df['timestamp_gps'].dt.date
-    virtual_df['hora'] = virtual_df['timestamp_gps'].dt.time
+    # Split day and hour, as HH:MM:SS
+    seconds_of_day = timestamps.view(np.int64) // 10**9 % 86400
+    two_digits = np.array([f"{value:02d}" for value in range(60)], dtype=object)
 
-    # Time must be shown as HH:MM:SS
-    virtual_df['hora'] = virtual_df['hora'].apply(lambda x: x.strftime('%H:%M:%S'))
+    virtual_df = pd.DataFrame({
+        'timestamp_gps': timestamps,
+        'data': timestamps.astype('datetime64[D]').astype('datetime64[s]'),
+        'hora': two_digits[seconds_of_day // 3600] + ':' + two_digits[seconds_of_day // 60 % 60] + ':' + two_digits[seconds_of_day % 60],
+        'id_veiculo': np.repeat(np.asarray(vehicle_ids, dtype=object), np.diff(virtual_offsets)),
+        'servico': service_id,
+        'direction': directions,
+        'cumulative_distance_traveled': cumulative_distances,
+        'time_traveled': times_traveled,
+        'cumulative_time_traveled': cumulative_times,
+        'current_stop_index': stop_indexes,
+        'next_stop_distance': next_stop_distances,
+    })
+
+    # Add the mean speeds
+    for j, speed_column in enumerate(speed_columns):
+        virtual_df[speed_column] = virtual_mean_speeds[:, j]
+
+    # Return the dataframe that contains the virtual datapoints, and where the datapoints of each vehicle start
+    return virtual_df, virtual_offsets
+
+def virtualize_stop_points(gps_timestamps, gps_in_route, gps_direction, gps_last_stop_index, gps_next_stop_index, gps_distances, gps_cumulative_distances, gps_cumulative_time, mean_speeds, stops_distances_by_direction, vehicle_id, service_id, speed_columns=('mean_speed_1_min', 'mean_speed_3_min', 'mean_speed_5_min')):
+    """
+    Generate virtual datapoints for each bus stop based on the location of each stop, simulating the time when the bus would stop at each one.
+
+    Args:
+        gps_timestamps (np.array): Array of timestamps for each GPS point.
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_direction (np.array): Array of inferred directions for each GPS point (-1 for unknown, 0 for inbound, 1 for outbound).
+        gps_last_stop_index (np.array): Array of indexes of the last stop for each GPS point.
+        gps_next_stop_index (np.array): Array of indexes of the next stop for each GPS point.
+        gps_distances (np.array): Array of distances traveled for each GPS point.
+        gps_cumulative_distances (np.array): Array of cumulative distances traveled for each GPS point.
+        gps_cumulative_time (np.array): Array of cumulative times traveled for each GPS point.
+        mean_speeds (np.array): Array of mean speeds for each GPS point, with one column for each name in speed_columns.
+        stops_distances_by_direction (list): List of distances to each stop for each direction.
+        vehicle_id (str): The vehicle identifier.
+        service_id (str): The service identifier.
+        speed_columns (tuple, optional): Names of the speed columns. Defaults to the mean speeds of the last 1, 3 and 5 minutes.
 
-    # Insert columns again, getting the first value of the original dataframe
-    virtual_df['id_veiculo'] = vehicle_id
-    virtual_df['servico'] = service_id
+    Returns:
+        pd.DataFrame: DataFrame with the virtual datapoints for each bus stop.
+    """
 
-    # Reorder the columns
-    virtual_df = virtual_df[['timestamp_gps', 'data', 'hora', 'id_veiculo', 'servico', 'direction', 'cumulative_distance_traveled', 'time_traveled', 'cumulative_time_traveled', 'current_stop_index', 'next_stop_distance', 'mean_speed_1_min', 'mean_speed_3_min', 'mean_speed_5_min']]
+    # Generate the virtual datapoints as a batch with a single vehicle
+    virtual_df, _ = virtualize_route_stop_points(gps_timestamps, gps_in_route, gps_direction, gps_last_stop_index, gps_next_stop_index, gps_distances, gps_cumulative_distances, gps_cumulative_time, mean_speeds, stops_distances_by_direction, [vehicle_id], service_id, [0, len(gps_timestamps)], speed_columns)
 
     # Return the dataframe that contains the virtual datapoints
     return virtual_df
 
-def process_bus_data(gps, gtfs, vehicle, route, bus_output_path):
+# Features of the GPS points of a bus, as a struct of arrays with one element (or row) per GPS point
+BusFeatures = namedtuple("BusFeatures", ["direction", "direction_directly_infered", "distance_traveled", "cumulative_distance_traveled", "time_traveled", "cumulative_time_traveled", "last_stop_index", "next_stop_index", "last_stop_distance", "next_stop_distance", "mean_speeds", "speed_variances", "stop_fractions"])
+
+@jit(nopython=True)
+def compute_bus_features(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps, stop_distances, stop_offsets, windows, companion_features=False, N=3):
+    """
+    Compute the features of the GPS points of a bus in a single compiled pipeline: direction, distance traveled, stops and speed windows.
+
+    Args:
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_distance_dir_0 (np.array): Array of distances traveled on the inbound route.
+        gps_distance_dir_1 (np.array): Array of distances traveled on the outbound route.
+        gps_timestamps (np.array): Array of timestamps for each GPS point (in seconds).
+        stop_distances (np.array): Distances to each stop of every direction, concatenated (see "concatenate_stop_distances").
+        stop_offsets (np.array): Offsets of the stops of each direction in stop_distances.
+        windows (np.array): Number of last minutes of each window of mean speeds.
+        companion_features (bool, optional): Whether to compute the speed variance and stop fraction of each window. Defaults to False.
+        N (int, optional): Number of last points to consider for direction inference. Defaults to 3.
+
+    Returns:
+        BusFeatures: The features of each GPS point.
+    """
+
+    # Assign the direction and direction inference to each GPS point
+    direction, direction_directly_infered = assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N=N)
+
+    # Assign the distance traveled to each GPS point based on the inferred direction
+    distance_traveled, cumulative_distance_traveled, time_traveled, cumulative_time_traveled = assign_distance_traveled(gps_timestamps, gps_in_route, direction, gps_distance_dir_0, gps_distance_dir_1)
+
+    # Assign stops to the GPS data
+    last_stop_index, next_stop_index, last_stop_distance, next_stop_distance = assign_stops(gps_in_route, direction, distance_traveled, stop_distances, stop_offsets)
+
+    # Assign the mean speeds (and optionally their variances and stop fractions) of every window
+    mean_speeds, speed_variances, stop_fractions = assign_window_speeds(gps_in_route, gps_timestamps, cumulative_distance_traveled, windows, companion_features)
+
+    return BusFeatures(direction, direction_directly_infered, distance_traveled, cumulative_distance_traveled, time_traveled, cumulative_time_traveled, last_stop_index, next_stop_index, last_stop_distance, next_stop_distance, mean_speeds, speed_variances, stop_fractions)
+
+@jit(nopython=True, nogil=True)
+def compute_route_features(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps, stop_distances, stop_offsets, windows, vehicle_offsets, companion_features=False, N=3):
+    """
+    Compute the features of the GPS points of several vehicles of a route in a single compiled call (see "compute_bus_features").
+    The GPS points of each vehicle are stored one after the other, and the features of each vehicle are computed independently.
+
+    Args:
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_distance_dir_0 (np.array): Array of distances traveled on the inbound route.
+        gps_distance_dir_1 (np.array): Array of distances traveled on the outbound route.
+        gps_timestamps (np.array): Array of timestamps for each GPS point (in seconds).
+        stop_distances (np.array): Distances to each stop of every direction, concatenated (see "concatenate_stop_distances").
+        stop_offsets (np.array): Offsets of the stops of each direction in stop_distances.
+        windows (np.array): Number of last minutes of each window of mean speeds.
+        vehicle_offsets (np.array): Offsets of the GPS points of each vehicle, with one more element than the number of vehicles.
+        companion_features (bool, optional): Whether to compute the speed variance and stop fraction of each window. Defaults to False.
+        N (int, optional): Number of last points to consider for direction inference. Defaults to 3.
+
+    Returns:
+        BusFeatures: The features of each GPS point.
+    """
+
+    num_points = len(gps_in_route)
+    num_companion_points = num_points if companion_features else 0
+
+    # Initialize the arrays of the features of every vehicle
+    direction = np.full(num_points, -1)
+    direction_directly_infered = np.full(num_points, False)
+    distance_traveled = np.zeros(num_points)
+    cumulative_distance_traveled = np.zeros(num_points)
+    time_traveled = np.zeros(num_points, dtype=np.int64)
+    cumulative_time_traveled = np.zeros(num_points, dtype=np.int64)
+    last_stop_index = np.full(num_points, -1, dtype=np.int32)
+    next_stop_index = np.full(num_points, -1, dtype=np.int32)
+    last_stop_distance = np.full(num_points, -1, dtype=np.float32)
+    next_stop_distance = np.full(num_points, -1, dtype=np.float32)
+    mean_speeds = np.zeros((num_points, len(windows)), dtype=np.float64)
+    speed_variances = np.zeros((num_companion_points, len(windows)), dtype=np.float64)
+    stop_fractions = np.zeros((num_companion_points, len(windows)), dtype=np.float64)
+
+    # Iterate over the vehicles, so the state of each kernel is reset at the first point of each one
+    for vehicle in range(len(vehicle_offsets) - 1):
+        start, end = vehicle_offsets[vehicle], vehicle_offsets[vehicle + 1]
+
+        features = compute_bus_features(gps_in_route[start:end], gps_distance_dir_0[start:end], gps_distance_dir_1[start:end], gps_timestamps[start:end], stop_distances, stop_offsets, windows, companion_features, N)
+
+        direction[start:end] = features.direction
+        direction_directly_infered[start:end] = features.direction_directly_infered
+        distance_traveled[start:end] = features.distance_traveled
+        cumulative_distance_traveled[start:end] = features.cumulative_distance_traveled
+        time_traveled[start:end] = features.time_traveled
+        cumulative_time_traveled[start:end] = features.cumulative_time_traveled
+        last_stop_index[start:end] = features.last_stop_index
+        next_stop_index[start:end] = features.next_stop_index
+        last_stop_distance[start:end] = features.last_stop_distance
+        next_stop_distance[start:end] = features.next_stop_distance
+        mean_speeds[start:end] = features.mean_speeds
+        if companion_features:
+            speed_variances[start:end] = features.speed_variances
+            stop_fractions[start:end] = features.stop_fractions
+
+    return BusFeatures(direction, direction_directly_infered, distance_traveled, cumulative_distance_traveled, time_traveled, cumulative_time_traveled, last_stop_index, next_stop_index, last_stop_distance, next_stop_distance, mean_speeds, speed_variances, stop_fractions)
+
+def process_bus_data(gps, gtfs, vehicle, route, bus_output_path, parallel=False, incremental=False, speed_windows=(1, 3, 5), companion_features=False, write_bus_files=True, writer=None, plot=True, plotter=None):
     """
     Process the GPS data from a bus, generating the necessary features and saving the results.
-    This is the main pipeline to process the bus data given data from a specific data, route and vehicle.
+    This is the main pipeline to process the bus data given data from a specific data, route and vehicle (see "process_route_data" to process several buses at once).
 
     Args:
         gps (GPSData): The GPS data object containing the bus data.
@@ -692,60 +1794,334 @@ def process_bus_data(gps, gtfs, vehicle, route, bus_output_path):
         vehicle (str): The vehicle identifier.
         route (str): The route identifier.
         bus_output_path (str): The path to save the results.
+        parallel (bool, optional): Whether to use the parallel kernels to project the GPS points on the route. Defaults to False.
+        incremental (bool, optional): Whether to match each GPS point around the segment matched to the previous one. Defaults to False.
+        speed_windows (tuple, optional): Number of last minutes of each window of mean speeds. Defaults to (1, 3, 5).
+        companion_features (bool, optional): Whether to add the speed variance and stop fraction of each window to the mean speeds. Defaults to False.
+        write_bus_files (bool, optional): Whether to save the CSV files of each bus (the data is still kept in "gps.gps_df" and "gps.validation_df"). Defaults to True.
+        writer (BackgroundWriter, optional): Writer used to save the CSV files of each bus in the background. Defaults to None, which saves them before returning.
+        plot (bool, optional): Whether to plot the GPS data of the bus, before and after filtering. Defaults to True.
+        plotter (plotting.PlotRenderer, optional): Renderer of the plots. Defaults to None, which renders them in this process before continuing.
+
+    Returns:
+        None
+    """
+
+    # Process the bus data as a batch with a single vehicle
+    gps.vehicle_offsets = np.array([0, len(gps.gps_df)], dtype=np.int64)
+    process_route_data(gps, gtfs, [vehicle], route, [bus_output_path], parallel=parallel, incremental=incremental, speed_windows=speed_windows, companion_features=companion_features, write_bus_files=write_bus_files, writer=writer, plot_buses=[plot], plotter=plotter)
+
+def process_route_data(gps, gtfs, vehicles, route, bus_output_paths, parallel=False, incremental=False, speed_windows=(1, 3, 5), companion_features=False, write_bus_files=True, writer=None, plot_buses=None, plotter=None):
+    """
+    Process the GPS data from several buses of a route at once, generating the necessary features and saving the results of each bus.
+    The GPS data of the buses must be stored one after the other, with the offsets of each bus in "gps.vehicle_offsets" (see "GPSHandler.get_buses_data").
+
+    Args:
+        gps (GPSData): The GPS data object containing the data of the buses.
+        gtfs (GTFSData): The GTFS data object containing the route data.
+        vehicles (list): The identifier of each vehicle.
+        route (str): The route identifier.
+        bus_output_paths (list): The path to save the results of each vehicle.
+        parallel (bool, optional): Whether to use the parallel kernels to project the GPS points on the route. Defaults to False.
+        incremental (bool, optional): Whether to match each GPS point around the segment matched to the previous one. Defaults to False.
+        speed_windows (tuple, optional): Number of last minutes of each window of mean speeds. Defaults to (1, 3, 5).
+        companion_features (bool, optional): Whether to add the speed variance and stop fraction of each window to the mean speeds. Defaults to False.
+        write_bus_files (bool, optional): Whether to save the CSV files of each bus (the data is still kept in "gps.gps_df" and "gps.validation_df"). Defaults to True.
+        writer (BackgroundWriter, optional): Writer used to save the CSV files of each bus in the background. Defaults to None, which saves them before returning.
+        plot_buses (list, optional): Whether to plot the GPS data of each vehicle, before and after filtering. Defaults to None, which plots all of them.
+        plotter (plotting.PlotRenderer, optional): Renderer of the plots. Defaults to None, which renders them in this process before continuing.
 
     Returns:
         None
     """
 
+    vehicle_offsets = gps.vehicle_offsets
+
+    # Render the plots with the renderer, if given
+    render_plot = plotter.submit if plotter is not None else plotting.render_plot
+    if plot_buses is None:
+        plot_buses = [True] * len(vehicles)
+
     # Plot bus data
-    gps.plot_gps_data(title=f"GPS data from bus {vehicle} (route {route})", save_path=bus_output_path + "gps_data.png")
+    for k, vehicle in enumerate(vehicles):
+        if plot_buses[k]:
+            render_plot(gps.get_gps_plot_job(gps.gps_df.iloc[vehicle_offsets[k]:vehicle_offsets[k + 1]], title=f"GPS data from bus {vehicle} (route {route})", save_path=bus_output_paths[k] + "gps_data.png"))
     
-    # Filter gps coordinates
-    gps.filter_gps_coordinates(gtfs)
+    # Filter gps coordinates and assign the distances from the route start
+    gps.project_on_route(gtfs, parallel=parallel, incremental=incremental, vehicle_offsets=vehicle_offsets)
 
     # Plot fitered bus data
-    gps.plot_gps_data(gps.gps_df[gps.gps_df["in_route"] == True], gtfs.route_shape_segments, title=f"Filtered GPS data from bus {vehicle} (route {route})", save_path=bus_output_path + "filtered_gps_data.png")
-
-    # Assign the distances from the route start
-    gps.get_distance_from_start(gtfs)
+    for k, vehicle in enumerate(vehicles):
+        if plot_buses[k]:
+            bus_df = gps.gps_df.iloc[vehicle_offsets[k]:vehicle_offsets[k + 1]]
+            render_plot(gps.get_gps_plot_job(bus_df[bus_df["in_route"] == True], gtfs.route_shape_segments, title=f"Filtered GPS data from bus {vehicle} (route {route})", save_path=bus_output_paths[k] + "filtered_gps_data.png"))
 
     # TODO: Plot the histogram with the distances from the start
 
-    # Assign the direction and direction inference to each GPS point
-    gps.gps_df['direction'], gps.gps_df['direction_directly_infered'] = assign_direction(gps.gps_df['in_route'].to_numpy(), gps.gps_df['distance_from_start_0'].to_numpy(), gps.gps_df['distance_from_start_1'].to_numpy(), N=3)
+    # Get the timestamps in seconds (they are parsed when the GPS data is loaded, so this doesn't parse them again)
+    timestamps = pd.to_datetime(gps.gps_df['timestamp_gps']).to_numpy()
+    timestamps_seconds = timestamps.astype('datetime64[s]').view(np.int64)
 
-    # TODO: Plot the distances/directions infered
+    # Get stops by direction
+    gtfs.get_stops_by_direction()
+    stop_distances, stop_offsets = concatenate_stop_distances(gtfs.stops_distances_by_direction)
+
+    # Compute the direction, distance traveled, stops and speed windows of each GPS point of every bus in a single call
+    in_route = gps.gps_df['in_route'].to_numpy()
+    features = compute_route_features(in_route, gps.gps_df['distance_from_start_0'].to_numpy(), gps.gps_df['distance_from_start_1'].to_numpy(), timestamps_seconds, stop_distances, stop_offsets, np.asarray(speed_windows), vehicle_offsets, companion_features)
+
+    # TODO: Plot the distances/directions infered, and the histograms of the distances traveled, stop distances and mean speeds
+
+    # Name the speed columns (mean speeds of every window, and then the variance and stop fraction of each one)
+    speed_columns = [f'mean_speed_{N}_min' for N in speed_windows]
+    speeds = [features.mean_speeds[:, k] for k in range(len(speed_windows))]
+
+    if companion_features:
+        for k, N in enumerate(speed_windows):
+            speed_columns.extend([f'speed_variance_{N}_min', f'stop_fraction_{N}_min'])
+            speeds.extend([features.speed_variances[:, k], features.stop_fractions[:, k]])
+
+    # Add the features to the dataframe only at the end of the pipeline
+    gps.gps_df['timestamp_gps'] = timestamps
+    feature_columns = {'direction': features.direction,
+                       'direction_directly_infered': features.direction_directly_infered,
+                       'timestamp_gps_seconds': timestamps_seconds,
+                       'distance_traveled': features.distance_traveled,
+                       'cumulative_distance_traveled': features.cumulative_distance_traveled,
+                       'time_traveled': features.time_traveled,
+                       'cumulative_time_traveled': features.cumulative_time_traveled,
+                       'last_stop_index': features.last_stop_index,
+                       'next_stop_index': features.next_stop_index,
+                       'last_stop_distance': features.last_stop_distance,
+                       'next_stop_distance': features.next_stop_distance,
+                       **dict(zip(speed_columns, speeds))}
+
+    for column, values in feature_columns.items():
+        gps.gps_df[column] = values
 
-    # Convert the 'timestamp_gps' to datetime
-    gps.gps_df['timestamp_gps'] = pd.to_datetime(gps.gps_df['timestamp_gps'])
-    # Create a new column based on the timestamp
-    gps.gps_df['timestamp_gps_seconds'] = gps.gps_df['timestamp_gps'].astype(np.int64) // 10**9
+    # Generate the validation dataset with virtual/interpolated datapoints
+    gps.validation_df, gps.validation_offsets = virtualize_route_stop_points(timestamps, in_route, features.direction, features.last_stop_index, features.next_stop_index, features.distance_traveled, features.cumulative_distance_traveled, features.cumulative_time_traveled, np.column_stack(speeds) if speeds else np.empty((len(in_route), 0)), gtfs.stops_distances_by_direction, vehicles, route, vehicle_offsets, speed_columns)
 
-    # Assign the distance traveled to each GPS point based on the inferred direction
-    gps.gps_df['distance_traveled'], gps.gps_df['cumulative_distance_traveled'], gps.gps_df['time_traveled'], gps.gps_df['cumulative_time_traveled']  = assign_distance_traveled(gps.gps_df['timestamp_gps_seconds'].to_numpy(), gps.gps_df['in_route'].to_numpy(), gps.gps_df['direction'].to_numpy(), gps.gps_df['distance_from_start_0'].to_numpy(), gps.gps_df['distance_from_start_1'].to_numpy())
+    # Save the results of each bus (in the background, if a writer is given)
+    write = writer.submit if writer is not None else lambda function, *args, **kwargs: function(*args, **kwargs)
+    for k, vehicle in enumerate(vehicles):
+        bus_df = gps.gps_df.iloc[vehicle_offsets[k]:vehicle_offsets[k + 1]]
+        bus_validation_df = gps.validation_df.iloc[gps.validation_offsets[k]:gps.validation_offsets[k + 1]]
 
-    # TODO: Plot a histogram of distance traveled and cumulative distance traveled
+        print(f"PROCESSED: {vehicle} {route} -> {len(bus_df)} / {len(bus_validation_df)}")
 
-    # Get stops by direction
-    gtfs.get_stops_by_direction()
+        if not write_bus_files:
+            continue
 
-    # Assign stops to the GPS data
-    gps.gps_df['last_stop_index'], gps.gps_df['next_stop_index'], gps.gps_df['last_stop_distance'], gps.gps_df['next_stop_distance'] = assign_stops(gps.gps_df['in_route'].to_numpy(), gps.gps_df['direction'].to_numpy(), gps.gps_df['distance_traveled'].to_numpy(), gtfs.stops_distances_by_direction)
+        write(bus_df.to_csv, bus_output_paths[k] + "raw_processed_gps_data.csv", index=False)
+        write(bus_df[bus_df['in_route'] == True].to_csv, bus_output_paths[k] + "processed_gps_data.csv", index=False)
+        write(bus_validation_df.to_csv, bus_output_paths[k] + "validation_data.csv", index=False)
+
+def hash_files(file_paths, extra="", chunk_size=1 << 20):
+    """
+    Hash the names and contents of a list of files, reading them in chunks.
+
+    Args:
+        file_paths (list): List of paths to the files to be hashed.
+        extra (str, optional): Additional text to be included in the hash (e.g., parameters used to read the files). Defaults to "".
+        chunk_size (int, optional): Number of bytes read at a time. Defaults to 1 MiB.
 
-    # TODO: Plot a histogram of the last_stop_distance and next_stop_distance
+    Returns:
+        str: The hexadecimal SHA-256 digest of the files.
+    """
 
-    gps.gps_df['mean_speed_1_min'] = assign_mean_speed(gps.gps_df['in_route'].to_numpy(), gps.gps_df['timestamp_gps_seconds'].to_numpy(), gps.gps_df['cumulative_distance_traveled'].to_numpy(), N=1)
-    gps.gps_df['mean_speed_3_min'] = assign_mean_speed(gps.gps_df['in_route'].to_numpy(), gps.gps_df['timestamp_gps_seconds'].to_numpy(), gps.gps_df['cumulative_distance_traveled'].to_numpy(), N=3)
-    gps.gps_df['mean_speed_5_min'] = assign_mean_speed(gps.gps_df['in_route'].to_numpy(), gps.gps_df['timestamp_gps_seconds'].to_numpy(), gps.gps_df['cumulative_distance_traveled'].to_numpy(), N=5)
+    file_hash = hashlib.sha256(extra.encode())
 
-    # TODO: Plot a histogram of the mean speeds
+    for file_path in file_paths:
+        # Include the file name, so renaming a file also changes the hash
+        file_hash.update(os.path.basename(file_path).encode())
 
-    # Generate the validation dataset with virtual/interpolated datapoints
-    gps.validation_df = virtualize_stop_points(gps.gps_df['timestamp_gps'].to_numpy(), gps.gps_df['in_route'].to_numpy(), gps.gps_df['direction'].to_numpy(), gps.gps_df['last_stop_index'].to_numpy(), gps.gps_df['next_stop_index'].to_numpy(), gps.gps_df['distance_traveled'].to_numpy(), gps.gps_df['cumulative_distance_traveled'].to_numpy(), gps.gps_df['cumulative_time_traveled'].to_numpy(), gps.gps_df[['mean_speed_1_min', 'mean_speed_3_min', 'mean_speed_5_min']].to_numpy(), gtfs.stops_distances_by_direction, vehicle, route)
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                file_hash.update(chunk)
 
-    print(f"PROCESSED: {vehicle} {route} -> {len(gps.gps_df)} / {len(gps.validation_df)}")
+    return file_hash.hexdigest()
+
+def get_partition_path(dataset_path, partition_values):
+    """
+    Get the folder of a partition of a Parquet dataset, with a "column=value" folder for each partition column.
+
+    Args:
+        dataset_path (str): Path to the dataset folder.
+        partition_values (dict): Value of each partition column, in the order of the folders.
+
+    Returns:
+        str: Path to the partition folder.
+    """
+
+    return dataset_path + "".join(f"/{column}={value}" for column, value in partition_values.items())
+
+def write_parquet_partition(dfs, dataset_path, partition_values, compression="zstd"):
+    """
+    Write dataframes to a Parquet dataset partitioned by the given columns (as "column=value" folders), as a single file with a single row group.
+    The partition columns are not stored in the file, as their value is in its path. Requires the "pyarrow" package.
+
+    Args:
+        dfs (list): List of dataframes with the rows to write, in order.
+        dataset_path (str): Path to the dataset folder.
+        partition_values (dict): Value of each partition column, in the order of the folders.
+        compression (str, optional): Parquet compression codec. Defaults to "zstd".
+
+    Returns:
+        str: Path to the file written, or None if there were no rows.
+    """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Writing Parquet files requires the 'pyarrow' package (pip install -r requirements.txt).") from e
+
+    dfs = [df for df in dfs if len(df) > 0]
+    if not dfs:
+        return None
+
+    # Get the rows of all the dataframes, without the partition columns
+    df = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+    table = pa.Table.from_pandas(df.drop(columns=list(partition_values), errors="ignore"), preserve_index=False)
+
+    # Get the folder of the partition, and a file name not used yet (in case the partition is written again)
+    partition_path = get_partition_path(dataset_path, partition_values)
+    os.makedirs(partition_path, exist_ok=True)
+    file_path = f"{partition_path}/part-{len([name for name in os.listdir(partition_path) if name.endswith('.parquet')])}.parquet"
+
+    # Write to a temporary file, renamed at the end, so readers never see a partial file
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    pq.write_table(table, temporary_path, compression=compression, row_group_size=max(table.num_rows, 1))
+    os.rename(temporary_path, file_path)
+
+    return file_path
+
+def append_csv(df, file_path):
+    """
+    Append a dataframe to a CSV file, writing the header only if the file doesn't exist yet.
+
+    Args:
+        df (pd.DataFrame): Dataframe to append.
+        file_path (str): Path to the CSV file.
+    """
+
+    df.to_csv(file_path, mode='a', index=False, header=not os.path.exists(file_path))
+
+class BackgroundWriter:
+    """
+    Writes the output files in a background thread, while the caller processes the next data.
+    The writes are run one at a time, in the order they are submitted, so the files written are the same as writing them synchronously.
+    The queue of pending writes is bounded: submitting a write when it is full waits for the oldest one to finish.
+    The dataframes (or arrays) given to a write must not be modified after it is submitted.
+    """
 
-    # Save the results
-    gps.gps_df.to_csv(bus_output_path + "raw_processed_gps_data.csv", index=False)
-    gps.gps_df[gps.gps_df['in_route'] == True].to_csv(bus_output_path + "processed_gps_data.csv", index=False)
-    gps.validation_df.to_csv(bus_output_path + "validation_data.csv", index=False)
+    def __init__(self, max_pending=8):
+        """
+        Initialize the writer, starting its thread.
+
+        Args:
+            max_pending (int, optional): Maximum number of writes waiting in the queue. 0 runs each write synchronously, when it is submitted. Defaults to 8.
+        """
+
+        self.max_pending = max_pending
+
+        # Total number of writes, time spent writing and time the caller waited for the writes (on a full queue, or at the end)
+        self.num_writes = 0
+        self.write_time = 0.0
+        self.wait_time = 0.0
+
+        # First error raised by a write (the following writes are skipped, and the error is raised to the caller)
+        self.error = None
+
+        self.queue = None
+        self.thread = None
+        if max_pending > 0:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self._run, name="BackgroundWriter", daemon=True)
+            self.thread.start()
+
+    def _write(self, function, args, kwargs):
+        # Run a write, adding its time to the total
+        start_time = time.perf_counter()
+        try:
+            function(*args, **kwargs)
+        finally:
+            self.write_time += time.perf_counter() - start_time
+            self.num_writes += 1
+
+    def _run(self):
+        # Run the writes of the queue until the end marker (None) is received
+        while True:
+            write = self.queue.get()
+            try:
+                if write is None:
+                    return
+                if self.error is None:
+                    self._write(*write)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        # Raise the error of a previous write in the caller
+        if self.error is not None:
+            raise RuntimeError(f"Error writing the output in the background: {self.error}") from self.error
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Submit a write, waiting if the queue is full.
+
+        Args:
+            function (callable): Function that writes the data (e.g. "df.to_csv" or "append_csv").
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+        """
+
+        self._raise_error()
+
+        # Write in this thread when there's no queue
+        if self.queue is None:
+            start_time = time.perf_counter()
+            self._write(function, args, kwargs)
+            self.wait_time += time.perf_counter() - start_time
+            return
+
+        start_time = time.perf_counter()
+        self.queue.put((function, args, kwargs))
+        self.wait_time += time.perf_counter() - start_time
+
+    def flush(self):
+        """
+        Wait for all the writes submitted to finish, raising the error of any of them.
+        """
+
+        if self.queue is not None:
+            start_time = time.perf_counter()
+            self.queue.join()
+            self.wait_time += time.perf_counter() - start_time
+
+        self._raise_error()
+
+    def close(self):
+        """
+        Flush the pending writes and stop the thread.
+        """
+
+        try:
+            self.flush()
+        finally:
+            if self.thread is not None and self.thread.is_alive():
+                self.queue.put(None)
+                self.thread.join()
+
+    def get_timings(self):
+        """
+        Get the timings of the writes: the time spent writing, the time the caller waited for them, and the difference, hidden behind the processing.
+
+        Returns:
+            dict: Number of writes ("writes"), and time in seconds spent writing ("write_time"), waiting ("wait_time") and hidden ("hidden_time").
+        """
+
+        return {"writes": self.num_writes, "write_time": self.write_time, "wait_time": self.wait_time, "hidden_time": max(self.write_time - self.wait_time, 0.0)}
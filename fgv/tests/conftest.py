@@ -0,0 +1,71 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the pipeline are imported as "src.<module>", from the fgv folder
+FGV_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FGV_FOLDER)
+
+# Launch at least 4 threads for the parallel kernels (numba reads it on import), so they are tested with several threads even on machines with fewer cores
+os.environ.setdefault("NUMBA_NUM_THREADS", str(max(os.cpu_count() or 1, 4)))
+
+import src.utils as utils
+
+# Folder with the GTFS data used by the tests on real shapes (the shapes file is not versioned, so it can be set with the FGV_GTFS_FOLDER variable)
+GTFS_FOLDER = os.environ.get("FGV_GTFS_FOLDER", os.path.join(FGV_FOLDER, "data", "gtfs_data"))
+
+def load_shapes(gtfs_folder=GTFS_FOLDER):
+    """
+    Load the shapes of the GTFS data, ordered by shape and point sequence.
+
+    Args:
+        gtfs_folder (str, optional): Path to the folder containing the GTFS data files. Defaults to GTFS_FOLDER.
+
+    Returns:
+        pandas.DataFrame: Dataframe with the shape points, with the points in the local metric frame in the "x" and "y" columns.
+    """
+
+    shapes = pd.read_csv(f"{gtfs_folder}/shapes.txt", dtype={"shape_id": "category"})
+    shapes = shapes.sort_values(["shape_id", "shape_pt_sequence"], kind="stable").reset_index(drop=True)
+
+    shapes[["x", "y"]] = utils.project_to_local_meters(shapes["shape_pt_lon"], shapes["shape_pt_lat"])
+
+    return shapes
+
+@pytest.fixture(scope="session")
+def gtfs_shapes():
+    """
+    Shapes of the GTFS data, skipping the test if the shapes file is not available.
+    """
+
+    if not os.path.exists(f"{GTFS_FOLDER}/shapes.txt"):
+        pytest.skip(f"GTFS shapes not found in {GTFS_FOLDER} (set FGV_GTFS_FOLDER)")
+
+    return load_shapes()
+
+def random_route_segments(rng, num_segments, step=50.0):
+    """
+    Build the segments of a random walk, as a route in the local metric frame.
+
+    Args:
+        rng (np.random.Generator): Random number generator.
+        num_segments (int): Number of segments.
+        step (float, optional): Mean length of the segments in meters. Defaults to 50.0.
+
+    Returns:
+        tuple: Array of route segments with shape (M, 2, 2) and array with the distance traveled at the start and at the end of each segment with shape (M, 2), as np.float32.
+    """
+
+    # Walk with a smooth heading, so the route wanders and passes near itself
+    headings = np.cumsum(rng.normal(0.0, 0.5, num_segments))
+    steps = rng.exponential(step, num_segments)
+    points = np.zeros((num_segments + 1, 2))
+    points[1:, 0] = np.cumsum(steps * np.cos(headings))
+    points[1:, 1] = np.cumsum(steps * np.sin(headings))
+
+    distances = np.concatenate(([0.0], np.cumsum(steps)))
+
+    return utils.build_shape_segments(points.astype(np.float32), distances.astype(np.float32), np.zeros(num_segments + 1, dtype=np.int64))
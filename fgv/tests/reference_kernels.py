@@ -0,0 +1,310 @@
+import numpy as np
+import pandas as pd
+
+from numba import jit
+
+import src.utils as utils
+
+# Previous implementations of the optimized kernels of "src.utils", kept unchanged as the reference their results must be identical to
+
+@jit(nopython=True)
+def infer_bus_direction(distance_traveled_inbound, distance_traveled_outbound, tolerance=100):
+    """
+    Infers the bus direction based on the distance traveled for inbound and outbound routes.
+
+    Args:
+        distance_traveled_inbound (np.array): The distance traveled on the inbound route during last records.
+        distance_traveled_outbound (np.array): The distance traveled on the outbound route during last records.
+        tolerance (int, optional): The minimum distance difference to infer the direction. Defaults to 100.
+
+    Returns:
+        int: The inferred bus direction (0 for inbound, 1 for outbound, -1 for unknown).
+    """
+
+    # Evaluate the mean of the distances traveled among the last records in each direction
+    mean_dist_traveled_inbound = np.mean(distance_traveled_inbound) - distance_traveled_inbound[0]
+    mean_dist_traveled_outbound = np.mean(distance_traveled_outbound) - distance_traveled_outbound[0]
+
+    # Get the difference between the mean of the distances
+    diff_mean_distance_traveled = mean_dist_traveled_inbound - mean_dist_traveled_outbound
+
+    # If a significant difference is found, return the direction with the highest mean distance traveled
+    if abs(diff_mean_distance_traveled) > tolerance:
+        return 0 if diff_mean_distance_traveled > 0 else 1
+    # Otherwise, if the difference is not significant, return -1 for unknown direction
+    else:
+        return -1
+
+@jit(nopython=True)
+def assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N=5, terminal_tolerance=500):
+    """
+    Assigns the direction to a GPS point based on the distance from the start of the route.
+    Reference for "utils.assign_direction": the mean of the last N distances is evaluated for every point, and the unknown directions are filled backwards from each inferred one.
+
+    Args:
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_distance_dir_0 (np.array): Array of distances traveled on the inbound route.
+        gps_distance_dir_1 (np.array): Array of distances traveled on the outbound route.
+        N (int, optional): Number of last points to consider for direction inference. Defaults to 5.
+        terminal_tolerance (int, optional): Maximum distance from the terminal to allow direction changes. Defaults to 500.
+
+    Returns:
+        tuple: Arrays of inferred directions and the method used to infer them (directly (using the last N points) or indirectly (using the next direction inference)).
+    """
+
+    # Initialize the result array with -1 for unknown direction
+    result = np.full(len(gps_in_route), -1)
+    directly_infered = np.full(len(gps_in_route), False)
+
+    # Iterate over the GPS points, starting from the N-th point
+    for i in range(N, len(gps_in_route)):
+        # If the GPS point is not in the route, skip
+        if gps_in_route[i] == False:
+            continue
+
+        # If the GPS point is too far from a terminal, don't allow direction changes
+        if i > 1 and result[i-1] != -1 and (gps_distance_dir_0[i] > terminal_tolerance and gps_distance_dir_1[i] > terminal_tolerance):
+            result[i] = result[i-1]
+            continue
+
+        # Get the last N elements of each direction
+        result[i] = infer_bus_direction(gps_distance_dir_0[i-N:i], gps_distance_dir_1[i-N:i])
+        if result[i] != -1:
+            directly_infered[i] = True
+
+        # If the last datapoints are in route and the directions are still unknown, assign the direction infered
+        for j in range(i, 0, -1):
+            if result[j] != -1 and result[j-1] == -1 and gps_in_route[j-1] == True:
+                result[j-1] = result[j]
+            else:
+                break
+
+    # Return the array with the infered directions and the method used to infer them
+    return result, directly_infered
+
+@jit(nopython=True)
+def assign_stops(gps_in_route, gps_direction, gps_distance, stops_distances_by_direction):
+    """
+    Assigns the stops to the GPS data based on the direction and distance from the start of the route.
+    Reference for "utils.assign_stops": the distances to the stops are given as a list with an array for each direction.
+
+    Args:
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_direction (np.array): Array of inferred directions for each GPS point (-1 for unknown, 0 for inbound, 1 for outbound).
+        gps_distance (np.array): Array of distances traveled for each GPS point.
+        stops_distances_by_direction (dict): Dictionary of distances to each stop for each direction.
+    
+    Returns:
+        tuple: Arrays of indexes of the last and next stops, and distances to the last and next stops.
+    """
+
+    # By default, the first direction is the first one in the list
+    stop_distances = stops_distances_by_direction[gps_direction[0]]
+
+    # Initialize the lists of last and next stops with -1, by default
+    last_stops = np.full(len(gps_in_route), -1, dtype=np.int32)
+    next_stops = np.full(len(gps_in_route), -1, dtype=np.int32)
+    distance_to_last_stop = np.full(len(gps_in_route), -1, dtype=np.float32)
+    distance_to_next_stop = np.full(len(gps_in_route), -1, dtype=np.float32)
+
+    # Iterate over the GPS data
+    for i in range(len(gps_in_route)):
+        # Skip the points that are not in the route
+        if gps_in_route[i] == False:
+            continue
+
+        # Update the list of stops by direction if it has changed
+        if i > 0 and gps_direction[i] != gps_direction[i-1]:
+            stop_distances = stops_distances_by_direction[gps_direction[i]]
+
+        # Assign the indexes of the last and next stops
+        next_stops[i] = utils.get_next_stop(gps_distance[i], stop_distances)
+        # last_stops[i] = utils.get_last_stop(gps_distance[i], stop_distances)
+        last_stops[i] = max(0, next_stops[i] - 1) # To avoid unnecessary calculations
+
+        # Assign the distances to the last and next stops
+        distance_to_next_stop[i] = max(stop_distances[next_stops[i]] - gps_distance[i], 0)
+        distance_to_last_stop[i] = max(abs(stop_distances[last_stops[i]] - gps_distance[i]), 0)
+
+    # Return the lists of last and next stops
+    return last_stops, next_stops, distance_to_last_stop, distance_to_next_stop
+
+@jit(nopython=True)
+def map_distance_into_timestamp(current_distance, initial_distance, final_distance, initial_timestamp, final_timestamp):
+    """
+    Map a distance into a timestamp using a linear interpolation
+    
+    Args:
+        current_distance (float): The distance to be mapped
+        initial_distance (float): The initial distance
+        final_distance (float): The final distance
+        initial_timestamp (int): The initial timestamp
+        final_timestamp (int): The final timestamp
+
+    Returns:
+        float: The mapped timestamp
+    """
+    return (current_distance - initial_distance) * (final_timestamp - initial_timestamp) / (final_distance - initial_distance) + initial_timestamp
+
+def generate_virtual_point(initial_distance, final_distance, initial_cumulative_distance, initial_timestamp, initial_cumulative_time, final_timestamp, stop_num, stop_distances, direction):
+    """
+    Generate a virtual datapoint for a bus stop based on the location of the next stop, simulating the time when the bus would stop at that location.
+
+    Args:
+        initial_distance (float): The distance of the initial GPS datapoint.
+        final_distance (float): The distance of the final GPS datapoint.
+        initial_cumulative_distance (float): The cumulative distance of the initial GPS datapoint.
+        initial_timestamp (int): The timestamp of the initial GPS datapoint.
+        initial_cumulative_time (int): The cumulative time of the initial GPS datapoint.
+        final_timestamp (int): The timestamp of the final GPS datapoint.
+        stop_num (int): The index of the stop to generate the virtual datapoint.
+        stop_distances (np.array): The distances of each stop.
+        direction (int): The direction of the bus.
+
+    Returns:
+        list: The virtual datapoint with the timestamp, distance traveled, cumulative distance traveled, time traveled, cumulative time traveled, direction, current stop index, and next stop distance.
+    """
+
+    # Get the timestamp and distance of the virtual datapoint
+    virtual_timestamp = map_distance_into_timestamp(stop_distances[stop_num], initial_distance, final_distance, initial_timestamp, final_timestamp)
+    virtual_distance = stop_distances[stop_num]
+
+    try:
+        # Assert if both values are valid
+        # It seems obvious that the virtual timestamp should be between the initial and final timestamps
+        # But, in a case of wrong direction inference, the virtual distance probably will be out of bounds
+        # This is a way to avoid this kind of error, as the main can catch this error and skip the virtual datapoint or the entire bus data
+        assert virtual_timestamp >= initial_timestamp and virtual_timestamp <= final_timestamp, f"TIMESTAMP ERROR: {virtual_timestamp} {initial_timestamp} {final_timestamp}"
+        assert virtual_distance >= initial_distance and virtual_distance <= final_distance, f"DISTANCE ERROR: {virtual_distance} {initial_distance} {final_distance}"
+
+        next_stop_index = min(stop_num + 1, len(stop_distances) - 1)
+        
+        # Evaluate the time diff as an integer
+        time_diff = pd.Timedelta(virtual_timestamp - initial_timestamp).seconds
+
+        # Append the virtual datapoints to alist
+        return [virtual_timestamp, # timestamp
+                virtual_distance, # distance_traveled
+                initial_cumulative_distance + (virtual_distance - initial_distance), # cumulative_distance_traveled
+                time_diff, # time_traveled
+                initial_cumulative_time + time_diff, # cumulative_time_traveled
+                direction, # direction
+                stop_num, # current_stop_index
+                stop_distances[next_stop_index] - stop_distances[stop_num]] # next_stop_distance
+    
+    except AssertionError as e:
+        print(e)
+        return None
+
+def virtualize_stop_points(gps_timestamps, gps_in_route, gps_direction, gps_last_stop_index, gps_next_stop_index, gps_distances, gps_cumulative_distances, gps_cumulative_time, mean_speeds, stops_distances_by_direction, vehicle_id, service_id, speed_columns=('mean_speed_1_min', 'mean_speed_3_min', 'mean_speed_5_min')):
+    """
+    Generate virtual datapoints for each bus stop based on the location of each stop, simulating the time when the bus would stop at each one.
+    Reference for "utils.generate_virtual_points": the datapoints are generated one by one in Python, with the timestamps as np.datetime64, and collected into a dataframe.
+
+    Args:
+        gps_timestamps (np.array): Array of timestamps for each GPS point.
+        gps_in_route (np.array): Array of boolean values indicating if the GPS point is in the route.
+        gps_direction (np.array): Array of inferred directions for each GPS point (-1 for unknown, 0 for inbound, 1 for outbound).
+        gps_last_stop_index (np.array): Array of indexes of the last stop for each GPS point.
+        gps_next_stop_index (np.array): Array of indexes of the next stop for each GPS point.
+        gps_distances (np.array): Array of distances traveled for each GPS point.
+        gps_cumulative_distances (np.array): Array of cumulative distances traveled for each GPS point.
+        gps_cumulative_time (np.array): Array of cumulative times traveled for each GPS point.
+        mean_speeds (np.array): Array of mean speeds for each GPS point, with one column for each name in speed_columns.
+        stops_distances_by_direction (dict): Dictionary of distances to each stop for each direction.
+        vehicle_id (str): The vehicle identifier.
+        service_id (str): The service identifier.
+        speed_columns (tuple, optional): Names of the speed columns. Defaults to the mean speeds of the last 1, 3 and 5 minutes.
+
+    Returns:
+        pd.DataFrame: DataFrame with the virtual datapoints for each bus stop.
+    """
+
+    # By default, the first direction is the first one in the list
+    current_direction = gps_direction[0]
+    stop_distances = stops_distances_by_direction[current_direction]
+    
+    # Initialize the list of virtual datapoints
+    virtual_datapoints = list()
+
+    # Iterate over the gps data
+    for i in range(1, len(gps_timestamps)):
+
+        # Ensure that the last and current datapoint are in the route
+        if gps_in_route[i-1] == False or gps_in_route[i] == False:
+            continue
+
+        # If the direction changes
+        if gps_direction[i] != current_direction:
+
+            # TODO: Generate a virtual datapoint to represent the final station (predict the time where the bus will stop at distance=MAX, i.e., the end of the route)
+
+            current_direction = gps_direction[i] # Update the current direction
+            stop_distances = stops_distances_by_direction[current_direction] # Update the stop distances
+
+            # TODO: Generate a virtual datapoint for the initial station (predict the time where the bus started the movement at distance=0)
+
+            continue # To ensure that we have 2 consecutive datapoints with the same direction
+
+        # Check if the bus went through a bus stop between the last and current datapoints
+        if gps_last_stop_index[i-1] != gps_last_stop_index[i] or gps_next_stop_index[i-1] != gps_next_stop_index[i]:
+
+            # Get the indexes of the stops to be generated
+            initial_stop_index = gps_next_stop_index[i-1]
+            final_stop_index = gps_last_stop_index[i]
+
+            if initial_stop_index >= len(stop_distances) or final_stop_index >= len(stop_distances):
+                # print(f"ERROR: Stop index out of bounds: {initial_stop_index} {final_stop_index}")
+                continue
+
+            # Get the distances of the last and current datapoint, to be used in the interpolation
+            initial_distance = gps_distances[i-1]
+            final_distance = gps_distances[i]
+
+            initial_timestamp = gps_timestamps[i-1]
+            final_timestamp = gps_timestamps[i]
+
+            initial_cumulative_distance = gps_cumulative_distances[i-1]
+
+            # Iteratate over the stops to be generated
+            for stop_num in range(initial_stop_index, final_stop_index + 1):
+                # Generate a virtual datapoint for each stop
+                virtual_datapoint = generate_virtual_point(initial_distance, final_distance, initial_cumulative_distance, initial_timestamp, gps_cumulative_time[i-1], final_timestamp, stop_num, stop_distances, gps_direction[i])
+
+                # Check if the virtual datapoint is valid
+                if virtual_datapoint is None:
+                    continue
+
+                # Append the mean and accumulated mean speeds to the virtual datapoint (the same as the current datapoint)
+                for j in range(mean_speeds.shape[1]):
+                    virtual_datapoint.append(mean_speeds[i, j])
+
+                # Append the virtual datapoints to a list
+                virtual_datapoints.append(virtual_datapoint)                
+
+    # Set the name of the columns
+    columns = ['timestamp_gps', 'distance_traveled', 'cumulative_distance_traveled', 'time_traveled', 'cumulative_time_traveled', 'direction', 'current_stop_index',  'next_stop_distance']
+    # Add the name of the mean and accumulated mean speeds to the columns
+    columns.extend(speed_columns)
+
+    # Convert the list into a pandas dataframe
+    virtual_df = pd.DataFrame(virtual_datapoints, columns=columns)
+
+    virtual_df['timestamp_gps'] = pd.to_datetime(virtual_df['timestamp_gps'])
+
+    # Split day and hour
+    virtual_df['data'] = virtual_df['timestamp_gps'].dt.date
+    virtual_df['hora'] = virtual_df['timestamp_gps'].dt.time
+
+    # Time must be shown as HH:MM:SS
+    virtual_df['hora'] = virtual_df['hora'].apply(lambda x: x.strftime('%H:%M:%S'))
+
+    # Insert columns again, getting the first value of the original dataframe
+    virtual_df['id_veiculo'] = vehicle_id
+    virtual_df['servico'] = service_id
+
+    # Reorder the columns
+    virtual_df = virtual_df[['timestamp_gps', 'data', 'hora', 'id_veiculo', 'servico', 'direction', 'cumulative_distance_traveled', 'time_traveled', 'cumulative_time_traveled', 'current_stop_index', 'next_stop_distance'] + list(speed_columns)]
+
+    # Return the dataframe that contains the virtual datapoints
+    return virtual_df
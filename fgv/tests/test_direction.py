@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import reference_kernels
+import src.utils as utils
+
+def assert_same_directions(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N, terminal_tolerance=500):
+    """
+    Check that "utils.assign_direction" infers the same directions, in the same way, as the reference implementation.
+    """
+
+    expected_directions, expected_directly_infered = reference_kernels.assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N, terminal_tolerance)
+    directions, directly_infered = utils.assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N, terminal_tolerance)
+
+    np.testing.assert_array_equal(directions, expected_directions)
+    np.testing.assert_array_equal(directly_infered, expected_directly_infered)
+
+def random_trip(rng, num_points, dtype):
+    """
+    Distances of a bus going back and forth on a route, with noise, stops and points out of the route.
+    """
+
+    route_length = rng.uniform(5000.0, 30000.0)
+
+    # Alternate the direction of the bus, with some stationary periods
+    steps = rng.exponential(80.0, num_points) * rng.choice([0.0, 1.0], num_points, p=[0.2, 0.8])
+    position = np.cumsum(steps) % (2 * route_length)
+    forward = position < route_length
+
+    gps_distance_dir_0 = np.where(forward, position, 2 * route_length - position) + rng.normal(0.0, 20.0, num_points)
+    gps_distance_dir_1 = route_length - gps_distance_dir_0 + rng.normal(0.0, 20.0, num_points)
+    gps_in_route = rng.random(num_points) > 0.05
+
+    return gps_in_route, gps_distance_dir_0.astype(dtype), gps_distance_dir_1.astype(dtype)
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("N", [1, 2, 3, 5, 6, 50])
+def test_assign_direction_random_trips(dtype, N):
+    rng = np.random.default_rng(N)
+
+    for _ in range(50):
+        gps_in_route, gps_distance_dir_0, gps_distance_dir_1 = random_trip(rng, rng.integers(0, 2000), dtype)
+        assert_same_directions(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N)
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("N", [2, 3, 5, 6, 50])
+def test_assign_direction_tie_at_tolerance(dtype, N):
+    rng = np.random.default_rng(N)
+    num_points = 3000
+
+    # Distances growing by a constant step, so the difference of the means in every window is the tolerance (100 meters)
+    # They start far from zero, where the rounding of the sums is larger, and some of them are moved by a few units in the last place, to fall on both sides of the tolerance
+    step = 200.0 / (N - 1)
+    for offset in (0.0, 1000.0, 25000.0):
+        gps_distance_dir_0 = (offset + step * np.arange(num_points)).astype(dtype)
+        gps_distance_dir_1 = np.full(num_points, offset, dtype=dtype)
+
+        assert_same_directions(np.ones(num_points, dtype=bool), gps_distance_dir_0, gps_distance_dir_1, N, terminal_tolerance=np.inf)
+
+        for _ in range(20):
+            nudged = rng.random(num_points) < 0.3
+            gps_distance_dir_0_nudged = gps_distance_dir_0.copy()
+            gps_distance_dir_0_nudged[nudged] = np.nextafter(gps_distance_dir_0[nudged], rng.choice([-np.inf, np.inf], nudged.sum()).astype(dtype))
+            gps_distance_dir_1_nudged = gps_distance_dir_1.copy()
+            gps_distance_dir_1_nudged[~nudged] = np.nextafter(gps_distance_dir_1[~nudged], rng.choice([-np.inf, np.inf], (~nudged).sum()).astype(dtype))
+
+            # Swapping the directions gives the ties on the negative side
+            assert_same_directions(np.ones(num_points, dtype=bool), gps_distance_dir_0_nudged, gps_distance_dir_1_nudged, N, terminal_tolerance=np.inf)
+            assert_same_directions(np.ones(num_points, dtype=bool), gps_distance_dir_1_nudged, gps_distance_dir_0_nudged, N, terminal_tolerance=np.inf)
+
+@pytest.mark.parametrize("N", [1, 5, 50])
+def test_assign_direction_long_unknown_runs(N):
+    rng = np.random.default_rng(N)
+
+    # Long stretches of stationary points in the route (with unknown direction), each one resolved (or not) by a short trip, and separated by points out of the route
+    stretches = []
+    for _ in range(30):
+        stretch_length = rng.integers(1000, 5000)
+        position = rng.uniform(0.0, 10000.0)
+
+        gps_distance_dir_0 = np.full(stretch_length, position)
+        if rng.random() < 0.7:
+            trip_length = min(rng.integers(N + 1, 4 * N + 10), stretch_length)
+            gps_distance_dir_0[-trip_length:] += rng.choice([-1.0, 1.0]) * np.arange(trip_length) * 150.0
+
+        gps_in_route = np.ones(stretch_length, dtype=bool)
+        gps_in_route[:rng.integers(0, 3)] = False
+
+        stretches.append((gps_in_route, gps_distance_dir_0, 10000.0 - gps_distance_dir_0))
+
+    gps_in_route = np.concatenate([stretch[0] for stretch in stretches])
+    gps_distance_dir_0 = np.concatenate([stretch[1] for stretch in stretches]).astype(np.float32)
+    gps_distance_dir_1 = np.concatenate([stretch[2] for stretch in stretches]).astype(np.float32)
+
+    for terminal_tolerance in (500, np.inf):
+        assert_same_directions(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N, terminal_tolerance)
+
+    # A run that is never resolved, at the end of the data
+    num_points = 20000
+    assert_same_directions(np.ones(num_points, dtype=bool), np.zeros(num_points, dtype=np.float32), np.zeros(num_points, dtype=np.float32), N)
+
+@pytest.mark.parametrize("N", [1, 3, 5])
+def test_assign_direction_not_finite(N):
+    rng = np.random.default_rng(N)
+
+    # Missing (NaN) and infinite distances, as left by points without a projection
+    for _ in range(50):
+        gps_in_route, gps_distance_dir_0, gps_distance_dir_1 = random_trip(rng, rng.integers(0, 1000), np.float32)
+        for distances in (gps_distance_dir_0, gps_distance_dir_1):
+            distances[rng.random(len(distances)) < 0.02] = rng.choice([np.nan, np.inf, -np.inf])
+
+        assert_same_directions(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, N)
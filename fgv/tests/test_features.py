@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from numba import typed
+
+import reference_kernels
+import src.utils as utils
+
+WINDOWS = np.array([1, 3, 5])
+SPEED_COLUMNS = ('mean_speed_1_min', 'mean_speed_3_min', 'mean_speed_5_min')
+
+def random_stops(rng, route_length):
+    """
+    Distances to the stops of the two directions of a route, from its start to its end.
+    """
+
+    return [np.sort(np.concatenate(([0.0, route_length], rng.uniform(0.0, route_length, rng.integers(0, 30))))) for _ in range(2)]
+
+def random_bus(rng, num_points, route_length):
+    """
+    A bus going back and forth on a route, with noise, stops, repeated timestamps and points out of the route.
+
+    Returns:
+        tuple: Arrays of the points in the route, of the distances from the start of each direction and of the timestamps (in seconds).
+    """
+
+    steps = rng.exponential(150.0, num_points) * rng.choice([0.0, 1.0], num_points, p=[0.2, 0.8])
+    position = np.cumsum(steps) % (2 * route_length)
+    forward = position < route_length
+
+    gps_distance_dir_0 = np.where(forward, position, 2 * route_length - position) + rng.normal(0.0, 20.0, num_points)
+    gps_distance_dir_1 = route_length - gps_distance_dir_0 + rng.normal(0.0, 20.0, num_points)
+    gps_in_route = rng.random(num_points) > 0.05
+    gps_timestamps = 1704067200 + np.cumsum(rng.choice([0, 15, 30, 60, 120], num_points, p=[0.05, 0.3, 0.4, 0.2, 0.05])).astype(np.int64)
+
+    return gps_in_route, gps_distance_dir_0.astype(np.float32), gps_distance_dir_1.astype(np.float32), gps_timestamps
+
+def random_route(rng, num_vehicles):
+    """
+    The GPS points of several buses of a route, stored one after the other, with some buses without points.
+
+    Returns:
+        tuple: Arrays of the points of every bus (see "random_bus"), the offsets of the points of each bus, and the distances to the stops of each direction.
+    """
+
+    route_length = rng.uniform(5000.0, 20000.0)
+    buses = [random_bus(rng, rng.choice([0, rng.integers(1, 10), rng.integers(10, 1500)], p=[0.1, 0.2, 0.7]), route_length) for _ in range(num_vehicles)]
+
+    vehicle_offsets = np.zeros(num_vehicles + 1, dtype=np.int64)
+    vehicle_offsets[1:] = np.cumsum([len(bus[0]) for bus in buses])
+    arrays = tuple(np.concatenate([bus[k] for bus in buses]) for k in range(4))
+
+    return arrays, vehicle_offsets, random_stops(rng, route_length)
+
+@pytest.mark.parametrize("companion_features", [False, True])
+def test_compute_bus_features_matches_kernels(companion_features):
+    rng = np.random.default_rng(2 + int(companion_features))
+
+    for _ in range(20):
+        route_length = rng.uniform(5000.0, 20000.0)
+        gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps = random_bus(rng, rng.integers(1, 2000), route_length)
+        stops_distances_by_direction = random_stops(rng, route_length)
+
+        stop_distances, stop_offsets = utils.concatenate_stop_distances(stops_distances_by_direction)
+        features = utils.compute_bus_features(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps, stop_distances, stop_offsets, WINDOWS, companion_features)
+
+        # The same features computed by the separate kernels, as in the previous pipeline (with a list of the stop distances of each direction)
+        direction, direction_directly_infered = reference_kernels.assign_direction(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, 3)
+        distance_traveled, cumulative_distance_traveled, time_traveled, cumulative_time_traveled = utils.assign_distance_traveled(gps_timestamps, gps_in_route, direction, gps_distance_dir_0, gps_distance_dir_1)
+        stops = reference_kernels.assign_stops(gps_in_route, direction, distance_traveled, typed.List(stops_distances_by_direction))
+        speeds = utils.assign_window_speeds(gps_in_route, gps_timestamps, cumulative_distance_traveled, WINDOWS, companion_features)
+
+        expected = (direction, direction_directly_infered, distance_traveled, cumulative_distance_traveled, time_traveled, cumulative_time_traveled) + stops + speeds
+        for name, array, expected_array in zip(utils.BusFeatures._fields, features, expected):
+            np.testing.assert_array_equal(array, expected_array, err_msg=name)
+
+@pytest.mark.parametrize("companion_features", [False, True])
+def test_compute_route_features_matches_buses(companion_features):
+    rng = np.random.default_rng(int(companion_features))
+
+    for _ in range(10):
+        (gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps), vehicle_offsets, stops_distances_by_direction = random_route(rng, rng.integers(1, 8))
+        stop_distances, stop_offsets = utils.concatenate_stop_distances(stops_distances_by_direction)
+
+        # Leave out the points of the first and last vehicles, as the vehicles filtered out of a route
+        filtered_offsets = vehicle_offsets[1:-1] if len(vehicle_offsets) > 2 else vehicle_offsets
+        features = utils.compute_route_features(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps, stop_distances, stop_offsets, WINDOWS, filtered_offsets, companion_features)
+
+        # The features of each vehicle are the same as the ones computed for the vehicle alone
+        for start, end in zip(filtered_offsets[:-1], filtered_offsets[1:]):
+            bus_features = utils.compute_bus_features(gps_in_route[start:end], gps_distance_dir_0[start:end], gps_distance_dir_1[start:end], gps_timestamps[start:end], stop_distances, stop_offsets, WINDOWS, companion_features)
+
+            for name, array, bus_array in zip(utils.BusFeatures._fields, features, bus_features):
+                np.testing.assert_array_equal(array[start:end], bus_array, err_msg=name)
+
+        # The points of the vehicles filtered out keep the default features
+        left_out = np.concatenate((np.arange(filtered_offsets[0]), np.arange(filtered_offsets[-1], len(gps_in_route))))
+        assert np.all(features.direction[left_out] == -1)
+        assert np.all(features.last_stop_index[left_out] == -1)
+        assert np.all(features.cumulative_distance_traveled[left_out] == 0.0)
+        assert np.all(features.mean_speeds[left_out] == 0.0)
+
+        # Without the companion features, their arrays are empty
+        assert len(features.speed_variances) == (len(gps_in_route) if companion_features else 0)
+
+def bus_virtual_inputs(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps, stops_distances_by_direction):
+    """
+    Compute the features of a bus used to generate its virtual datapoints, as in "utils.process_route_data".
+
+    Returns:
+        tuple: Arguments of "virtualize_stop_points" up to the stop distances.
+    """
+
+    stop_distances, stop_offsets = utils.concatenate_stop_distances(stops_distances_by_direction)
+    features = utils.compute_bus_features(gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps, stop_distances, stop_offsets, WINDOWS)
+
+    return (gps_timestamps.astype('datetime64[s]').astype('datetime64[ns]'), gps_in_route, features.direction, features.last_stop_index, features.next_stop_index,
+            features.distance_traveled, features.cumulative_distance_traveled, features.cumulative_time_traveled, features.mean_speeds)
+
+def test_virtualize_stop_points_matches_reference():
+    rng = np.random.default_rng(0)
+
+    num_virtual_points = 0
+    for _ in range(10):
+        (gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps), vehicle_offsets, stops_distances_by_direction = random_route(rng, 5)
+
+        for vehicle, (start, end) in enumerate(zip(vehicle_offsets[:-1], vehicle_offsets[1:])):
+            # The reference can't handle a vehicle without points
+            if end == start:
+                continue
+
+            inputs = bus_virtual_inputs(gps_in_route[start:end], gps_distance_dir_0[start:end], gps_distance_dir_1[start:end], gps_timestamps[start:end], stops_distances_by_direction)
+
+            expected_df = reference_kernels.virtualize_stop_points(*inputs, stops_distances_by_direction, f"v{vehicle}", "100", SPEED_COLUMNS)
+            virtual_df = utils.virtualize_stop_points(*inputs, stops_distances_by_direction, f"v{vehicle}", "100", SPEED_COLUMNS)
+
+            # The reference stores the days as dates, and infers the types of the columns from the lists of values
+            expected_df['data'] = pd.to_datetime(expected_df['data'])
+            pd.testing.assert_frame_equal(virtual_df, expected_df, check_dtype=False, check_index_type=False)
+
+            num_virtual_points += len(virtual_df)
+
+    # The buses must have gone through some stops
+    assert num_virtual_points > 0
+
+def test_virtualize_route_stop_points_matches_buses():
+    rng = np.random.default_rng(1)
+
+    for _ in range(10):
+        (gps_in_route, gps_distance_dir_0, gps_distance_dir_1, gps_timestamps), vehicle_offsets, stops_distances_by_direction = random_route(rng, rng.integers(1, 8))
+        vehicle_ids = [f"v{vehicle}" for vehicle in range(len(vehicle_offsets) - 1)]
+
+        # The features (and so the virtual datapoints) of each bus are computed independently
+        inputs_by_bus = [bus_virtual_inputs(gps_in_route[start:end], gps_distance_dir_0[start:end], gps_distance_dir_1[start:end], gps_timestamps[start:end], stops_distances_by_direction)
+                         for start, end in zip(vehicle_offsets[:-1], vehicle_offsets[1:])]
+        inputs = tuple(np.concatenate([bus_inputs[k] for bus_inputs in inputs_by_bus]) for k in range(len(inputs_by_bus[0])))
+
+        virtual_df, virtual_offsets = utils.virtualize_route_stop_points(*inputs, stops_distances_by_direction, vehicle_ids, "100", vehicle_offsets, SPEED_COLUMNS)
+
+        # The virtual datapoints of each vehicle are the same as the ones generated for the vehicle alone
+        assert virtual_offsets[0] == 0 and virtual_offsets[-1] == len(virtual_df)
+        for vehicle, bus_inputs in enumerate(inputs_by_bus):
+            bus_df = utils.virtualize_stop_points(*bus_inputs, stops_distances_by_direction, vehicle_ids[vehicle], "100", SPEED_COLUMNS)
+            pd.testing.assert_frame_equal(virtual_df.iloc[virtual_offsets[vehicle]:virtual_offsets[vehicle + 1]].reset_index(drop=True), bus_df)
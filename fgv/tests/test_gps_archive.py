@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.gps_handler as gps_handler
+
+def write_gps_csv(file_path, rng, dates, num_records=3000, routes=("100", "200", "300"), buses=12):
+    """
+    Write a GPS export in the format of the pipeline input, with buses switching routes, records out of order, missing coordinates and missing texts.
+    """
+
+    timestamps = np.datetime64(f"{dates[0]}T00:00:00") + np.sort(rng.integers(0, 86400 * len(dates), num_records)).astype('timedelta64[s]')
+    timestamps = timestamps[rng.permutation(num_records) if rng.random() < 0.5 else np.arange(num_records)]
+    bus_ids = np.array([f"A{bus:05d}" for bus in range(buses)])[rng.integers(0, buses, num_records)]
+
+    latitudes = -22.9 + rng.normal(0.0, 0.05, num_records)
+    longitudes = -43.3 + rng.normal(0.0, 0.05, num_records)
+    missing = rng.random(num_records) < 0.02
+    latitudes[missing], longitudes[missing] = np.nan, np.nan
+
+    gps_df = pd.DataFrame({
+        'timestamp_gps': pd.Series(timestamps).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'data': pd.Series(timestamps).dt.strftime('%Y-%m-%d'),
+        'hora': pd.Series(timestamps).dt.strftime('%H:%M:%S'),
+        'id_veiculo': bus_ids,
+        'servico': np.array(routes)[rng.integers(0, len(routes), num_records)],
+        'latitude': latitudes,
+        'longitude': longitudes,
+        'flag_em_movimento': rng.random(num_records) < 0.7,
+        'tipo_parada': np.where(rng.random(num_records) < 0.1, None, rng.choice(["garagem", "terminal", "nao_identificado"], num_records)),
+        'status': rng.choice(["Em operacao", "Parado"], num_records),
+        'velocidade_instantanea': rng.integers(0, 80, num_records),
+        'distancia': rng.exponential(100.0, num_records).round(2),
+        'versao': "v1",
+    })
+    gps_df.to_csv(file_path, index=False)
+
+def assert_same_records(archive_df, csv_df):
+    """
+    Check that the records decoded from the archive are the ones read from the CSV file (with the coordinates rounded to microdegrees).
+    """
+
+    assert list(archive_df.columns) == list(csv_df.columns)
+    assert len(archive_df) == len(csv_df)
+
+    for column in csv_df.columns:
+        if column in ['latitude', 'longitude']:
+            np.testing.assert_allclose(archive_df[column].to_numpy(), csv_df[column].to_numpy(), rtol=0.0, atol=5e-7, err_msg=column)
+        else:
+            pd.testing.assert_series_equal(archive_df[column], csv_df[column], check_dtype=False, check_categorical=False, obj=column)
+
+@pytest.mark.parametrize("dates", [["2024-03-17"], ["2024-03-17", "2024-03-18", "2024-03-19"]])
+def test_gps_archive_round_trip(tmp_path, dates):
+    write_gps_csv(tmp_path / "gps.csv", np.random.default_rng(len(dates)), dates)
+
+    gps = gps_handler.GPSHandler(str(tmp_path))
+    gps.load_file_data("gps.csv")
+
+    archive_name = gps.convert_file(str(tmp_path), "gps.csv")
+    assert archive_name == "gps" + gps_handler.GPS_ARCHIVE_EXTENSION
+    assert os.path.exists(tmp_path / "gps.csv")
+
+    archive_gps = gps_handler.GPSHandler(str(tmp_path))
+    archive_gps.load_file_data(archive_name)
+
+    # A block for each run of records of the same route, bus and date
+    archive = archive_gps.archive
+    assert [column["kind"] for column in archive.columns if column["name"] == 'tipo_parada'] == ["text"]
+    key_codes = np.column_stack([gps.gps_all_df[column].cat.codes.to_numpy() for column in gps_handler.GPS_ARCHIVE_KEY_COLUMNS])
+    num_runs = 1 + np.count_nonzero(np.any(key_codes[1:] != key_codes[:-1], axis=1))
+    assert len(archive.block_counts) == num_runs
+    assert len(np.unique(archive.block_keys['data'])) == len(dates)
+
+    # The routes, buses and their counts are indexed in the same way
+    np.testing.assert_array_equal(archive_gps.get_routes(), gps.get_routes())
+    np.testing.assert_array_equal(archive_gps.get_buses(), gps.get_buses())
+    pd.testing.assert_series_equal(archive_gps.get_routes_count(), gps.get_routes_count())
+
+    for route in gps.get_routes():
+        assert_same_records(archive_gps.get_route_data(route), gps.get_route_data(route))
+
+        buses = gps.show_buses(route)
+        assert archive_gps.show_buses(route) == buses
+
+        for bus in buses:
+            assert_same_records(archive_gps.get_bus_data(bus), gps.get_bus_data(bus))
+
+        # The buses of the route in another order, as a batch
+        buses = buses[::-1]
+        assert_same_records(archive_gps.get_buses_data(buses), gps.get_buses_data(buses))
+        np.testing.assert_array_equal(archive_gps.vehicle_offsets, gps.vehicle_offsets)
+
+    # Without a selected route, the data of a bus in every route
+    archive_gps.route_position = gps.route_position = None
+    for bus in gps.get_buses():
+        assert_same_records(archive_gps.get_bus_data(bus), gps.get_bus_data(bus))
+
+    # A route without data
+    assert len(archive_gps.get_route_data("999")) == 0
+
+def test_gps_archive_missing_coordinates(tmp_path):
+    write_gps_csv(tmp_path / "gps.csv", np.random.default_rng(0), ["2024-03-17"])
+
+    gps = gps_handler.GPSHandler(str(tmp_path))
+    gps.load_file_data("gps.csv")
+    num_blocks, max_coordinate_error = gps_handler.write_gps_archive(gps.gps_all_df, gps.routes, gps.buses, str(tmp_path / "gps.gpsa"))
+
+    assert num_blocks > 0
+    assert max_coordinate_error <= 5e-7
+
+    # The missing coordinates are decoded as missing, and the others within the rounding error
+    archive = gps_handler.GPSArchive(str(tmp_path / "gps.gpsa"))
+    records = archive.read_records(0, len(gps.gps_all_df))
+    assert gps.gps_all_df['latitude'].isna().sum() > 0
+    for column in ['latitude', 'longitude']:
+        np.testing.assert_array_equal(records[column].isna(), gps.gps_all_df[column].isna())
+    assert_same_records(records, gps.gps_all_df)
+
+    # Ranges of records across and within blocks
+    for start, end in [(0, 0), (0, 1), (5, 500), (len(records) - 1, len(records))]:
+        assert_same_records(archive.read_records(start, end), gps.gps_all_df.iloc[start:end].reset_index(drop=True))
+
+def test_gps_archive_missing_timestamps(tmp_path):
+    write_gps_csv(tmp_path / "gps.csv", np.random.default_rng(0), ["2024-03-17"], num_records=100)
+
+    # Remove the timestamp of a record
+    gps_df = pd.read_csv(tmp_path / "gps.csv", dtype=str)
+    gps_df.loc[10, 'timestamp_gps'] = np.nan
+    gps_df.to_csv(tmp_path / "gps.csv", index=False)
+
+    gps = gps_handler.GPSHandler(str(tmp_path))
+    with pytest.raises(ValueError):
+        gps.convert_file(str(tmp_path), "gps.csv")
+
+    # No archive (or temporary file) is left
+    assert sorted(os.listdir(tmp_path)) == ["gps.csv"]
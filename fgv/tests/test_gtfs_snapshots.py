@@ -0,0 +1,85 @@
+import os
+
+import src.gtfs_handler as gtfs_handler
+import src.utils as utils
+
+def write_route_tables(folder):
+    """
+    Write the GTFS tables the routes are built from, with a single route of one trip.
+    """
+
+    tables = {
+        "routes.txt": "route_id,route_short_name\nr0,100\n",
+        "trips.txt": "trip_id,route_id,direction_id,shape_id\nt0,r0,0,s0\n",
+        "stop_times.txt": "trip_id,stop_id,stop_sequence,shape_dist_traveled\nt0,p0,1,0.0\nt0,p1,2,100.0\n",
+        "stops.txt": "stop_id,stop_name,stop_lat,stop_lon\np0,P0,-22.9,-43.3\np1,P1,-22.9,-43.299\n",
+        "shapes.txt": "shape_id,shape_pt_sequence,shape_pt_lat,shape_pt_lon,shape_dist_traveled\ns0,1,-22.9,-43.3,0.0\ns0,2,-22.9,-43.299,100.0\n",
+    }
+    for file_name, text in tables.items():
+        with open(f"{folder}/{file_name}", "w") as file:
+            file.write(text)
+
+def count_hashed_files(monkeypatch):
+    """
+    Count the files read by "utils.hash_files", by name.
+    """
+
+    hashed_files = []
+    hash_files = utils.hash_files
+
+    def counting_hash_files(file_paths, *args, **kwargs):
+        hashed_files.extend(os.path.basename(file_path) for file_path in file_paths)
+        return hash_files(file_paths, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "hash_files", counting_hash_files)
+
+    return hashed_files
+
+def test_gtfs_file_hashes_cached(tmp_path, monkeypatch):
+    write_route_tables(tmp_path)
+    hashed_files = count_hashed_files(monkeypatch)
+
+    # Each table file is hashed once by a handler, however many times its hash is used
+    gtfs = gtfs_handler.GTFSHandler(str(tmp_path))
+    route_data_hash = gtfs.get_route_data_hash()
+    route_arrays_path = gtfs.get_route_arrays_path()
+    for table_name in gtfs_handler.GTFS_ROUTE_TABLES:
+        getattr(gtfs, table_name)
+    assert gtfs.get_route_data_hash() == route_data_hash
+    assert sorted(hashed_files) == sorted(gtfs_handler.GTFS_TABLES[table_name]["file"] for table_name in gtfs_handler.GTFS_ROUTE_TABLES)
+
+    # The hashes are the ones of the files
+    for table_name in gtfs_handler.GTFS_ROUTE_TABLES:
+        file_name = gtfs_handler.GTFS_TABLES[table_name]["file"]
+        assert gtfs.get_file_hash(file_name) == utils.hash_files([f"{tmp_path}/{file_name}"])
+    hashed_files.clear()
+
+    # Another handler (as the next run) reads the hashes cached in the snapshot folder, and loads the same snapshots
+    gtfs = gtfs_handler.GTFSHandler(str(tmp_path))
+    assert gtfs.get_route_data_hash() == route_data_hash
+    assert gtfs.get_route_arrays_path() == route_arrays_path
+    assert len(gtfs.routes) == 1
+    assert hashed_files == []
+
+    # A changed file is hashed again, and leads to a new snapshot
+    with open(f"{tmp_path}/routes.txt", "a") as file:
+        file.write("r1,200\n")
+
+    gtfs = gtfs_handler.GTFSHandler(str(tmp_path))
+    assert gtfs.get_route_data_hash() != route_data_hash
+    assert list(gtfs.routes["route_short_name"]) == ["100", "200"]
+    assert hashed_files == ["routes.txt"]
+
+def test_gtfs_file_hashes_without_snapshots(tmp_path, monkeypatch):
+    write_route_tables(tmp_path)
+    hashed_files = count_hashed_files(monkeypatch)
+
+    # Without snapshots, the hashes are only cached by the handler, and nothing is written to the snapshot folder
+    gtfs = gtfs_handler.GTFSHandler(str(tmp_path), use_snapshot=False)
+    route_data_hash = gtfs.get_route_data_hash()
+    assert gtfs.get_route_data_hash() == route_data_hash
+    assert len(hashed_files) == len(gtfs_handler.GTFS_ROUTE_TABLES)
+    assert not os.path.exists(f"{tmp_path}/.snapshots")
+
+    # The hashes are the same as with snapshots
+    assert gtfs_handler.GTFSHandler(str(tmp_path)).get_route_data_hash() == route_data_hash
@@ -0,0 +1,74 @@
+import json
+
+import preprocess_data
+import src.manifest_handler as manifest_handler
+
+SIGNATURE = {"gps_hash": "a" * 32, "gtfs_hash": "b" * 32, "pipeline_version": "1-c"}
+
+def test_manifest_unit_statuses(tmp_path):
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    manifest = manifest_handler.ManifestHandler(manifest_path)
+
+    # Without a manifest file, every unit is new
+    assert manifest.get_unit_status("2024-03-17", "100", "A1", SIGNATURE) == "new"
+
+    # A unit started and never finished is incomplete, even with the same data
+    manifest.record_units("2024-03-17", "100", ["A1", "A2", "A3"], "started", SIGNATURE)
+    assert manifest.get_unit_status("2024-03-17", "100", "A1", SIGNATURE) == "incomplete"
+
+    # A unit finished (or skipped because of an error) from the same data is processed
+    manifest.record_units("2024-03-17", "100", ["A1", "A2"], "done", SIGNATURE)
+    manifest.record_units("2024-03-17", "100", ["A3"], "failed", SIGNATURE)
+    for bus in ["A1", "A2", "A3"]:
+        assert manifest.get_unit_status("2024-03-17", "100", bus, SIGNATURE) == "processed"
+
+    # From other data, or by another pipeline version, it's outdated
+    for key in SIGNATURE:
+        assert manifest.get_unit_status("2024-03-17", "100", "A1", {**SIGNATURE, key: "other"}) == "outdated"
+
+    # The units are identified by day, route and bus
+    assert manifest.get_unit_status("2024-03-18", "100", "A1", SIGNATURE) == "new"
+    assert manifest.get_unit_status("2024-03-17", "200", "A1", SIGNATURE) == "new"
+    assert manifest.get_unit_status("2024-03-17", 100, "A1", SIGNATURE) == "processed"
+
+    # Only the units with their data written are done
+    assert manifest.get_done_units("100") == [("2024-03-17", "A1"), ("2024-03-17", "A2")]
+
+    # Processing a unit again makes it incomplete until it's finished
+    manifest.record_units("2024-03-17", "100", ["A1"], "started", {**SIGNATURE, "gps_hash": "other"})
+    assert manifest.get_unit_status("2024-03-17", "100", "A1", SIGNATURE) == "incomplete"
+    assert manifest.get_done_units("100") == [("2024-03-17", "A2")]
+
+    # The last record of each unit is loaded back from the file
+    reloaded = manifest_handler.ManifestHandler(manifest_path)
+    assert reloaded.units == manifest.units
+
+def test_manifest_interrupted_write(tmp_path):
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest = manifest_handler.ManifestHandler(str(manifest_path))
+    manifest.record_units("2024-03-17", "100", ["A1", "A2"], "started", SIGNATURE)
+
+    # A record left incomplete by an interrupted run is skipped, keeping the previous record of the unit
+    record = json.dumps({"day": "2024-03-17", "route": "100", "bus": "A1", "status": "done", **SIGNATURE})
+    with open(manifest_path, "a") as manifest_file:
+        manifest_file.write(record[:len(record) // 2])
+
+    reloaded = manifest_handler.ManifestHandler(str(manifest_path))
+    assert reloaded.get_unit_status("2024-03-17", "100", "A1", SIGNATURE) == "incomplete"
+    assert reloaded.get_unit_status("2024-03-17", "100", "A2", SIGNATURE) == "incomplete"
+
+def test_bus_statuses_output_folders(tmp_path):
+    manifest = manifest_handler.ManifestHandler(str(tmp_path / "manifest.jsonl"))
+    route_output_path = f"{tmp_path}/2024-03-17/100/"
+    buses = ["A1", "A2", "A3", "A4", "A5", "A6"]
+
+    # A1 is done with its folder, A2 is done without its folder, A3 has a folder without a record, A4 is new, A5 is outdated and A6 was started
+    manifest.record_units("2024-03-17", "100", ["A1", "A2", "A6"], "started", SIGNATURE)
+    manifest.record_units("2024-03-17", "100", ["A1", "A2"], "done", SIGNATURE)
+    manifest.record_units("2024-03-17", "100", ["A5"], "done", {**SIGNATURE, "pipeline_version": "0-c"})
+    for bus in ["A1", "A3", "A5", "A6"]:
+        (tmp_path / "2024-03-17" / "100" / bus).mkdir(parents=True)
+
+    bus_statuses = preprocess_data.get_bus_statuses(manifest, "2024-03-17", "100", buses, route_output_path, SIGNATURE)
+
+    assert bus_statuses == {"A1": "processed", "A2": "incomplete", "A3": "incomplete", "A4": "new", "A5": "outdated", "A6": "incomplete"}
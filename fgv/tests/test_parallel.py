@@ -0,0 +1,79 @@
+import numba
+import numpy as np
+import pytest
+
+import src.utils as utils
+
+from conftest import random_route_segments
+
+# Numbers of threads tested (up to the number launched by numba)
+THREAD_COUNTS = [1, 2, 3, 4]
+
+@pytest.fixture(params=THREAD_COUNTS)
+def num_threads(request):
+    """
+    Number of threads used by the parallel kernels during the test, restoring the previous number after it.
+    """
+
+    if request.param > numba.config.NUMBA_NUM_THREADS:
+        pytest.skip(f"Only {numba.config.NUMBA_NUM_THREADS} threads available to numba")
+
+    previous_num_threads = numba.get_num_threads()
+    yield utils.set_num_threads(request.param)
+    numba.set_num_threads(previous_num_threads)
+
+def random_points(rng, route_segments, num_points):
+    """
+    Points around a route (as noisy GPS data), along with some points far from it and points on the segment ends.
+    """
+
+    points = route_segments[rng.integers(0, len(route_segments), num_points), 0].astype(np.float64) + rng.normal(0.0, 100.0, (num_points, 2))
+    far_points = rng.uniform(-1e6, 1e6, (100, 2))
+    segment_ends = route_segments.reshape(-1, 2)[:100].astype(np.float64)
+
+    return np.concatenate([points, far_points, segment_ends])
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_closest_projection_parallel(num_threads, indexed):
+    rng = np.random.default_rng(num_threads)
+    route_segments, _ = random_route_segments(rng, 1000)
+    segment_grid = utils.build_segment_grid(route_segments) if indexed else None
+
+    points = random_points(rng, route_segments, 20000)
+
+    expected = utils.closest_projection(points, route_segments, segment_grid)
+    result = utils.closest_projection_parallel(points, route_segments, segment_grid)
+
+    # The results must be bit-identical to the serial kernel, whatever the number of threads
+    for expected_array, array in zip(expected, result):
+        assert array.dtype == expected_array.dtype
+        assert np.array_equal(array, expected_array)
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_closest_projection_with_distance_parallel(num_threads, indexed):
+    rng = np.random.default_rng(num_threads)
+    route_segments, segment_distances = random_route_segments(rng, 1000)
+    segment_grid = utils.build_segment_grid(route_segments) if indexed else None
+
+    points = random_points(rng, route_segments, 20000)
+
+    expected = utils.closest_projection_with_distance(points, route_segments, segment_distances, segment_grid)
+    result = utils.closest_projection_with_distance_parallel(points, route_segments, segment_distances, segment_grid)
+
+    # The results must be bit-identical to the serial kernel, whatever the number of threads
+    for expected_array, array in zip(expected, result):
+        assert array.dtype == expected_array.dtype
+        assert np.array_equal(array, expected_array)
+
+def test_set_num_threads():
+    previous_num_threads = numba.get_num_threads()
+
+    # The number of threads is capped by the number launched by numba
+    assert utils.set_num_threads(1) == 1
+    assert utils.set_num_threads(numba.config.NUMBA_NUM_THREADS + 1) == numba.config.NUMBA_NUM_THREADS
+    assert utils.set_num_threads() == numba.config.NUMBA_NUM_THREADS
+
+    with pytest.raises(AssertionError):
+        utils.set_num_threads(0)
+
+    numba.set_num_threads(previous_num_threads)
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import src.utils as utils
+
+from conftest import random_route_segments
+
+def assert_same_projection(points, route_segments):
+    """
+    Check that the indexed search finds the same segments and distances as the brute force search.
+    """
+
+    segment_grid = utils.build_segment_grid(route_segments)
+
+    expected_distances, expected_indexes = utils.closest_projection_brute_force(points, route_segments)
+    distances, indexes = utils.closest_projection_indexed(points, route_segments, segment_grid)
+
+    np.testing.assert_array_equal(indexes, expected_indexes)
+    np.testing.assert_array_equal(distances, expected_distances)
+
+    # The dispatching kernel must use the index when it's given
+    distances, indexes = utils.closest_projection(points, route_segments, segment_grid)
+    np.testing.assert_array_equal(indexes, expected_indexes)
+    np.testing.assert_array_equal(distances, expected_distances)
+
+@pytest.mark.parametrize("num_segments", [1, 2, 10, 500])
+def test_indexed_random_points(num_segments):
+    rng = np.random.default_rng(num_segments)
+    route_segments, _ = random_route_segments(rng, num_segments)
+
+    # Points around the route, spread a bit beyond its bounding box
+    low, high = route_segments.reshape(-1, 2).min(axis=0), route_segments.reshape(-1, 2).max(axis=0)
+    margin = 0.2 * (high - low) + 10.0
+    points = rng.uniform(low - margin, high + margin, (2000, 2))
+
+    assert_same_projection(points, route_segments)
+
+def test_indexed_points_far_outside_grid():
+    rng = np.random.default_rng(1)
+    route_segments, _ = random_route_segments(rng, 300)
+
+    # Points far from the route in every direction (including along the axes of the grid)
+    center = route_segments.reshape(-1, 2).mean(axis=0)
+    angles = np.linspace(0.0, 2 * np.pi, 64, endpoint=False)
+    points = np.concatenate([center + radius * np.column_stack((np.cos(angles), np.sin(angles))) for radius in (1e4, 1e5, 1e6)])
+
+    assert_same_projection(points, route_segments)
+
+def test_indexed_points_on_cell_borders():
+    rng = np.random.default_rng(2)
+    route_segments, _ = random_route_segments(rng, 300)
+
+    origin_x, origin_y, cell_size, num_cells_x, num_cells_y, _, _ = utils.build_segment_grid(route_segments)
+
+    # Points on the corners and on the middle of the edges of the cells (and of the cells just outside the grid)
+    border_x = origin_x + cell_size * np.arange(-1, num_cells_x + 2)
+    border_y = origin_y + cell_size * np.arange(-1, num_cells_y + 2)
+    corners = np.stack(np.meshgrid(border_x, border_y), axis=-1).reshape(-1, 2)
+    edges_x = np.stack(np.meshgrid(border_x, border_y + cell_size / 2), axis=-1).reshape(-1, 2)
+    edges_y = np.stack(np.meshgrid(border_x + cell_size / 2, border_y), axis=-1).reshape(-1, 2)
+
+    assert_same_projection(np.concatenate([corners, edges_x, edges_y]), route_segments)
+
+def test_indexed_points_on_segment_ends():
+    rng = np.random.default_rng(3)
+    route_segments, _ = random_route_segments(rng, 300)
+
+    # The ends of consecutive segments are at the same distance of both segments, so the smallest index must win
+    points = route_segments.reshape(-1, 2).astype(np.float64)
+
+    assert_same_projection(points, route_segments)
+
+def test_indexed_empty_segments():
+    route_segments = np.empty((0, 2, 2), dtype=np.float32)
+    segment_distances = np.empty((0, 2), dtype=np.float32)
+    points = np.array([[0.0, 0.0], [1e6, -1e6]])
+
+    # The grid of no segments has no candidates, so every point is at an infinite distance (as in the brute force search)
+    segment_grid = utils.build_segment_grid(route_segments)
+    assert_same_projection(points, route_segments)
+
+    min_distances, closest_segment_indexes, _, distances_from_start = utils.closest_projection_with_distance(points, route_segments, segment_distances, segment_grid)
+    assert np.all(np.isinf(min_distances))
+    np.testing.assert_array_equal(closest_segment_indexes, 0)
+    np.testing.assert_array_equal(distances_from_start, 0)
+
+def test_indexed_gtfs_shapes(gtfs_shapes):
+    rng = np.random.default_rng(4)
+
+    # A sample of the shapes, with points scattered around them (as noisy GPS data)
+    shape_ids = rng.choice(gtfs_shapes["shape_id"].cat.categories, 20, replace=False)
+    for shape_id in shape_ids:
+        shape = gtfs_shapes[gtfs_shapes["shape_id"] == shape_id]
+        route_segments, _ = utils.build_shape_segments(shape[["x", "y"]].to_numpy(np.float32), shape["shape_dist_traveled"].to_numpy(np.float32), np.zeros(len(shape), dtype=np.int64))
+
+        points = shape[["x", "y"]].to_numpy()[rng.integers(0, len(shape), 1000)] + rng.normal(0.0, 200.0, (1000, 2))
+
+        assert_same_projection(points, route_segments)
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import preprocess_data
+import src.gtfs_handler as gtfs_handler
+import src.utils as utils
+
+# Tolerances in meters checked (along with the one set in the pipeline)
+TOLERANCES = sorted({1.0, 2.0, 5.0, 10.0} | ({preprocess_data.SHAPE_SIMPLIFY_TOLERANCE} if preprocess_data.SHAPE_SIMPLIFY_TOLERANCE is not None else set()))
+
+def dense_shapes(rng, num_shapes, num_points, spacing=5.0, noise=0.5):
+    """
+    Shapes sampled every few meters along smooth random curves, with noise, as over-sampled GTFS shapes.
+
+    Returns:
+        tuple: Arrays of the shape points with shape (N, 2), of the distance traveled up to each point and of the shape id of each point.
+    """
+
+    shape_points, shape_distances, shape_ids = [], [], []
+    for shape_id in range(num_shapes):
+        headings = np.cumsum(rng.normal(0.0, 0.05, num_points))
+        points = np.cumsum(spacing * np.column_stack((np.cos(headings), np.sin(headings))), axis=0) + rng.normal(0.0, noise, (num_points, 2))
+
+        shape_points.append(points)
+        shape_distances.append(np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T)))))
+        shape_ids.append(np.full(num_points, shape_id))
+
+    return np.concatenate(shape_points), np.concatenate(shape_distances), np.concatenate(shape_ids)
+
+def assert_simplification_within_tolerance(shape_points, shape_distances, shape_ids, tolerance):
+    """
+    Check the points kept by the simplification, and that the distance error it introduces is within the tolerance.
+    """
+
+    keep = utils.simplify_shapes(shape_points, shape_distances, shape_ids, tolerance)
+
+    # The first and last points of each shape are kept
+    first = np.concatenate(([True], shape_ids[1:] != shape_ids[:-1]))
+    last = np.concatenate((shape_ids[1:] != shape_ids[:-1], [True]))
+    assert np.all(keep[first]) and np.all(keep[last])
+
+    # Every removed point is within the tolerance from the segment between the points kept around it
+    kept_indexes = np.flatnonzero(keep)
+    for i in np.flatnonzero(~keep):
+        previous = kept_indexes[np.searchsorted(kept_indexes, i) - 1]
+        following = kept_indexes[np.searchsorted(kept_indexes, i)]
+        assert utils.squared_distance_to_segment(*shape_points[i], *shape_points[previous], *shape_points[following]) <= tolerance * tolerance
+
+    # The distances interpolated on the simplified shapes are within the tolerance from the original ones
+    distance_error = utils.simplification_distance_error(shape_points, shape_distances, keep)
+    assert distance_error <= tolerance
+
+    return keep.sum(), distance_error
+
+@pytest.mark.parametrize("tolerance", TOLERANCES)
+def test_simplification_dense_shapes(tolerance):
+    rng = np.random.default_rng(int(tolerance))
+    shape_points, shape_distances, shape_ids = dense_shapes(rng, 5, 2000)
+
+    num_kept, _ = assert_simplification_within_tolerance(shape_points, shape_distances, shape_ids, tolerance)
+
+    # The over-sampled shapes are reduced
+    assert num_kept < len(shape_points) / 2
+
+def zig_zag_shape():
+    """
+    A shape zig-zagging 4 meters every meter for 100 meters, followed by 100 meters of straight line.
+    Every point is within 5 meters from the segment between the ends, but the distance traveled along the zig-zag is about 4 times longer.
+    """
+
+    x = np.arange(201, dtype=np.float64)
+    y = np.where((np.arange(201) % 2 == 1) & (np.arange(201) <= 100), 4.0, 0.0)
+    shape_points = np.column_stack((x, y))
+    shape_distances = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(shape_points, axis=0).T))))
+
+    return shape_points, shape_distances, np.zeros(201, dtype=np.int64)
+
+def test_simplification_zig_zag():
+    shape_points, shape_distances, shape_ids = zig_zag_shape()
+
+    # The points are all within the tolerance from the straight line, so the distance error is what keeps the zig-zag points
+    num_kept, distance_error = assert_simplification_within_tolerance(shape_points, shape_distances, shape_ids, 5.0)
+    assert num_kept > 2
+    assert distance_error <= 5.0
+
+    # With a tolerance above the whole distance difference, only the ends are kept
+    num_kept, _ = assert_simplification_within_tolerance(shape_points, shape_distances, shape_ids, 1000.0)
+    assert num_kept == 2
+
+def test_simplification_uneven_distances():
+    # A straight shape whose distances traveled don't grow evenly along it (as "shape_dist_traveled" values measured on another geometry)
+    x = np.linspace(0.0, 1000.0, 101)
+    shape_points = np.column_stack((x, np.zeros(101)))
+    shape_distances = 1000.0 * (x / 1000.0) ** 2
+
+    num_kept, _ = assert_simplification_within_tolerance(shape_points, shape_distances, np.zeros(101, dtype=np.int64), 5.0)
+    assert 2 < num_kept < 101
+
+@pytest.mark.parametrize("tolerance", TOLERANCES)
+def test_simplification_gtfs_shapes(gtfs_shapes, tolerance):
+    shape_points = gtfs_shapes[["x", "y"]].to_numpy()
+    shape_distances = gtfs_shapes["shape_dist_traveled"].to_numpy(np.float64)
+    shape_ids = gtfs_shapes["shape_id"].cat.codes.to_numpy()
+
+    assert_simplification_within_tolerance(shape_points, shape_distances, shape_ids, tolerance)
+
+def write_gtfs(folder, rng):
+    """
+    Write a small GTFS feed, with two routes of two directions each, with over-sampled shapes.
+    """
+
+    shape_points, shape_distances, shape_ids = dense_shapes(rng, 4, 500)
+    longitudes, latitudes = utils.PROJECTION_ORIGIN[0] + shape_points[:, 0] / 102000.0, utils.PROJECTION_ORIGIN[1] + shape_points[:, 1] / 111000.0
+    shape_names = np.array(["s0", "s1", "s2", "s3"])[shape_ids]
+
+    pd.DataFrame({"shape_id": shape_names, "shape_pt_sequence": np.concatenate([np.arange(500)] * 4) + 1, "shape_pt_lat": latitudes, "shape_pt_lon": longitudes,
+                  "shape_dist_traveled": shape_distances}).to_csv(f"{folder}/shapes.txt", index=False)
+    pd.DataFrame({"route_id": ["r0", "r1"], "route_short_name": ["100", "200"]}).to_csv(f"{folder}/routes.txt", index=False)
+    pd.DataFrame({"trip_id": ["t0", "t1", "t2", "t3"], "route_id": ["r0", "r0", "r1", "r1"], "direction_id": [0, 1, 0, 1], "shape_id": ["s0", "s1", "s2", "s3"]}).to_csv(f"{folder}/trips.txt", index=False)
+
+    # A stop at the start and at the end of each shape
+    stop_positions = np.flatnonzero(np.diff(np.concatenate(([-1], shape_ids, [-1]))) != 0)
+    stop_positions = np.sort(np.concatenate((stop_positions[:-1], stop_positions[1:] - 1)))
+    stop_ids = [f"p{i}" for i in range(len(stop_positions))]
+    pd.DataFrame({"stop_id": stop_ids, "stop_name": stop_ids, "stop_lat": latitudes[stop_positions], "stop_lon": longitudes[stop_positions]}).to_csv(f"{folder}/stops.txt", index=False)
+    pd.DataFrame({"trip_id": np.repeat(["t0", "t1", "t2", "t3"], 2), "stop_id": stop_ids, "stop_sequence": np.tile([1, 2], 4),
+                  "shape_dist_traveled": shape_distances[stop_positions]}).to_csv(f"{folder}/stop_times.txt", index=False)
+
+def test_simplification_report(tmp_path):
+    write_gtfs(tmp_path, np.random.default_rng(0))
+
+    gtfs = gtfs_handler.GTFSHandler(str(tmp_path), use_snapshot=False, simplify_tolerance_meters=2.0)
+    report = gtfs.get_simplification_report()
+
+    # Each route has two shapes of 499 segments, reduced by the simplification, within the tolerance
+    assert list(report.index) == ["100", "200"]
+    assert np.all(report["num_segments"] == 2 * 499)
+    assert np.all(report["num_simplified_segments"] < report["num_segments"])
+    assert np.all(report["reduction"] > 1.0)
+    assert np.all(report["max_distance_error"] <= 2.0)
+
+    # The segments of each direction are built from the simplified shapes
+    gtfs.filter_by_route("100")
+    num_simplified_segments = sum(len(gtfs.get_route_segments_by_direction(direction_id)) for direction_id in gtfs.get_route_directions())
+    assert num_simplified_segments == report.loc["100", "num_simplified_segments"]
+
+    # Without simplification, the segments are the same
+    report = gtfs_handler.GTFSHandler(str(tmp_path), use_snapshot=False).get_simplification_report()
+    assert np.all(report["num_simplified_segments"] == report["num_segments"])
+    assert np.all(report["reduction"] == 1.0)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import src.utils as utils
+
+WINDOWS = [0, 1, 3, 5, 17]
+
+def random_trip(rng, num_points, ascending=True):
+    """
+    Timestamps (in seconds) and cumulative distances of a bus, with repeated timestamps, stops and points out of the route.
+    """
+
+    time_steps = rng.choice([0, 10, 15, 30, 60, 120, 600], num_points, p=[0.05, 0.2, 0.3, 0.3, 0.1, 0.04, 0.01])
+    gps_timestamps = 1704067200 + np.cumsum(time_steps).astype(np.int64)
+
+    if not ascending:
+        # Swap some pairs of consecutive timestamps, as in data sent out of order
+        swapped = np.flatnonzero(rng.random(max(num_points - 1, 0)) < 0.05)
+        gps_timestamps[swapped], gps_timestamps[swapped + 1] = gps_timestamps[swapped + 1], gps_timestamps[swapped].copy()
+
+    gps_cumulative_distance = np.cumsum(rng.exponential(100.0, num_points) * rng.choice([0.0, 1.0], num_points, p=[0.3, 0.7]))
+    gps_in_route = rng.random(num_points) > 0.05
+
+    return gps_in_route, gps_timestamps, gps_cumulative_distance
+
+@pytest.mark.parametrize("ascending", [True, False])
+@pytest.mark.parametrize("companion_features", [False, True])
+def test_assign_window_speeds_matches_mean_speed(ascending, companion_features):
+    rng = np.random.default_rng(int(ascending) + 2 * int(companion_features))
+
+    for num_points in [0, 1, 2, 10, 1000, 5000]:
+        gps_in_route, gps_timestamps, gps_cumulative_distance = random_trip(rng, num_points, ascending)
+
+        mean_speeds, _, _ = utils.assign_window_speeds(gps_in_route, gps_timestamps, gps_cumulative_distance, np.array(WINDOWS), companion_features)
+
+        # Each window must have the same mean speeds as the kernel of a single window
+        assert mean_speeds.shape == (num_points, len(WINDOWS))
+        for w, window in enumerate(WINDOWS):
+            expected_speeds = utils.assign_mean_speed(gps_in_route, gps_timestamps, gps_cumulative_distance, window)
+            np.testing.assert_array_equal(mean_speeds[:, w], expected_speeds)
+
+def test_assign_window_speeds_companion_features():
+    # The bus runs at 36 km/h for a minute, stops for a minute, and runs at 36 km/h again, then the last point is out of the route
+    gps_timestamps = np.array([0, 60, 120, 180, 240], dtype=np.int64)
+    gps_cumulative_distance = np.array([0.0, 600.0, 600.0, 1200.0, 1800.0])
+    gps_in_route = np.array([True, True, True, True, False])
+
+    mean_speeds, speed_variances, stop_fractions = utils.assign_window_speeds(gps_in_route, gps_timestamps, gps_cumulative_distance, np.array([1, 3]), companion_features=True)
+
+    # Window of 1 minute: the speed between the last two points
+    np.testing.assert_allclose(mean_speeds[:, 0], [0.0, 36.0, 0.0, 36.0, 0.0])
+    np.testing.assert_allclose(speed_variances[:, 0], [0.0, 0.0, 0.0, 0.0, 0.0], atol=1e-9)
+    np.testing.assert_allclose(stop_fractions[:, 0], [0.0, 0.0, 1.0, 0.0, 0.0])
+
+    # Window of 3 minutes (from the first point): speeds of 36 and 0 km/h at 120 s (mean 18, variance 324), and 36, 0 and 36 km/h at 180 s (mean 24, variance 288)
+    np.testing.assert_allclose(mean_speeds[:, 1], [0.0, 36.0, 18.0, 24.0, 0.0])
+    np.testing.assert_allclose(speed_variances[:, 1], [0.0, 0.0, 324.0, 288.0, 0.0], atol=1e-9)
+    np.testing.assert_allclose(stop_fractions[:, 1], [0.0, 0.0, 1 / 2, 1 / 3, 0.0])
+
+    # Without the companion features, their arrays are empty
+    _, speed_variances, stop_fractions = utils.assign_window_speeds(gps_in_route, gps_timestamps, gps_cumulative_distance, np.array([1, 3]))
+    assert speed_variances.shape == (0, 2)
+    assert stop_fractions.shape == (0, 2)
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import src.gps_handler as gps_handler
+
+def write_gps_export(file_path, rng, num_records=100):
+    """
+    Write a multi-day GPS export, with the dates of the records interleaved (so each date recurs across the chunks) and missing values.
+    """
+
+    dates = rng.choice(["2024-03-17", "2024-03-18", "2024-03-19"], num_records, p=[0.5, 0.3, 0.2])
+    hours = [f"{hour:02d}:{minute:02d}:00" for hour, minute in zip(rng.integers(0, 24, num_records), rng.integers(0, 60, num_records))]
+
+    pd.DataFrame({
+        'timestamp_gps': [f"{date} {hour}" for date, hour in zip(dates, hours)],
+        'data': dates,
+        'hora': hours,
+        'id_veiculo': [f"A{bus:05d}" for bus in rng.integers(0, 5, num_records)],
+        'servico': rng.choice(["100", "200", "0100"], num_records),
+        'latitude': np.where(rng.random(num_records) < 0.05, np.nan, -22.9 + rng.normal(0.0, 0.05, num_records)),
+        'longitude': -43.3 + rng.normal(0.0, 0.05, num_records),
+        'tipo_parada': np.where(rng.random(num_records) < 0.2, "", "garagem"),
+    }).to_csv(file_path, index=False)
+
+def split_into_folder(folder, rng_seed, chunk_size):
+    """
+    Write the same export into a folder and split it with the given chunk size.
+
+    Returns:
+        dict: Text of the file of each date.
+    """
+
+    os.makedirs(folder)
+    write_gps_export(f"{folder}/gps.csv", np.random.default_rng(rng_seed))
+
+    gps = gps_handler.GPSHandler(str(folder))
+    gps.split_file(str(folder), "gps.csv", chunk_size=chunk_size)
+
+    files = {}
+    for file_name in sorted(os.listdir(folder)):
+        with open(f"{folder}/{file_name}") as date_file:
+            files[file_name] = date_file.read()
+
+    return files
+
+def test_split_file_chunks(tmp_path):
+    files = split_into_folder(tmp_path / "single", 0, chunk_size=1000)
+    chunked_files = split_into_folder(tmp_path / "chunked", 0, chunk_size=7)
+
+    # The original file is deleted, and a file is written for each date
+    assert sorted(files) == ["2024-03-17.csv", "2024-03-18.csv", "2024-03-19.csv"]
+
+    # Reading the file in chunks of 7 records gives the same files as reading it at once (with a single header, and the records in their order)
+    assert chunked_files == files
+
+    # The records of each date are the ones of the export, unchanged (with the ids as text and the missing values kept)
+    write_gps_export(tmp_path / "gps.csv", np.random.default_rng(0))
+    export = pd.read_csv(tmp_path / "gps.csv", dtype=str, keep_default_na=False)
+    for date, date_records in export.groupby('data', sort=False):
+        pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "single" / f"{date}.csv", dtype=str, keep_default_na=False), date_records.reset_index(drop=True))